@@ -0,0 +1,488 @@
+"""Offline benchmarks for the parsers. 'record' saves Paninishop and Halopedia pages as
+fixtures once, 'run' measures the parsers on them (records per second, latency percentiles
+and allocations) and compares the results with a saved baseline. 'log' and 'pool' measure the
+overhead of a log call and of sending tasks to the process pool.
+
+The fixtures in the repository are small pages in the markup of both sites, recorded from a
+local test server so 'run' works on a fresh checkout; 'record' replaces them with real pages
+(save a new baseline with 'run --save' afterwards).
+"""
+
+import argparse
+import datetime
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import typing
+
+import bs4
+
+import comics
+import fetch
+import halo_novels
+import http_cache
+import log_transport
+import worker_pool
+
+HALO_URL = "https://www.halopedia.org/"
+
+
+class Fixtures:
+    """Recorded pages, saved as '<directory>/<kind>/<number>.html' with a manifest
+    ('<directory>/manifest.json') that lists the urls of every kind.
+    """
+
+    KINDS = ("checklist", "product", "novels", "novel")
+
+    def __init__(self, directory: str = "fixtures") -> None:
+        """Initialize the fixtures.
+
+        Arguments:
+            - directory: directory of the fixtures.
+
+        Returns:
+            Nothing.
+        """
+        self.directory = directory
+        self.manifest: dict[str, list[str]] = {kind: [] for kind in self.KINDS}
+        if os.path.exists(os.path.join(directory, "manifest.json")):
+            with open(os.path.join(directory, "manifest.json"), "r", encoding="utf-8") as file:
+                self.manifest.update(json.load(file))
+
+    def path(self, kind: str, index: int) -> str:
+        """Get the path of a fixture.
+
+        Arguments:
+            - kind: the kind of page.
+            - index: the number of the page.
+
+        Returns:
+            The path.
+        """
+        return os.path.join(self.directory, kind, f"{index}.html")
+
+    def add(self, kind: str, url: str, content: bytes) -> None:
+        """Add a page.
+
+        Arguments:
+            - kind: the kind of page.
+            - url: the url of the page.
+            - content: the html of the page.
+
+        Returns:
+            Nothing.
+        """
+        path = self.path(kind, len(self.manifest[kind]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(content)
+        self.manifest[kind].append(url)
+
+    def save(self) -> None:
+        """Save the manifest.
+
+        Returns:
+            Nothing.
+        """
+        with open(os.path.join(self.directory, "manifest.json"), "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=4)
+
+    def load(self, kind: str) -> list[tuple[str, bytes]]:
+        """Read all pages of a kind.
+
+        Arguments:
+            - kind: the kind of page.
+
+        Returns:
+            The urls and the html of the pages.
+        """
+        pages = []
+        for index, url in enumerate(self.manifest[kind]):
+            with open(self.path(kind, index), "rb") as file:
+                pages.append((url, file.read()))
+        return pages
+
+
+def record(fixtures: Fixtures, pages: int, products: int,
+           cache: http_cache.HTTPCache | None = None) -> None:
+    """Fetch the pages for the fixtures.
+
+    Arguments:
+        - fixtures: the fixtures to add to.
+        - pages: number of checklist pages.
+        - products: number of product pages.
+        - cache: http cache for all requests or None to always ask the server.
+
+    Returns:
+        Nothing.
+    """
+    apollo = comics.Apollo(cache=cache)
+    links = []
+    for page_number in range(1, pages + 1):
+        url = f"{comics.CHECKLIST_URL}?o=1&p={page_number}&n=100"
+        content = get(url)
+        fixtures.add("checklist", url, content)
+        links += apollo.parse_comic_links(content)
+    # spread the products over all recorded pages
+    for url in links[::max(1, len(links) // products)][:products]:
+        try:
+            fixtures.add("product", url, get(url))
+        except Exception as exception:  # pylint: disable=broad-except
+            print(f"Skipped {url}: {exception}", file=sys.stderr)
+    url = f"{HALO_URL}Halo_novels"
+    content = get(url)
+    fixtures.add("novels", url, content)
+    for _, novel_data in halo_novels.parse_novel_tables(content):
+        url = f"{HALO_URL}{novel_data[0].replace(' ', '_')}"
+        try:
+            fixtures.add("novel", url, get(url))
+        except Exception as exception:  # pylint: disable=broad-except
+            print(f"Skipped {url}: {exception}", file=sys.stderr)
+    fixtures.save()
+
+
+def get(url: str) -> bytes:
+    """Fetch a page for the fixtures, error pages are not recorded.
+
+    Arguments:
+        - url: the url of the page.
+
+    Returns:
+        The html of the page.
+    """
+    response = fetch.get(url)
+    response.raise_for_status()
+    return response.content
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Get a percentile (nearest rank).
+
+    Arguments:
+        - values: the sorted values.
+        - percent: the percentile, e.g. 95.
+
+    Returns:
+        The percentile.
+    """
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+def measure(func: typing.Callable[..., typing.Any], inputs: list[tuple],
+            records: typing.Callable[[typing.Any], int], repeat: int
+            ) -> dict[str, float] | None:
+    """Benchmark a function on all inputs.
+
+    Arguments:
+        - func: the function.
+        - inputs: the arguments of the calls.
+        - records: gets the number of records from a result.
+        - repeat: how often every input is parsed.
+
+    Returns:
+        Calls, records per second, latency percentiles in ms and allocations per call or
+        None if there are no inputs (e.g. no pages of the kind were recorded).
+    """
+    if not inputs or repeat < 1:
+        return None
+    latencies = []
+    count = 0
+    for _ in range(repeat):
+        for arguments in inputs:
+            start = time.perf_counter()
+            result = func(*arguments)
+            latencies.append(time.perf_counter() - start)
+            count += records(result)
+    # allocations in a separate pass, tracing slows down everything
+    peaks = []
+    blocks = []
+    tracemalloc.start()
+    for arguments in inputs:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        current = tracemalloc.get_traced_memory()[0]
+        result = func(*arguments)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        blocks.append(sum(stat.count_diff for stat in
+                          tracemalloc.take_snapshot().compare_to(before, "filename")
+                          if stat.count_diff > 0))
+        del result
+    tracemalloc.stop()
+    latencies.sort()
+    return {"calls": len(latencies),
+            "records_per_second": round(count / sum(latencies), 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "peak_kib": round(statistics.mean(peaks) / 1024, 1),
+            "allocations": round(statistics.mean(blocks))}
+
+
+def run(fixtures: Fixtures, repeat: int) -> dict[str, dict[str, float]]:
+    """Benchmark all parsers on the fixtures.
+
+    Arguments:
+        - fixtures: the fixtures.
+        - repeat: how often every page is parsed.
+
+    Returns:
+        The results of every parser.
+    """
+    apollo = comics.Apollo()
+    checklist = [(content,) for _, content in fixtures.load("checklist")]
+    products = [(content, url) for url, content in fixtures.load("product")]
+    stories = []
+    for _, content in fixtures.load("product"):
+        soup = bs4.BeautifulSoup(content, "lxml")
+        stories += [(row.find("td", class_="product--properties-value").text.strip(),)
+                    for row in soup.find_all("tr", class_="product--properties-row")
+                    if row.find("td", class_="product--properties-label"
+                                ).text.strip() == "Storys:"]
+    results: dict[str, dict[str, float] | None] = {}
+    for parser in ("bs4", "lxml"):
+        apollo.parser = parser
+        results[f"get_comic_links[{parser}]"] = measure(
+            apollo.parse_comic_links, checklist, len, repeat)
+        results[f"get_comic_information[{parser}]"] = measure(
+            apollo.parse_comic_information, products, lambda _: 1, repeat)
+    results["stories_to_list"] = measure(apollo.stories_to_list, stories, len, repeat)
+    results["get_novel_information"] = measure(
+        halo_novels.parse_novel_information,
+        [(content,) for _, content in fixtures.load("novel")], len, repeat)
+    results["halo_novels.main"] = measure(
+        lambda content: list(halo_novels.parse_novel_tables(content)),
+        [(content,) for _, content in fixtures.load("novels")], len, repeat)
+    return {name: result for name, result in results.items() if result is not None}
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]],
+            threshold: float) -> list[str]:
+    """Find regressions against a baseline.
+
+    Arguments:
+        - results: the new results.
+        - baseline: the results of the baseline.
+        - threshold: allowed relative difference, e.g. 0.2 for 20 %.
+
+    Returns:
+        A description of every regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result["records_per_second"] < old["records_per_second"] * (1 - threshold):
+            regressions.append(f"{name}: {result['records_per_second']} records/s "
+                               f"(baseline {old['records_per_second']})")
+        for key in ("p50_ms", "p95_ms", "peak_kib"):
+            if result[key] > old[key] * (1 + threshold):
+                regressions.append(f"{name}: {key} {result[key]} (baseline {old[key]})")
+    return regressions
+
+
+def drain(log_queue: typing.Any) -> None:
+    """Read a log queue until False arrives, like the logging process.
+
+    Arguments:
+        - log_queue: the queue.
+
+    Returns:
+        Nothing.
+    """
+    while log_queue.get() is not False:
+        pass
+
+
+def log_overhead(calls: int) -> dict[str, float]:
+    """Measure the time of a log call with the old transport (caller from inspect.stack,
+    one record per put into a manager queue) and with the batched transport.
+
+    Arguments:
+        - calls: number of log calls.
+
+    Returns:
+        Microseconds per call of both transports.
+    """
+    def old_log(level: int, msg: str) -> None:
+        now = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        manager_queue.put((level, msg, {"func": inspect.stack()[1][3],
+                                        "proc": multiprocessing.current_process().name,
+                                        "time": now,
+                                        "fetch": fetch.stats()}))
+
+    def get_comic_information(index: int) -> None:
+        old_log(logging.DEBUG, f"Got information about comic {index}.")
+
+    def get_comic_information_batched(index: int) -> None:
+        log_transport.send(logging.DEBUG, f"Got information about comic {index}.",
+                           "get_comic_information")
+
+    results = {}
+    with multiprocessing.Manager() as manager:
+        manager_queue = manager.Queue()
+        for name, log_queue, func in (
+                ("manager+inspect", manager_queue, get_comic_information),
+                ("batched", multiprocessing.Queue(log_transport.QUEUE_SIZE),
+                 get_comic_information_batched)):
+            log_transport.install(log_queue, comics.PROGRESS_TASKS, fetch.stats)
+            consumer = multiprocessing.Process(target=drain, args=(log_queue,))
+            consumer.start()
+            start = time.perf_counter()
+            for index in range(calls):
+                func(index)
+            log_transport.flush()
+            results[name] = round((time.perf_counter() - start) / calls * 1e6, 2)
+            log_queue.put(False)
+            consumer.join()
+    return results
+
+
+class Synthetic:
+    """Stand-in for Apollo in the pool benchmark: state that gets pickled with every task when
+    a bound method is sent, and a task that takes next to no time, so only the dispatch counts.
+    """
+
+    def __init__(self, state_size: int) -> None:
+        """Initialize the stand-in.
+
+        Arguments:
+            - state_size: size of the state in bytes.
+
+        Returns:
+            Nothing.
+        """
+        self.state = bytes(state_size)
+
+    def work(self, index: int) -> int:
+        """The task.
+
+        Arguments:
+            - index: the number of the task.
+
+        Returns:
+            A number.
+        """
+        return sum(range(index % 100))
+
+
+def pool_dispatch(tasks: int, stages: int, processes: int, state_size: int) -> dict[str, float]:
+    """Measure the tasks per second of the old dispatch (a new pool per stage, a bound method
+    and one task per message) and of the worker pool (started once, the name of the method
+    and adaptive batches).
+
+    Arguments:
+        - tasks: number of tasks per stage.
+        - stages: number of stages.
+        - processes: number of workers.
+        - state_size: size of the state of the target in bytes.
+
+    Returns:
+        Tasks per second of both.
+    """
+    target = Synthetic(state_size)
+    results = {}
+    start = time.perf_counter()
+    for _ in range(stages):
+        with multiprocessing.Pool(processes) as pool:
+            for _ in pool.imap(target.work, range(tasks)):
+                pass
+    results["pool per stage"] = round(stages * tasks / (time.perf_counter() - start))
+    start = time.perf_counter()
+    with worker_pool.WorkerPool(target, processes) as shared_pool:
+        for _ in range(stages):
+            for _ in shared_pool.imap("work", list(range(tasks))):
+                pass
+    results["worker pool"] = round(stages * tasks / (time.perf_counter() - start))
+    return results
+
+
+def main() -> None:
+    """The main method.
+
+    Returns:
+        Nothing.
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the parsers.")
+    parser.add_argument("--fixtures", metavar="DIRECTORY", default="fixtures",
+                        help="directory of the recorded pages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="record the pages for the fixtures")
+    record_parser.add_argument("--pages", type=int, default=3,
+                               help="number of checklist pages")
+    record_parser.add_argument("--products", type=int, default=100,
+                               help="number of product pages")
+    record_parser.add_argument("--cache", metavar="DIRECTORY",
+                               help="use the responses in this http cache")
+    record_parser.add_argument("--offline", action="store_true",
+                               help="only use the cache")
+    run_parser = subparsers.add_parser("run", help="benchmark the parsers")
+    run_parser.add_argument("--repeat", type=int, default=5,
+                            help="how often every page is parsed")
+    run_parser.add_argument("--baseline", metavar="PATH", default="benchmark.json",
+                            help="baseline to compare with")
+    run_parser.add_argument("--threshold", type=float, default=0.2,
+                            help="allowed slowdown relative to the baseline")
+    run_parser.add_argument("--save", action="store_true",
+                            help="save the results as the new baseline")
+    log_parser = subparsers.add_parser("log", help="benchmark the overhead of a log call")
+    log_parser.add_argument("--calls", type=int, default=10000, help="number of log calls")
+    pool_parser = subparsers.add_parser("pool", help="benchmark sending tasks to the pool")
+    pool_parser.add_argument("--tasks", type=int, default=20000,
+                             help="number of tasks per stage")
+    pool_parser.add_argument("--stages", type=int, default=3, help="number of stages")
+    pool_parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                             help="number of workers")
+    pool_parser.add_argument("--state", type=int, default=64,
+                             help="KiB of state pickled with a bound method")
+    args = parser.parse_args()
+
+    fixtures = Fixtures(args.fixtures)
+    if args.command == "record":
+        record(fixtures, args.pages, args.products,
+               http_cache.HTTPCache(args.cache or "cache", offline=args.offline)
+               if args.cache or args.offline else None)
+        print(", ".join(f"{len(urls)} {kind}" for kind, urls in fixtures.manifest.items()))
+        return
+
+    if args.command == "log":
+        for name, microseconds in log_overhead(args.calls).items():
+            print(f"{name:<20}{microseconds:>10} µs per call")
+        return
+
+    if args.command == "pool":
+        dispatch = pool_dispatch(args.tasks, args.stages, args.processes, args.state * 1024)
+        for name, tasks_per_second in dispatch.items():
+            print(f"{name:<20}{tasks_per_second:>10} tasks/s")
+        print(f"{'speedup':<20}{dispatch['worker pool'] / dispatch['pool per stage']:>10.2f}")
+        return
+
+    results = run(fixtures, args.repeat)
+    print(f"{'function':<32}{'calls':>7}{'records/s':>12}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'peak KiB':>10}{'allocs':>9}")
+    for name, result in results.items():
+        print(f"{name:<32}{result['calls']:>7}{result['records_per_second']:>12}"
+              f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}"
+              f"{result['peak_kib']:>10}{result['allocations']:>9}")
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+        print(f"Saved baseline to {args.baseline}.")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
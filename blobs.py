@@ -0,0 +1,213 @@
+"""Content-addressed store for the cover images. Every image is saved once under its sha256,
+so records only have to hold the hash and identical covers are deduplicated.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+
+class BlobStore:
+    """Stores blobs as '<directory>/<first two hex digits>/<sha256>'."""
+
+    def __init__(self, directory: str = "images") -> None:
+        """Initialize the store.
+
+        Arguments:
+            - directory: directory to store the blobs in.
+
+        Returns:
+            Nothing.
+        """
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        """Get the path of a blob.
+
+        Arguments:
+            - key: the hash of the blob.
+
+        Returns:
+            The path.
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put(self, data: bytes) -> str:
+        """Store a blob. Does nothing if the blob is already stored.
+
+        Arguments:
+            - data: the blob.
+
+        Returns:
+            The hash of the blob.
+        """
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write atomically, other processes might store the same blob at the same time
+            file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        return key
+
+    def writer(self) -> "BlobWriter":
+        """Store a blob that arrives in chunks, e.g. while it is downloaded.
+
+        Returns:
+            The writer; the blob is stored once it is committed.
+        """
+        return BlobWriter(self)
+
+    def get(self, key: str) -> bytes:
+        """Read a blob.
+
+        Arguments:
+            - key: the hash of the blob.
+
+        Returns:
+            The blob.
+        """
+        with open(self.path(key), "rb") as file:
+            return file.read()
+
+    def image(self, value: str | None) -> bytes | None:
+        """Get the image of a record. Works with hashes as well as with
+        the old base64 encoded images.
+
+        Arguments:
+            - value: the image field of the record.
+
+        Returns:
+            The image or None if the record has no image or its blob is missing.
+        """
+        if not value:
+            return None
+        if re.fullmatch(r"[0-9a-f]{64}", value):
+            if value not in self:
+                logging.getLogger("blobs").warning("Image %s is not in '%s'.",
+                                                   value, self.directory)
+                return None
+            return self.get(value)
+        return base64.b64decode(value.encode("utf-8"))
+
+
+class BlobWriter:
+    """Writes a blob chunk by chunk into a temporary file and hashes it on the way."""
+
+    def __init__(self, store: BlobStore) -> None:
+        """Initialize the writer.
+
+        Arguments:
+            - store: the store to put the blob into.
+
+        Returns:
+            Nothing.
+        """
+        self.store = store
+        self.hash = hashlib.sha256()
+        os.makedirs(store.directory, exist_ok=True)
+        file_descriptor, self.temp_path = tempfile.mkstemp(dir=store.directory)
+        self.file = os.fdopen(file_descriptor, "wb")
+
+    def write(self, data: bytes) -> None:
+        """Add a chunk of the blob.
+
+        Arguments:
+            - data: the chunk.
+
+        Returns:
+            Nothing.
+        """
+        self.file.write(data)
+        self.hash.update(data)
+
+    def commit(self) -> str:
+        """Store the blob. Does nothing if it is already stored.
+
+        Returns:
+            The hash of the blob.
+        """
+        self.file.close()
+        key = self.hash.hexdigest()
+        path = self.store.path(key)
+        if os.path.exists(path):
+            os.remove(self.temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.temp_path, path)
+        return key
+
+    def abort(self) -> None:
+        """Throw the blob away.
+
+        Returns:
+            Nothing.
+        """
+        self.file.close()
+        os.remove(self.temp_path)
+
+
+class Base64Writer:
+    """Encodes a blob chunk by chunk as base64, for records without a blob store."""
+
+    def __init__(self) -> None:
+        """Initialize the writer.
+
+        Returns:
+            Nothing.
+        """
+        self.parts: list[str] = []
+        # base64 works on groups of three bytes, the rest waits for the next chunk
+        self.rest = b""
+
+    def write(self, data: bytes) -> None:
+        """Add a chunk of the blob.
+
+        Arguments:
+            - data: the chunk.
+
+        Returns:
+            Nothing.
+        """
+        data = self.rest + data
+        cut = len(data) - len(data) % 3
+        self.parts.append(base64.b64encode(data[:cut]).decode("utf-8"))
+        self.rest = data[cut:]
+
+    def commit(self) -> str:
+        """Finish the encoding.
+
+        Returns:
+            The blob as base64 encoded string.
+        """
+        self.parts.append(base64.b64encode(self.rest).decode("utf-8"))
+        return "".join(self.parts)
+
+    def abort(self) -> None:
+        """Throw the blob away.
+
+        Returns:
+            Nothing.
+        """
+        self.parts = []
+        self.rest = b""
+
+
+def writer(store: BlobStore | None) -> "BlobWriter | Base64Writer":
+    """Get a writer for a blob: into the store or as base64 if there is none.
+
+    Arguments:
+        - store: the blob store or None.
+
+    Returns:
+        The writer.
+    """
+    return store.writer() if store is not None else Base64Writer()
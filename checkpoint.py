@@ -0,0 +1,177 @@
+"""Persistent work queue for long crawls. The state of every work item (checklist page, product
+url, image) and the results of the finished ones are committed to a SQLite database as they
+arrive, so a crawl that failed or was interrupted can be restarted: finished items are taken
+from the checkpoint and only pending and failed items are fetched again.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import typing
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class Checkpoint:
+    """Work items and their results in a SQLite database. Only used by one process,
+    the one that hands out the work.
+    """
+
+    def __init__(self, path: str, settings: dict[str, typing.Any] | None = None,
+                 max_age: float | None = None) -> None:
+        """Open a checkpoint or start a new one.
+
+        Arguments:
+            - path: path of the database.
+            - settings: settings the results depend on (e.g. the image store); a checkpoint
+            with other settings is started again.
+            - max_age: seconds after which a checkpoint is too old to resume (the results
+            would be outdated) or None to always resume.
+
+        Returns:
+            Nothing.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # every result is committed on its own, the write-ahead log keeps that cheap
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+        settings_json = json.dumps(settings if settings is not None else {}, sort_keys=True)
+        meta = dict(self.connection.execute("SELECT name, value FROM meta"))
+        if meta.get("settings") != settings_json or (
+                max_age is not None and time.time() - float(meta["started"]) > max_age):
+            self.connection.execute("DELETE FROM items")
+            meta = {"settings": settings_json, "started": str(time.time())}
+            self.connection.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                        meta.items())
+            self.connection.commit()
+        self.started = float(meta["started"])
+
+    def add(self, kind: str, keys: typing.Iterable[str]) -> None:
+        """Add work items as pending, items that are already known keep their state.
+
+        Arguments:
+            - kind: the kind of the items, e.g. 'page'.
+            - keys: the keys of the items, e.g. the urls.
+
+        Returns:
+            Nothing.
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO items (kind, key, state, updated) VALUES (?, ?, ?, ?)",
+            [(kind, key, PENDING, now) for key in keys])
+        self.connection.commit()
+
+    def done(self, kind: str, key: str, result: typing.Any) -> None:
+        """Commit the result of a work item.
+
+        Arguments:
+            - kind: the kind of the item.
+            - key: the key of the item.
+            - result: the result (has to be JSON serializable).
+
+        Returns:
+            Nothing.
+        """
+        self.connection.execute(
+            "INSERT INTO items (kind, key, state, result, attempts, updated) "
+            "VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT (kind, key) DO UPDATE SET "
+            "state = excluded.state, result = excluded.result, "
+            "attempts = attempts + 1, updated = excluded.updated",
+            (kind, key, DONE, json.dumps(result), time.time()))
+        self.connection.commit()
+
+    def fail(self, kind: str, key: str) -> None:
+        """Mark a work item as failed; it is tried again by the next run.
+
+        Arguments:
+            - kind: the kind of the item.
+            - key: the key of the item.
+
+        Returns:
+            Nothing.
+        """
+        self.connection.execute(
+            "INSERT INTO items (kind, key, state, attempts, updated) VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT (kind, key) DO UPDATE SET state = excluded.state, "
+            "attempts = attempts + 1, updated = excluded.updated",
+            (kind, key, FAILED, time.time()))
+        self.connection.commit()
+
+    def result(self, kind: str, key: str) -> typing.Any:
+        """Get the result of a finished work item.
+
+        Arguments:
+            - kind: the kind of the item.
+            - key: the key of the item.
+
+        Returns:
+            The result or None if the item is not finished.
+        """
+        row = self.connection.execute(
+            "SELECT result FROM items WHERE kind = ? AND key = ? AND state = ?",
+            (kind, key, DONE)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def results(self, kind: str) -> dict[str, typing.Any]:
+        """Get the results of all finished work items of a kind.
+
+        Arguments:
+            - kind: the kind of the items.
+
+        Returns:
+            The results by key.
+        """
+        return {key: json.loads(result) for key, result in self.connection.execute(
+            "SELECT key, result FROM items WHERE kind = ? AND state = ?", (kind, DONE))}
+
+    def counts(self) -> dict[str, dict[str, int]]:
+        """Count the work items.
+
+        Returns:
+            The number of items by kind and state.
+        """
+        counts: dict[str, dict[str, int]] = {}
+        for kind, state, count in self.connection.execute(
+                "SELECT kind, state, COUNT(*) FROM items GROUP BY kind, state"):
+            counts.setdefault(kind, {})[state] = count
+        return counts
+
+    def close(self) -> None:
+        """Close the database; a later run resumes from it.
+
+        Returns:
+            Nothing.
+        """
+        self.connection.close()
+
+    def finish(self) -> None:
+        """Delete the checkpoint after a complete run, so the next run starts from scratch.
+
+        Returns:
+            Nothing.
+        """
+        self.connection.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(f"{self.path}{suffix}"):
+                os.remove(f"{self.path}{suffix}")
@@ -2,27 +2,48 @@
 https://paninishop.de/checkliste/dc-comics/. The comics will be saved as JSON in 'comics.json'.
 """
 
-import base64
+import argparse
+import asyncio
+import contextlib
 import datetime
-import inspect
-import json
 import logging
 import multiprocessing
-import random
+import pickle
 import re
+import signal
+import sys
 import time
 import typing
 
 import bs4
-import requests
+import lxml.etree
+import lxml.html
 import rich.color
 import rich.console
 import rich.highlighter
 import rich.live
 import rich.logging
 import rich.progress
+import rich.text
 import rich.theme
 
+import blobs
+import checkpoint
+import delta
+import engine
+import fetch
+import http_cache
+import log_transport
+import metrics
+import profiling
+import rate_control
+import series_index
+import shards
+import sqlite_catalog
+import thumbnails
+import worker_pool
+import writer
+
 
 THEME = rich.theme.Theme({
     "log.datetime": rich.color.Color.from_rgb(44, 88, 172).name,
@@ -36,18 +57,53 @@ THEME = rich.theme.Theme({
 })
 FORMATTER = logging.Formatter(fmt="[{time}] [{func}/{levelname}] ({proc}) {message}",
                               datefmt="%Y-%m-%d %H:%M:%S", style="{")
-USER_AGENTS = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:53.0) Gecko/20100101 Firefox/53.0",
-    "Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:47.0) Gecko/20100101 Firefox/47.0",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/91.0.4472.124",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/91.0.4472.124",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/58.0.3029.110 Safari/537.36",
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/51.0.2704.103 Safari/537.36"
-]
+CHECKLIST_URL = "https://paninishop.de/checkliste/dc-comics/"
+JPG_MAGIC_NUMBER = b"\xff\xd8\xff"
+TASK_DESCRIPTIONS = {"links": "Getting links...",
+                     "info": "Getting information...",
+                     "image": "Getting images..."}
+# every record of these functions advances the progress task
+PROGRESS_TASKS = {"get_comic_links": "links",
+                  "get_comic_information": "info",
+                  "get_comic_image": "image"}
+# the functions whose results are kept in the checkpoint, by kind of work item
+CHECKPOINT_FUNCTIONS = {"page": "get_comic_links",
+                        "info": "get_comic_information",
+                        "image": "get_comic_image"}
+
+
+def process_status() -> dict[str, typing.Any]:
+    """Get the connection statistics and the metrics of this process.
+    Sent with every batch of log records.
+
+    Returns:
+        The statistics and the metrics.
+    """
+    return {"fetch": fetch.stats(), "metrics": metrics.snapshot()}
+
+
+def has_class(name: str) -> str:
+    """XPath condition for an element with a class (like class_ in BeautifulSoup).
+
+    Arguments:
+        - name: the class.
+
+    Returns:
+        The condition.
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# precompiled XPath expressions for the lxml parser
+XPATH_COMIC_LINKS = lxml.etree.XPath(f"//a[{has_class('product--title')}]/@href")
+XPATH_TITLE = lxml.etree.XPath(f"(//h1[{has_class('product--title')}])[1]")
+XPATH_IMAGE = lxml.etree.XPath(f"(//span[{has_class('image--element')}])[1]")
+XPATH_PRICE = lxml.etree.XPath("(//meta[@itemprop='price'])[1]")
+XPATH_STATUS = lxml.etree.XPath(f"(//span[{has_class('delivery--text')}])[1]")
+XPATH_BASE_INFO = lxml.etree.XPath(f"//li[{has_class('base-info--entry')}]")
+XPATH_PROPERTIES = lxml.etree.XPath(f"//tr[{has_class('product--properties-row')}]")
+XPATH_PROPERTY_LABEL = lxml.etree.XPath(f"(.//td[{has_class('product--properties-label')}])[1]")
+XPATH_PROPERTY_VALUE = lxml.etree.XPath(f"(.//td[{has_class('product--properties-value')}])[1]")
 
 
 class LogHighlighter(rich.highlighter.RegexHighlighter):
@@ -70,25 +126,153 @@ class LogHighlighter(rich.highlighter.RegexHighlighter):
 class Apollo:
     """Apollo class thing."""
 
-    def __init__(self) -> None:
+    def __init__(self, mode: str = "pool", requests_in_flight: int = 64,
+                 parse_workers: int = 2, timeout: float = 10, queue_size: int = 256,
+                 pool_connections: int = 4, pool_maxsize: int = 4,
+                 cache: http_cache.HTTPCache | None = None,
+                 image_store: blobs.BlobStore | None = None,
+                 database: str | None = None, parser: str = "bs4",
+                 max_concurrency: int = 16, thumbnail_widths: list[int] | None = None,
+                 thumbnail_format: str = "jpeg", thumbnail_quality: int = 80,
+                 thumbnails_only: bool = False, checkpoint_path: str | None = None,
+                 checkpoint_max_age: float | None = None,
+                 shard: tuple[int, int] | None = None,
+                 merge_shards: int | None = None, checklist_url: str = CHECKLIST_URL,
+                 profile_directory: str | None = None) -> None:
         """Initialize apollo.
 
+        Arguments:
+            - mode: 'pool' to use a process pool for every stage, 'async' to use the
+            asyncio fetch engine or 'pipeline' to stream the stages into each other.
+            - requests_in_flight: maximum number of requests at the same time
+            (async and pipeline only).
+            - parse_workers: number of processes used for parsing (async and pipeline only).
+            - timeout: timeout for each request in seconds.
+            - queue_size: maximum number of items between two stages (pipeline only).
+            - pool_connections: number of hosts to keep connections for per session.
+            - pool_maxsize: maximum number of keep-alive connections per host and session.
+            - cache: http cache for all requests or None to always ask the server.
+            - image_store: store for the images or None to put them into the
+            JSON file as base64 encoded strings.
+            - database: path of a SQLite catalog to write as well or None.
+            - parser: 'bs4' to parse the sites with BeautifulSoup or 'lxml' to only
+            extract the needed elements with lxml and XPath (faster, same results).
+            - max_concurrency: maximum number of requests per host at the same time. The
+            rate controller adapts the actual limit to the host up to this (pool mode uses
+            this many processes, at least one per cpu).
+            - thumbnail_widths: widths of the thumbnails of the covers or None for none.
+            - thumbnail_format: 'jpeg' or 'webp'.
+            - thumbnail_quality: quality of the thumbnails (1-100).
+            - thumbnails_only: keep only the thumbnails, the biggest one replaces the cover.
+            - checkpoint_path: path of a checkpoint that keeps the finished pages, comics and
+            images, so an interrupted run can be resumed, or None for no checkpoint.
+            - checkpoint_max_age: seconds after which a checkpoint is not resumed anymore
+            or None to always resume it.
+            - shard: the shard and the number of shards, e.g. (0, 4), to only get the comics
+            whose links hash to this shard and write them to 'comics.shard-0-of-4.jsonl',
+            or None to get all comics.
+            - merge_shards: merge the outputs of this many shards into 'comics.json' instead
+            of crawling, or None.
+            - checklist_url: url of the checklist, e.g. of a standin.py serving recorded
+            responses to test shards locally.
+            - profile_directory: profile the stages in every process and write the merged
+            profiles and allocation sites to this directory, or None to not profile.
+
+        Returns:
+            Nothing.
+        """
+        self.logger_queue: multiprocessing.Queue = multiprocessing.Queue(
+            log_transport.QUEUE_SIZE)
+        self.mode = mode
+        self.requests_in_flight = requests_in_flight
+        self.parse_workers = parse_workers
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.cache = cache
+        self.image_store = image_store
+        self.database = database
+        self.parser = parser
+        self.max_concurrency = max_concurrency
+        self.thumbnail_widths = thumbnail_widths
+        self.thumbnail_format = thumbnail_format
+        self.thumbnail_quality = thumbnail_quality
+        self.thumbnails_only = thumbnails_only
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_max_age = checkpoint_max_age
+        # opened by main, only the main process uses it
+        self.checkpoint: checkpoint.Checkpoint | None = None
+        self.shard = shard
+        self.merge_shards = merge_shards
+        self.checklist_url = checklist_url
+        self.profile_directory = profile_directory
+        # the pool of the stages of pool mode, while it runs
+        self.pool: worker_pool.WorkerPool | None = None
+        # position (page number, index on page) of every link, written with the shard output
+        self.positions: dict[str, tuple[int, int]] = {}
+        # the checklist pages whose links were listed and the number of pages
+        self.pages: set[int] = set()
+        self.page_count = 0
+        self.rate_controller = rate_control.RateController(maximum=max_concurrency)
+        # the transport to the logging process is only installed by main and the pools,
+        # so using the methods as a library starts no threads
+        fetch.configure(self.pool_connections, self.pool_maxsize, self.cache,
+                        self.rate_controller)
+
+    def __getstate__(self) -> dict[str, typing.Any]:
+        # the queue and the shared limits can only be inherited by new processes,
+        # not be sent with every task
+        state = self.__dict__.copy()
+        del state["logger_queue"]
+        del state["rate_controller"]
+        state["checkpoint"] = None
+        state["positions"] = {}
+        state["pages"] = set()
+        state["pool"] = None
+        return state
+
+    def init_worker(self, logger_queue: multiprocessing.Queue,
+                    rate_controller: rate_control.RateController) -> None:
+        """Set up fetching and logging of a process. Used as initializer of the pools.
+
+        Arguments:
+            - logger_queue: the queue of the logging process.
+            - rate_controller: the rate controller shared by all processes.
+
         Returns:
             Nothing.
         """
-        manager = multiprocessing.Manager()
-        self.logger_queue = manager.Queue()
+        if multiprocessing.parent_process() is not None:
+            # Ctrl-C is handled by the main process alone, it stops the pool and keeps the
+            # checkpoint; workers killed by it would hang the pool
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        fetch.configure(self.pool_connections, self.pool_maxsize, self.cache, rate_controller)
+        log_transport.install(logger_queue, PROGRESS_TASKS, process_status)
+        # start the transport now, so it sends the final status of the process even if
+        # the process never logs anything
+        log_transport.transport()
 
-    def logger_thread(self) -> None:
+    def logger_thread(self, logger_queue: multiprocessing.Queue,
+                      rate_controller: rate_control.RateController) -> None:
         """Seperate for logging.
 
+        Arguments:
+            - logger_queue: the queue to get the batches of records from.
+            - rate_controller: the rate controller whose limits are shown.
+
         Returns:
             Nothing.
         """
         try:
+            started = time.time()
             # file_handler for logging
             date = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            file_handler = logging.FileHandler(filename=f"logs/comics-{date}.log",
+            # shards started at the same time must not share a log file
+            suffix = f"-shard-{self.shard[0]}-of-{self.shard[1]}" if self.shard else ""
+            report_path = f"logs/comics-{date}{suffix}.metrics.json"
+            prometheus_path = f"comics{suffix}.prom"
+            file_handler = logging.FileHandler(filename=f"logs/comics-{date}{suffix}.log",
                                                mode="w", encoding="utf-8")
             file_handler.setFormatter(FORMATTER)
             file_handler.setLevel(logging.DEBUG)
@@ -112,41 +296,70 @@ class Apollo:
                                               rich.progress.BarColumn(), rich.progress.TextColumn(
                 "[progress.percentage]{task.percentage:>3.0f}%"),
                 rich.progress.TimeRemainingColumn(), rich.progress.TimeElapsedColumn())
+            tasks: dict[str, rich.progress.TaskID] = {}
+            # steps of tasks whose total did not arrive yet
+            pending: dict[str, int] = {}
+            # latest connection statistics and metrics of every process
+            statuses: dict[str, dict[str, typing.Any]] = {}
+
+            def display() -> rich.console.Group:
+                # progress and the current limit and throughput of every host
+                return rich.console.Group(progress, *(rich.text.Text(
+                    f"{host}: limit {host_metrics['limit']:g} "
+                    f"({host_metrics['in_flight']:g} in flight), "
+                    f"{host_metrics['requests_per_second']:g} requests/s, "
+                    f"{host_metrics['latency_ms']:g} ms, {host_metrics['throttled']:g} throttled, "
+                    f"{host_metrics['errors']:g} errors", style="log.proc")
+                    for host, host_metrics in rate_controller.metrics().items()))
 
             # log
-            with rich.live.Live(progress, console=log_console):
+            with rich.live.Live(console=log_console, get_renderable=display):
                 while True:
-                    data = self.logger_queue.get()
+                    batch: log_transport.Batch | typing.Literal[False] = logger_queue.get()
                     # end logging process if data is False
-                    if not data:
+                    if not batch:
+                        # the report of the run, merged from all processes
+                        metrics.write(
+                            metrics.merge(status["metrics"] for status in statuses.values()),
+                            started, report_path, prometheus_path, "comics")
+                        now = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                        for msg in (fetch.summary(status["fetch"] for status in statuses.values()),
+                                    rate_controller.summary(),
+                                    f"Wrote the metrics to '{report_path}' and "
+                                    f"'{prometheus_path}'."):
+                            logger.info(msg=msg, extra={
+                                "func": "logger_thread",
+                                "proc": multiprocessing.current_process().name, "time": now})
                         return
-                    if len(data) == 2:
-                        # this could be a problem, because it assumes that the total will
-                        # be received before any logging from the corresponding functions
-                        match data[0]:
-                            case "links":
-                                task_links = progress.add_task("Getting links...",
-                                                               total=data[1])
-                            case "info":
-                                task_info = progress.add_task("Getting information...",
-                                                              total=data[1])
-                            case "image":
-                                task_image = progress.add_task("Getting images...",
-                                                               total=data[1])
-                    else:
-                        match data[2]["func"]:
-                            case "get_comic_links":
-                                progress.advance(task_links)
-                            case "get_comic_information":
-                                progress.advance(task_info)
-                            case "get_comic_image":
-                                progress.advance(task_image)
-                        logger.log(level=data[0], msg=data[1], extra=data[2])
+                    # a total that is sent again (streaming pipeline) updates the task
+                    for task, total in batch.totals.items():
+                        if task in tasks:
+                            progress.update(tasks[task], total=total)
+                        else:
+                            tasks[task] = progress.add_task(TASK_DESCRIPTIONS[task],
+                                                            total=total,
+                                                            completed=pending.pop(task, 0))
+                    for task, count in batch.progress.items():
+                        if task in tasks:
+                            progress.advance(tasks[task], count)
+                        else:
+                            pending[task] = pending.get(task, 0) + count
+                    if batch.status is not None:
+                        statuses[batch.proc] = batch.status
+                    for level, msg, func, created in batch.records:
+                        logger.log(level=level, msg=msg, extra={
+                            "func": func, "proc": batch.proc,
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created))})
+                    if batch.dropped:
+                        logger.warning(msg=f"Dropped {batch.dropped} log records, "
+                                       "logging could not keep up.",
+                                       extra={"func": "logger_thread", "proc": batch.proc,
+                                              "time": time.strftime("%Y-%m-%dT%H:%M:%SZ")})
         except (KeyboardInterrupt, Exception) as excp:  # pylint: disable=broad-except
             now = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
             logger.critical(msg=f"{excp.__class__.__name__}: {excp}"
                             if len(str(excp)) > 0 else excp.__class__.__name__,
-                            extra={"func": inspect.stack()[0][3],
+                            extra={"func": "logger_thread",
                                    "proc": multiprocessing.current_process().name,
                                    "time": now})
 
@@ -160,36 +373,161 @@ class Apollo:
         Returns:
             Nothing.
         """
-        now = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-        self.logger_queue.put((level, msg, {"func": func_name
-                                            if len(func_name) > 0 else inspect.stack()[1][3],
-                                            "proc": multiprocessing.current_process().name,
-                                            "time": now}))
+        # pylint: disable-next=protected-access
+        log_transport.send(level, msg, func_name or sys._getframe(1).f_code.co_name)
+
+    @contextlib.contextmanager
+    def pooled(self) -> typing.Iterator[worker_pool.WorkerPool]:
+        """Start the process pool for the pool maps. Every stage of pool mode runs in the same
+        pool, its workers are only set up once.
+
+        Returns:
+            Context manager that gives the pool.
+        """
+        # the processes mostly wait for the network; the rate controller decides how many
+        # of them send requests at the same time
+        with worker_pool.WorkerPool(self, max(multiprocessing.cpu_count(), self.max_concurrency),
+                                    self.init_worker,
+                                    (self.logger_queue, self.rate_controller)) as pool:
+            self.pool = pool
+            try:
+                yield pool
+            finally:
+                self.pool = None
+            self.log(logging.DEBUG, f"Sent {pool.tasks} tasks to the pool in "
+                     f"{pool.batches} batches.")
+
+    def poolimap(self, func: typing.Callable, iterable: list[typing.Any],
+                 keep_failed: bool = False) -> typing.Iterator[tuple[typing.Any, typing.Any]]:
+        """Map iterable to method and execute in multiple processes in a pool.
+        Yields every result (in order) as soon as it is ready, together with its argument.
+        Uses the pool of pooled or, outside of it, a pool of its own.
+
+        Arguments:
+            - func: method of apollo to apply (only its name is sent to the workers).
+            - iterable: arguments for function.
+            - keep_failed: also yield arguments that failed (with None as result).
+
+        Returns:
+            The arguments and results.
+        """
+        if self.pool is None:
+            with self.pooled():
+                yield from self.poolimap(func, iterable, keep_failed)
+            return
+        for argument, succeeded, result in self.pool.imap(
+                func.__name__, iterable, "profiled" if self.profile_directory else None):
+            if succeeded:
+                yield argument, result
+                continue
+            self.log(logging.ERROR, result, func.__name__)
+            if keep_failed:
+                yield argument, None
+
+    def profiled(self, stage: str, func: typing.Callable, *args: typing.Any) -> typing.Any:
+        """Run a function of a stage with the profiler (see profiling.py).
+
+        Arguments:
+            - stage: the stage, e.g. 'get_comic_links'.
+            - func: function to apply; has to be picklable.
+            - args: arguments for the function.
+
+        Returns:
+            The result of the function.
+        """
+        with profiling.stage(self.profile_directory, stage) as profiled:
+            result = func(*args)
+            if profiled and multiprocessing.parent_process() is not None:
+                # a worker pickles the result to send it back to the main process;
+                # pickle it once more here to see what that costs
+                pickle.dumps(result)
+        return result
 
     def poolmap(self, func: typing.Callable, iterable: list[typing.Any]) -> list[typing.Any]:
         """Map iterable to function and execute in multiple processes in a pool.
-        Basically just wraps multiprocessing.Pool.imap with some error handling.
+        Basically just poolimap without the arguments.
 
         Arguments:
-            - func: function to apply.
+            - func: method of apollo to apply.
             - iterable: arguments for function.
 
         Returns:
             The results.
         """
-        # this function will not log correctly; func should be correct, but proc will be wrong
-        result = []
-        with multiprocessing.Pool(multiprocessing.cpu_count()) as pool:
-            iterator = pool.imap(func, iterable)
-            while True:
-                try:
-                    result.append(next(iterator))
-                except StopIteration:
-                    break
-                except Exception as excp:  # pylint: disable=broad-except
-                    self.log(logging.ERROR,
-                             f"{excp.__class__.__name__}: {excp}",
-                             func.__name__)
+        return [result for _, result in self.poolimap(func, iterable)]
+
+    def resumable_imap(self, kind: str, func: typing.Callable, iterable: list[typing.Any],
+                       keep_failed: bool = False
+                       ) -> typing.Iterator[tuple[typing.Any, typing.Any]]:
+        """poolimap that takes the results of finished work items from the checkpoint and
+        commits every new result (or failure) to it as soon as it is ready.
+
+        Arguments:
+            - kind: the kind of the work items in the checkpoint, e.g. 'page'.
+            - func: function to apply.
+            - iterable: arguments for function.
+            - keep_failed: also yield arguments that failed (with None as result).
+
+        Returns:
+            The arguments and results.
+        """
+        if self.checkpoint is None:
+            yield from self.poolimap(func, iterable, keep_failed)
+            return
+        keys = [str(argument) for argument in iterable]
+        self.checkpoint.add(kind, keys)
+        stored = self.checkpoint.results(kind)
+        pending = [argument for argument, key in zip(iterable, keys) if key not in stored]
+        fetched = self.poolimap(func, pending, keep_failed=True) if pending else iter(())
+        for argument, key in zip(iterable, keys):
+            if key in stored:
+                self.log(logging.DEBUG, f"Got {kind} {key} from the checkpoint.",
+                         CHECKPOINT_FUNCTIONS[kind])
+                yield argument, stored[key]
+                continue
+            _, result = next(fetched)
+            if result is None:
+                self.checkpoint.fail(kind, key)
+            else:
+                self.checkpoint.done(kind, key, result)
+            if result is not None or keep_failed:
+                yield argument, result
+        # run the map to the end, so no batch is left behind in the pool
+        for _ in fetched:
+            pass
+
+    async def resumable(self, kind: str, key: str,
+                        func: typing.Callable[..., typing.Awaitable], *args: typing.Any
+                        ) -> typing.Any:
+        """Await a work item or take its result from the checkpoint. The async counterpart
+        of resumable_imap.
+
+        Arguments:
+            - kind: the kind of the work item in the checkpoint, e.g. 'page'.
+            - key: the key of the work item, e.g. the url.
+            - func: coroutine function that does the work.
+            - args: arguments for the function.
+
+        Returns:
+            The result.
+        """
+        if self.checkpoint is None:
+            return await func(*args)
+        result = self.checkpoint.result(kind, key)
+        if result is not None:
+            self.log(logging.DEBUG, f"Got {kind} {key} from the checkpoint.",
+                     CHECKPOINT_FUNCTIONS[kind])
+            return result
+        self.checkpoint.add(kind, [key])
+        try:
+            result = await func(*args)
+        except Exception:
+            self.checkpoint.fail(kind, key)
+            raise
+        if result is None:
+            self.checkpoint.fail(kind, key)
+        else:
+            self.checkpoint.done(kind, key, result)
         return result
 
     def stories_to_list(self, stories: str) -> list[str]:
@@ -217,6 +555,82 @@ class Apollo:
             story_list.append(item)
         return story_list
 
+    def parse_page_numbers(self, content: bytes) -> int:
+        """Gets the number of pages from the first page of the checklist.
+
+        Arguments:
+            - content: the html of the page.
+
+        Returns:
+            The number of pages.
+        """
+        soup = bs4.BeautifulSoup(content, "lxml")
+        return int(typing.cast(
+            bs4.Tag, typing.cast(bs4.Tag, soup.find("span", class_="paging--display")
+                                 ).find("strong")).text.strip())
+
+    def parse_comic_links(self, content: bytes) -> list[str]:
+        """Gets all the comic links from the html of a checklist page.
+
+        Arguments:
+            - content: the html of the page.
+
+        Returns:
+            The links that were found.
+        """
+        if self.parser == "lxml":
+            return self.parse_comic_links_lxml(content)
+        soup = bs4.BeautifulSoup(content, "lxml")
+        return [link["href"].split("?")[0]
+                for link in soup.find_all("a", class_="product--title")]
+
+    def parse_comic_links_lxml(self, content: bytes) -> list[str]:
+        """Gets all the comic links from the html of a checklist page
+        with lxml and XPath (same result as parse_comic_links).
+
+        Arguments:
+            - content: the html of the page.
+
+        Returns:
+            The links that were found.
+        """
+        return [str(link).split("?")[0] for link in XPATH_COMIC_LINKS(self.lxml_tree(content))]
+
+    def select(self, page_number: int, links: list[str]) -> list[str]:
+        """Remember the positions of the links of a page and get the ones of this shard.
+
+        Arguments:
+            - page_number: the number of the page.
+            - links: the links on the page.
+
+        Returns:
+            The links of this shard (all links without sharding).
+        """
+        self.pages.add(page_number)
+        for index, link in enumerate(links):
+            self.positions.setdefault(link, (page_number, index))
+        if self.shard is None:
+            return links
+        return [link for link in links
+                if shards.shard_of(link, self.shard[1]) == self.shard[0]]
+
+    def list_comics(self, catalog: writer.CatalogWriter | shards.ShardWriter) -> None:
+        """Tell the delta which comics are on the checklist, so a comic that could not be
+        fetched is not reported as removed.
+
+        Arguments:
+            - catalog: the catalog the comics were written to.
+
+        Returns:
+            Nothing.
+        """
+        for sink in catalog.sinks if isinstance(catalog, writer.CatalogWriter) else []:
+            if isinstance(sink, delta.DeltaIndex):
+                sink.listed = set(self.positions)
+                if self.pages != set(range(1, self.page_count + 1)):
+                    # the comics of a missing checklist page can not be told from removed ones
+                    sink.listed |= set(sink.previous)
+
     def get_comic_links(self, page_number: int) -> list[str]:
         """Gets all the comic links from a page of the paninishop dc comics checklist.
 
@@ -226,29 +640,99 @@ class Apollo:
         Returns:
             The links that were found.
         """
-        respone = requests.get(
-            f"https://paninishop.de/checkliste/dc-comics/?o=1&p={page_number}&n=100",
-            timeout=10, headers={"User-Agent": random.choice(USER_AGENTS)})
-        soup = bs4.BeautifulSoup(respone.content, "lxml")
-        links = [link["href"].split("?")[0]
-                 for link in soup.find_all("a", class_="product--title")]
+        with metrics.timer("stage_seconds", stage="get_comic_links", step="fetch"):
+            respone = fetch.get(f"{self.checklist_url}?o=1&p={page_number}&n=100",
+                                timeout=self.timeout)
+        with metrics.timer("stage_seconds", stage="get_comic_links", step="parse"):
+            links = self.parse_comic_links(respone.content)
+        metrics.item("get_comic_links")
         self.log(logging.DEBUG, f"Got {len(links)} comic links from "
                  f"page {page_number}.")
         return links
 
-    def get_comic_information(self, url: str) -> dict:
-        """Scrapes the url for information about a comic.
-        Will only work with a paninishop comic site.
+    def lxml_tree(self, content: bytes) -> lxml.etree._Element:
+        """Parses html with lxml. Decodes it like BeautifulSoup does (declared encoding,
+        otherwise UTF-8), so both parsers see the same text.
 
         Arguments:
+            - content: the html.
+
+        Returns:
+            The root element.
+        """
+        encoding = bs4.dammit.EncodingDetector.find_declared_encoding(content, is_html=True)
+        return lxml.html.document_fromstring(
+            content, parser=lxml.html.HTMLParser(encoding=encoding or "utf-8"))
+
+    def add_base_info(self, comic_information: dict, key: str, value: str) -> None:
+        """Adds an entry of the base information of a comic site.
+
+        Arguments:
+            - comic_information: the information to add to.
+            - key: the label of the entry.
+            - value: the value of the entry.
+
+        Returns:
+            Nothing.
+        """
+        match key:
+            case "Artikel-Nr.:":  # rename key
+                comic_information.update({"Artikelnummer": value})
+            case "Erscheint am:":  # as ISO 8601 format
+                comic_information.update({"Erscheinungsdatum":
+                                          "-".join(value.split(".")[::-1])})
+            case "Limitierte Auflage:":  # as list[int]
+                comic_information.update({"Limitierte Auflage":
+                                          [int(number) for number in value.split(", ")]})
+            case _:  # just normal str
+                comic_information.update(
+                    {key.removesuffix(":"): value})
+
+    def add_property(self, comic_information: dict, key: str, value: str) -> None:
+        """Adds a row of the extra information table of a comic site.
+
+        Arguments:
+            - comic_information: the information to add to.
+            - key: the label of the row.
+            - value: the value of the row.
+
+        Returns:
+            Nothing.
+        """
+        match key:
+            # format information correctly as list[str]
+            case "Storys:":
+                comic_information.update(
+                    {"Storys": self.stories_to_list(value)})
+            case "Zeichner:" | "Autor:" | "Charaktere:" | "Zielgruppe:" | "Genre:" \
+                    | "Thema:" | "Marke:":  # as list[str]
+                comic_information.update({key.removesuffix(":"):
+                                          value.split(", ")})
+            case "Seitenzahl:":  # as int
+                comic_information.update({"Seitenzahl": int(value)})
+            case "Serienstart:" | "Einsteigerfreundlich:":
+                comic_information.update({key.removesuffix(":"):
+                                          value == "Ja"})
+            case "Limitierte Auflage:":  # as list[int]
+                comic_information.update({"Limitierte Auflage":
+                                          list(map(int, value.split(", ")))})
+            case _:  # just normal str
+                comic_information.update(
+                    {key.removesuffix(":"): value})
+
+    def parse_comic_information(self, content: bytes, url: str) -> dict:
+        """Parses the html of a paninishop comic site for information about a comic.
+
+        Arguments:
+            - content: the html of the site.
             - url: the site with the comic.
 
         Returns:
-            The information in a dictionary (in a list, doesn't work otherwise).
+            The information in a dictionary.
         """
-        response = requests.get(url, timeout=10,
-                                headers={"User-Agent": random.choice(USER_AGENTS)})
-        soup = bs4.BeautifulSoup(response.content, "lxml")
+        if self.parser == "lxml":
+            return self.parse_comic_information_lxml(content, url)
+        soup = bs4.BeautifulSoup(content, "lxml")
         # basic information
         title = typing.cast(bs4.Tag, soup.find("h1", class_="product--title")
                             ).text.strip()
@@ -265,141 +749,620 @@ class Apollo:
                              "Status": status}
         # more information
         for item in soup.find_all("li", class_="base-info--entry"):
-            value = item.find("span").text.strip()
-            match key := item.find("strong").text.strip():
-                case "Artikel-Nr.:":  # rename key
-                    comic_information.update({"Artikelnummer": value})
-                case "Erscheint am:":  # as ISO 8601 format
-                    comic_information.update({"Erscheinungsdatum":
-                                              "-".join(value.split(".")[::-1])})
-                case "Limitierte Auflage:":  # as list[int]
-                    comic_information.update({"Limitierte Auflage":
-                                              [int(number) for number in value.split(", ")]})
-                case _:  # just normal str
-                    comic_information.update(
-                        {key.removesuffix(":"): value})
+            self.add_base_info(comic_information, item.find("strong").text.strip(),
+                               item.find("span").text.strip())
         # extra information in table
         for item in soup.find_all("tr", class_="product--properties-row"):
-            value = item.find("td",
-                              class_="product--properties-value").text.strip()
-            match key := item.find("td", class_="product--properties-label").text.strip():
-                # format information correctly as list[str]
-                case "Storys:":
-                    comic_information.update(
-                        {"Storys": self.stories_to_list(value)})
-                case "Zeichner:" | "Autor:" | "Charaktere:" | "Zielgruppe:" | "Genre:" \
-                        | "Thema:" | "Marke:":  # as list[str]
-                    comic_information.update({key.removesuffix(":"):
-                                              value.split(", ")})
-                case "Seitenzahl:":  # as int
-                    comic_information.update({"Seitenzahl": int(value)})
-                case "Serienstart:" | "Einsteigerfreundlich:":
-                    comic_information.update({key.removesuffix(":"):
-                                              value == "Ja"})
-                case "Limitierte Auflage:":  # as list[int]
-                    comic_information.update({"Limitierte Auflage":
-                                              list(map(int, value.split(", ")))})
-                case _:  # just normal str
-                    comic_information.update(
-                        {key.removesuffix(":"): value})
+            self.add_property(
+                comic_information,
+                item.find("td", class_="product--properties-label").text.strip(),
+                item.find("td", class_="product--properties-value").text.strip())
+        return comic_information
+
+    def parse_comic_information_lxml(self, content: bytes, url: str) -> dict:
+        """Parses the html of a paninishop comic site for information about a comic
+        with lxml and precompiled XPath (same result as parse_comic_information).
+
+        Arguments:
+            - content: the html of the site.
+            - url: the site with the comic.
+
+        Returns:
+            The information in a dictionary.
+        """
+        tree = self.lxml_tree(content)
+        # basic information
+        title = XPATH_TITLE(tree)[0].text_content().strip()
+        image = XPATH_IMAGE(tree)[0].get("data-img-original")
+        price = XPATH_PRICE(tree)
+        status = XPATH_STATUS(tree)[0].text_content().strip()
+        comic_information = {"Titel": title,
+                             "Bildlink": image,
+                             "Link": url,
+                             "Preis": float(price[0].get("content")) if price else None,
+                             "Status": status}
+        # more information
+        for item in XPATH_BASE_INFO(tree):
+            self.add_base_info(comic_information,
+                               item.find(".//strong").text_content().strip(),
+                               item.find(".//span").text_content().strip())
+        # extra information in table
+        for item in XPATH_PROPERTIES(tree):
+            self.add_property(comic_information,
+                              XPATH_PROPERTY_LABEL(item)[0].text_content().strip(),
+                              XPATH_PROPERTY_VALUE(item)[0].text_content().strip())
+        return comic_information
+
+    def get_comic_information(self, url: str) -> dict:
+        """Scrapes the url for information about a comic.
+        Will only work with a paninishop comic site.
+
+        Arguments:
+            - url: the site with the comic.
+
+        Returns:
+            The information in a dictionary (in a list, doesn't work otherwise).
+        """
+        with metrics.timer("stage_seconds", stage="get_comic_information", step="fetch"):
+            response = fetch.get(url, timeout=self.timeout)
+        with metrics.timer("stage_seconds", stage="get_comic_information", step="parse"):
+            comic_information = self.parse_comic_information(response.content, url)
+        metrics.item("get_comic_information")
         self.log(logging.DEBUG, f"Got information about {comic_information['Titel']} "
                  f"from url {url}.")
         return comic_information
 
+    def image_writer(self) -> blobs.BlobWriter | blobs.Base64Writer:
+        """Open the destination of a downloaded image: the image store or a base64
+        encoded string if there is none.
+
+        Returns:
+            The writer; committing it returns the hash or the base64 encoded string.
+        """
+        return blobs.writer(self.image_store)
+
     def get_comic_image(self, url: str) -> str | None:
-        """Downloads the image at the url.
+        """Downloads the image at the url. Stops as soon as the first bytes are not a JPEG
+        and tries again with backoff.
 
         Arguments:
             - url: the url of the image.
 
         Returns:
-            The image as a base64 encoded string or None if failed.
+            The hash of the image in the image store (or the image as
+            base64 encoded string without one) or None if failed.
         """
-        image = b""
-        retries = 0
-        while not image.startswith(b"\xff\xd8\xff") and retries < 10:
-            image = requests.get(url, timeout=10, headers={
-                "User-Agent": random.choice(USER_AGENTS)}).content
-            retries += 1
-        if image.startswith(b"\xff\xd8\xff"):
-            image_string = base64.b64encode(image).decode("utf-8")
+        with metrics.timer("stage_seconds", stage="get_comic_image", step="fetch"):
+            image_string, retries = fetch.download(url, self.image_writer,
+                                                   (JPG_MAGIC_NUMBER,), timeout=self.timeout)
+        if image_string is not None:
+            metrics.item("get_comic_image")
             self.log(logging.DEBUG, f"Got image from '{url}' with "
                      f"{retries} tries.")
         else:
-            image_string = None
             self.log(logging.WARNING, f"Failed to get image from '{url}'.")
         return image_string
 
-    def main(self) -> None:
-        """It's just the main method. It's good practice, but, honestly, it only
-        exists because multiprocessing doesn't work otherwise. For some reason.
+    async def gather(self, func_name: str, coroutines: typing.Iterable[typing.Awaitable]
+                     ) -> list[typing.Any]:
+        """Await all coroutines concurrently. The async counterpart of poolmap.
+
+        Arguments:
+            - func_name: name of the function to log errors with.
+            - coroutines: the coroutines to await.
+
+        Returns:
+            The results of the coroutines that did not fail, in order.
         """
-        try:
-            # logging process setup
-            log_proc = multiprocessing.Process(target=self.logger_thread,
-                                               name="Logging")
-            log_proc.start()
+        result = []
+        for item in await asyncio.gather(*coroutines, return_exceptions=True):
+            if isinstance(item, Exception):
+                self.log(logging.ERROR, f"{item.__class__.__name__}: {item}", func_name)
+            else:
+                result.append(item)
+        return result
+
+    async def get_comic_links_async(self, fetcher: engine.AsyncEngine,
+                                    page_number: int) -> list[str]:
+        """Async version of get_comic_links.
+
+        Arguments:
+            - fetcher: the engine used for fetching and parsing.
+            - page_number: the number for the page.
 
+        Returns:
+            The links that were found.
+        """
+        with metrics.timer("stage_seconds", stage="get_comic_links", step="fetch"):
+            content = await fetcher.fetch(f"{self.checklist_url}?o=1&p={page_number}&n=100")
+        with metrics.timer("stage_seconds", stage="get_comic_links", step="parse"):
+            links = await fetcher.parse(self.profiled, "get_comic_links",
+                                        self.parse_comic_links, content)
+        metrics.item("get_comic_links")
+        self.log(logging.DEBUG, f"Got {len(links)} comic links from "
+                 f"page {page_number}.", "get_comic_links")
+        return links
+
+    async def get_comic_information_async(self, fetcher: engine.AsyncEngine, url: str) -> dict:
+        """Async version of get_comic_information.
+
+        Arguments:
+            - fetcher: the engine used for fetching and parsing.
+            - url: the site with the comic.
+
+        Returns:
+            The information in a dictionary.
+        """
+        with metrics.timer("stage_seconds", stage="get_comic_information", step="fetch"):
+            content = await fetcher.fetch(url)
+        with metrics.timer("stage_seconds", stage="get_comic_information", step="parse"):
+            comic_information = await fetcher.parse(self.profiled, "get_comic_information",
+                                                    self.parse_comic_information, content, url)
+        metrics.item("get_comic_information")
+        self.log(logging.DEBUG, f"Got information about {comic_information['Titel']} "
+                 f"from url {url}.", "get_comic_information")
+        return comic_information
+
+    async def get_comic_image_async(self, fetcher: engine.AsyncEngine, url: str) -> str | None:
+        """Async version of get_comic_image.
+
+        Arguments:
+            - fetcher: the engine used for fetching.
+            - url: the url of the image.
+
+        Returns:
+            The hash of the image in the image store (or the image as
+            base64 encoded string without one) or None if failed.
+        """
+        with metrics.timer("stage_seconds", stage="get_comic_image", step="fetch"):
+            image_string, retries = await fetcher.download(url, self.image_writer,
+                                                           (JPG_MAGIC_NUMBER,))
+        if image_string is not None:
+            metrics.item("get_comic_image")
+            self.log(logging.DEBUG, f"Got image from '{url}' with "
+                     f"{retries} tries.", "get_comic_image")
+        else:
+            self.log(logging.WARNING, f"Failed to get image from '{url}'.", "get_comic_image")
+        return image_string
+
+    def thumbnail_writer(self, catalog: writer.CatalogWriter
+                         ) -> typing.ContextManager[writer.Sink]:
+        """Get what the comics are written to: the catalog or, if there are thumbnails,
+        a writer that adds them first.
+
+        Arguments:
+            - catalog: the catalog.
+
+        Returns:
+            The writer (as context manager).
+        """
+        if not self.thumbnail_widths:
+            return contextlib.nullcontext(catalog)
+        return thumbnails.ThumbnailWriter(
+            catalog, "Bild", "Vorschaubilder", self.thumbnail_widths, self.thumbnail_format,
+            self.thumbnail_quality, self.thumbnails_only, self.image_store,
+            "comics.thumbnails.json")
+
+    def catalog_writer(self) -> writer.CatalogWriter | shards.ShardWriter:
+        """Get the writer for the comics: the catalog or, for a shard, the shard output.
+
+        Returns:
+            The writer.
+        """
+        if self.shard is not None:
+            return shards.ShardWriter(shards.shard_path("comics.json", *self.shard),
+                                      lambda comic: self.positions[comic["Link"]])
+        sinks: list[writer.Sink] = [
+            series_index.SeriesIndex("comics.series.json"),
+            delta.DeltaIndex("comics.hashes.json", "comics.delta.jsonl", ("Link", "Artikelnummer"))]
+        if self.database:
+            sinks.append(sqlite_catalog.SQLiteCatalog(self.database, create=True))
+        return writer.CatalogWriter("comics.json", sinks)
+
+    def crawl_pool(self, catalog: writer.Sink) -> None:
+        """Get links, information and images stage by stage with a process pool each.
+
+        Arguments:
+            - catalog: the writer every complete comic gets written to.
+
+        Returns:
+            Nothing.
+        """
+        # get the number of pages
+        start_time = time.monotonic()
+        page = fetch.get(f"{self.checklist_url}?o=1&n=100", timeout=self.timeout)
+        page_numbers = self.page_count = self.parse_page_numbers(page.content)
+        self.log(logging.INFO, f"Got {page_numbers} as number of pages in "
+                 f"{round(time.monotonic() - start_time, 2)} seconds.")
+
+        # get all the links for comics on the checklist
+        log_transport.total("links", page_numbers)
+        start_time = time.monotonic()
+        comic_links = sum((self.select(page_number, links)
+                           for page_number, links in self.resumable_imap(
+            "page", self.get_comic_links, list(range(1, page_numbers + 1)))), [])
+        comic_links = [link for link in comic_links
+                       if isinstance(link, str)]
+        self.log(logging.INFO, f"Got {len(comic_links)} comic links in "
+                 f"{round(time.monotonic() - start_time, 2)} seconds.")
+
+        # get the data for the comics
+        log_transport.total("info", len(comic_links))
+        start_time = time.monotonic()
+        comic_data = [comic for _, comic in self.resumable_imap(
+            "info", self.get_comic_information, comic_links)]
+        self.log(logging.INFO, f"Got information about {len(comic_data)} "
+                 f"comics in {round(time.monotonic() - start_time, 2)} seconds.")
+
+        # get the images for the comic and write every comic as soon as it is complete
+        log_transport.total("image", len(comic_data))
+        start_time = time.monotonic()
+        comic_images = 0
+        # the map comes first, so it runs to the end
+        for (_, image), comic in zip(self.resumable_imap(
+                "image", self.get_comic_image, [comic["Bildlink"] for comic in comic_data],
+                keep_failed=True), comic_data):
+            catalog.write(comic | {"Bild": image})
+            comic_images += image is not None
+        self.log(logging.INFO, f"Got {comic_images} images in "
+                 f"{round(time.monotonic() - start_time, 2)} seconds.")
+
+    async def crawl_async(self, catalog: writer.Sink) -> None:
+        """Get links, information and images stage by stage with the asyncio fetch engine.
+
+        Arguments:
+            - catalog: the writer every complete comic gets written to.
+
+        Returns:
+            Nothing.
+        """
+        async with engine.AsyncEngine(fetch.USER_AGENTS, self.requests_in_flight,
+                                      timeout=self.timeout,
+                                      parse_workers=self.parse_workers) as fetcher:
             # get the number of pages
             start_time = time.monotonic()
-            page = requests.get("https://paninishop.de/checkliste/dc-comics/?o=1&n=100",
-                                timeout=10, headers={"User-Agent": random.choice(USER_AGENTS)})
-            soup = bs4.BeautifulSoup(page.content, "lxml")
-            page_numbers = int(typing.cast(
-                bs4.Tag, typing.cast(bs4.Tag, soup.find("span", class_="paging--display")
-                                     ).find("strong")).text.strip())
+            page_numbers = self.page_count = await fetcher.parse(
+                self.parse_page_numbers, await fetcher.fetch(f"{self.checklist_url}?o=1&n=100"))
             self.log(logging.INFO, f"Got {page_numbers} as number of pages in "
                      f"{round(time.monotonic() - start_time, 2)} seconds.")
 
             # get all the links for comics on the checklist
-            self.logger_queue.put(("links", page_numbers))
+            log_transport.total("links", page_numbers)
             start_time = time.monotonic()
-            comic_links = sum(self.poolmap(self.get_comic_links,
-                                           list(range(1, page_numbers + 1))), [])
-            comic_links = [link for link in comic_links
-                           if isinstance(link, str)]
+            async def get_links(page_number: int) -> list[str]:
+                return self.select(page_number, await self.resumable(
+                    "page", str(page_number), self.get_comic_links_async, fetcher, page_number))
+
+            comic_links = sum(await self.gather("get_comic_links", (
+                get_links(page_number) for page_number in range(1, page_numbers + 1))), [])
             self.log(logging.INFO, f"Got {len(comic_links)} comic links in "
                      f"{round(time.monotonic() - start_time, 2)} seconds.")
 
             # get the data for the comics
-            self.logger_queue.put(("info", len(comic_links)))
+            log_transport.total("info", len(comic_links))
             start_time = time.monotonic()
-            comic_data = self.poolmap(self.get_comic_information, comic_links)
+            comic_data = await self.gather("get_comic_information", (
+                self.resumable("info", link, self.get_comic_information_async, fetcher, link)
+                for link in comic_links))
             self.log(logging.INFO, f"Got information about {len(comic_data)} "
                      f"comics in {round(time.monotonic() - start_time, 2)} seconds.")
 
-            # get the images for the comic
-            self.logger_queue.put(("image", len(comic_data)))
+            # get the images for the comic and write every comic as soon as it is complete
+            log_transport.total("image", len(comic_data))
             start_time = time.monotonic()
-            comic_images = self.poolmap(self.get_comic_image, [comic["Bildlink"]
-                                                               for comic in comic_data])
-            self.log(logging.INFO, f"Got {len(comic_images)} images in "
+            ordered = writer.OrderedWriter(catalog)
+            ordered.expect(0, len(comic_data))
+            comic_images = 0
+
+            async def get_image(index: int, comic: dict) -> None:
+                nonlocal comic_images
+                image = None
+                try:
+                    image = await self.resumable("image", comic["Bildlink"],
+                                                 self.get_comic_image_async, fetcher,
+                                                 comic["Bildlink"])
+                    comic_images += image is not None
+                except Exception as excp:  # pylint: disable=broad-except
+                    self.log(logging.ERROR, f"{excp.__class__.__name__}: {excp}",
+                             "get_comic_image")
+                ordered.put(0, index, comic | {"Bild": image})
+
+            await asyncio.gather(*(get_image(index, comic)
+                                   for index, comic in enumerate(comic_data)))
+            self.log(logging.INFO, f"Got {comic_images} images in "
                      f"{round(time.monotonic() - start_time, 2)} seconds.")
 
-            # store data in JSON file
+    async def run_stage(self, func_name: str,
+                        handle: typing.Callable[[typing.Any], typing.Awaitable],
+                        inbox: asyncio.Queue, workers: int,
+                        outbox: asyncio.Queue | None = None, outbox_workers: int = 0) -> None:
+        """Run one stage of the streaming pipeline. Takes items from the inbox until every
+        worker got None and then tells the workers of the next stage to stop.
+
+        Arguments:
+            - func_name: name of the function to log errors with.
+            - handle: coroutine function that handles an item (and puts results in the outbox).
+            - inbox: queue with the items for this stage.
+            - workers: number of workers for this stage.
+            - outbox: queue of the next stage.
+            - outbox_workers: number of workers of the next stage.
+
+        Returns:
+            Nothing.
+        """
+        async def worker() -> None:
+            while (item := await inbox.get()) is not None:
+                try:
+                    await handle(item)
+                except Exception as excp:  # pylint: disable=broad-except
+                    self.log(logging.ERROR, f"{excp.__class__.__name__}: {excp}", func_name)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if outbox is not None:
+            for _ in range(outbox_workers):
+                await outbox.put(None)
+
+    async def crawl_pipeline(self, catalog: writer.Sink) -> None:
+        """Get links, information and images in a streaming pipeline. Every link goes straight
+        to the information stage and every image link straight to the image stage, the stages
+        are connected with bounded queues.
+
+        Arguments:
+            - catalog: the writer every complete comic gets written to (in the same
+            order as the other modes).
+
+        Returns:
+            Nothing.
+        """
+        async with engine.AsyncEngine(fetch.USER_AGENTS, self.requests_in_flight,
+                                      timeout=self.timeout,
+                                      parse_workers=self.parse_workers) as fetcher:
+            # get the number of pages
+            start_time = time.monotonic()
+            page_numbers = self.page_count = await fetcher.parse(
+                self.parse_page_numbers, await fetcher.fetch(f"{self.checklist_url}?o=1&n=100"))
+            self.log(logging.INFO, f"Got {page_numbers} as number of pages in "
+                     f"{round(time.monotonic() - start_time, 2)} seconds.")
+
+            # queues between the stages; items are tagged with (page number, index on page)
+            workers = self.requests_in_flight
+            pages: asyncio.Queue = asyncio.Queue()
+            infos: asyncio.Queue = asyncio.Queue(self.queue_size)
+            images: asyncio.Queue = asyncio.Queue(self.queue_size)
+            for page_number in range(1, page_numbers + 1):
+                pages.put_nowait(page_number)
+            for _ in range(workers):
+                pages.put_nowait(None)
+            totals = {"info": 0, "image": 0, "done": 0}
+            # comics are completed out of order, put them back in order for the catalog
+            ordered = writer.OrderedWriter(catalog, first_group=1)
+
+            async def links_stage(page_number: int) -> None:
+                try:
+                    links = self.select(page_number, await self.resumable(
+                        "page", str(page_number), self.get_comic_links_async, fetcher,
+                        page_number))
+                except Exception:
+                    ordered.expect(page_number, 0)
+                    raise
+                ordered.expect(page_number, len(links))
+                totals["info"] += len(links)
+                log_transport.total("info", totals["info"])
+                for index, link in enumerate(links):
+                    await infos.put(((page_number, index), link))
+
+            async def info_stage(item: tuple[tuple[int, int], str]) -> None:
+                try:
+                    comic = await self.resumable("info", item[1],
+                                                 self.get_comic_information_async, fetcher,
+                                                 item[1])
+                except Exception:
+                    ordered.put(*item[0], None)
+                    raise
+                totals["image"] += 1
+                log_transport.total("image", totals["image"])
+                await images.put((item[0], comic))
+
+            async def image_stage(item: tuple[tuple[int, int], dict]) -> None:
+                image = None
+                try:
+                    image = await self.resumable("image", item[1]["Bildlink"],
+                                                 self.get_comic_image_async, fetcher,
+                                                 item[1]["Bildlink"])
+                    totals["done"] += image is not None
+                finally:
+                    ordered.put(*item[0], item[1] | {"Bild": image})
+
+            async def timed(stage: typing.Awaitable, message: typing.Callable[[], str]) -> None:
+                await stage
+                self.log(logging.INFO, f"{message()} in "
+                         f"{round(time.monotonic() - start_time, 2)} seconds.", "crawl_pipeline")
+
+            log_transport.total("links", page_numbers)
+            log_transport.total("info", 0)
+            log_transport.total("image", 0)
             start_time = time.monotonic()
-            for comic, image in zip(comic_data, comic_images):
-                comic["Bild"] = image
-            comics = {"_default": {str(index): comic
-                                   for index, comic in enumerate(comic_data)}}
-            with open("comics.json", "w", encoding="utf-8") as file:
-                json.dump(comics, file)
-            self.log(logging.INFO, f"Saved {len(comics['_default'])} comics to "
-                     f"file in {round(time.monotonic() - start_time, 2)} seconds.")
+            await asyncio.gather(
+                timed(self.run_stage("get_comic_links", links_stage, pages, workers,
+                                     infos, workers),
+                      lambda: f"Got {totals['info']} comic links"),
+                timed(self.run_stage("get_comic_information", info_stage, infos, workers,
+                                     images, workers),
+                      lambda: f"Got information about {totals['image']} comics"),
+                timed(self.run_stage("get_comic_image", image_stage, images, workers),
+                      lambda: f"Got {totals['done']} images"))
+
+    def main(self) -> None:
+        """It's just the main method. It's good practice, but, honestly, it only
+        exists because multiprocessing doesn't work otherwise. For some reason.
+        """
+        try:
+            # logging process setup
+            log_proc = multiprocessing.Process(target=self.logger_thread,
+                                               args=(self.logger_queue, self.rate_controller),
+                                               name="Logging")
+            log_proc.start()
+            self.init_worker(self.logger_queue, self.rate_controller)
+
+            # finished work of an interrupted run is taken from the checkpoint
+            if self.checkpoint_path and not self.merge_shards:
+                self.checkpoint = checkpoint.Checkpoint(
+                    self.checkpoint_path,
+                    {"images": self.image_store.directory if self.image_store else None,
+                     "shard": self.shard}, self.checkpoint_max_age)
+                done = {kind: states.get(checkpoint.DONE, 0)
+                        for kind, states in self.checkpoint.counts().items()}
+                if any(done.values()):
+                    started = datetime.datetime.fromtimestamp(self.checkpoint.started)
+                    self.log(logging.INFO, f"Resuming the run from {started:%Y-%m-%d %H:%M:%S}: "
+                             f"{done.get('page', 0)} pages, {done.get('info', 0)} comics and "
+                             f"{done.get('image', 0)} images are done.")
+
+            if self.profile_directory:
+                profiling.clear(self.profile_directory)
+
+            # get links, information and images; every comic is written as soon as
+            # it is complete and the JSON file gets finalized at the end
+            if self.shard is not None:
+                self.log(logging.INFO, f"Getting shard {self.shard[0]} of {self.shard[1]}.")
+            with self.catalog_writer() as catalog, self.thumbnail_writer(catalog) as output:
+                if self.merge_shards:
+                    # the shards already made the thumbnails
+                    merged, duplicates = shards.merge(
+                        [shards.shard_path("comics.json", shard, self.merge_shards)
+                         for shard in range(self.merge_shards)], catalog)
+                    self.log(logging.INFO, f"Merged {merged} comics from {self.merge_shards} "
+                             f"shards, dropped {duplicates} duplicates.")
+                elif self.mode == "async":
+                    asyncio.run(self.crawl_async(output))
+                elif self.mode == "pipeline":
+                    asyncio.run(self.crawl_pipeline(output))
+                else:
+                    with self.pooled():
+                        self.crawl_pool(output)
+                if not self.merge_shards:
+                    self.list_comics(catalog)
+                start_time = time.monotonic()
+            if isinstance(output, thumbnails.ThumbnailWriter):
+                self.log(logging.INFO, f"Made thumbnails of {output.made} covers, "
+                         f"{output.reused} were still up to date.")
+            self.log(logging.INFO, f"Saved {catalog.count} comics to "
+                     f"'{catalog.path}' in {round(time.monotonic() - start_time, 2)} seconds.")
+            for sink in catalog.sinks if isinstance(catalog, writer.CatalogWriter) else []:
+                if isinstance(sink, delta.DeltaIndex):
+                    self.log(logging.INFO, sink.summary())
+
+            # all workers have exited and saved their profiles
+            if self.profile_directory:
+                profiled = profiling.merge(self.profile_directory)
+                self.log(logging.INFO, f"Wrote the profiles of {len(profiled)} stages to "
+                         f"'{self.profile_directory}'.")
+
+            # keep the cache within its size limit
+            if self.cache is not None:
+                deleted, size = self.cache.prune()
+                self.log(logging.INFO, f"Deleted {deleted} responses from the cache, "
+                         f"{round(size / 1024 ** 2, 2)} MiB left.")
+
+            # a complete run does not need its checkpoint anymore, unless items failed
+            if self.checkpoint is not None:
+                failed = sum(states.get(checkpoint.FAILED, 0)
+                             for states in self.checkpoint.counts().values())
+                if failed:
+                    self.checkpoint.close()
+                    self.log(logging.WARNING, f"{failed} items failed, run again to retry "
+                             f"them (finished ones are kept in '{self.checkpoint_path}').")
+                else:
+                    self.checkpoint.finish()
 
             # stop logging
+            log_transport.flush()
             self.logger_queue.put(False)
             log_proc.join()
         except (KeyboardInterrupt, Exception) as excp:  # pylint: disable=broad-except
             self.log(logging.ERROR, f"{excp.__class__.__name__}: {excp}")
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+                self.log(logging.INFO, f"Finished work is kept in '{self.checkpoint_path}', "
+                         "run again to resume.")
             # also stop logging
+            log_transport.flush()
             self.logger_queue.put(False)
             log_proc.join()
             self.log(logging.INFO, "Exiting.")
 
 
 if __name__ == "__main__":
-    Apollo().main()
+    parser = argparse.ArgumentParser(description="Get all the comics from the paninishop "
+                                     "dc comics checklist.")
+    parser.add_argument("--mode", choices=["pool", "async", "pipeline"], default="pool",
+                        help="execution mode for fetching and parsing")
+    parser.add_argument("--requests-in-flight", type=int, default=64,
+                        help="maximum number of requests at the same time "
+                        "(async and pipeline only)")
+    parser.add_argument("--parse-workers", type=int, default=2,
+                        help="number of processes used for parsing (async and pipeline only)")
+    parser.add_argument("--queue-size", type=int, default=256,
+                        help="maximum number of items between two stages (pipeline only)")
+    parser.add_argument("--timeout", type=float, default=10,
+                        help="timeout for each request in seconds")
+    parser.add_argument("--pool-connections", type=int, default=4,
+                        help="number of hosts to keep connections for per session")
+    parser.add_argument("--pool-maxsize", type=int, default=4,
+                        help="maximum number of keep-alive connections per host and session")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="cache responses in this directory and revalidate them")
+    parser.add_argument("--cache-ttl", type=float, default=12 * 60 * 60,
+                        help="seconds a cached response is used without asking the server")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum size of the cache in MiB")
+    parser.add_argument("--offline", action="store_true",
+                        help="only use the cache (e.g. to rerun the parsers)")
+    parser.add_argument("--images", metavar="DIRECTORY",
+                        help="store the images in this directory and only their hashes in "
+                        "the JSON file")
+    parser.add_argument("--database", metavar="PATH",
+                        help="also write the comics to an indexed SQLite catalog")
+    parser.add_argument("--parser", choices=["bs4", "lxml"], default="bs4",
+                        help="parse the sites with BeautifulSoup or with lxml and XPath (faster)")
+    parser.add_argument("--max-concurrency", type=int, default=16,
+                        help="maximum number of requests per host at the same time; the actual "
+                        "limit adapts to the host (pool mode uses this many processes)")
+    parser.add_argument("--thumbnails", metavar="WIDTHS",
+                        type=lambda widths: [int(width) for width in widths.split(",")],
+                        help="make thumbnails of the covers with these widths, e.g. 100,300")
+    parser.add_argument("--thumbnail-format", choices=["jpeg", "webp"], default="jpeg",
+                        help="format of the thumbnails")
+    parser.add_argument("--thumbnail-quality", type=int, default=80,
+                        help="quality of the thumbnails (1-100)")
+    parser.add_argument("--thumbnails-only", action="store_true",
+                        help="keep only the thumbnails, the biggest one replaces the cover")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="keep finished work in this SQLite database, so an interrupted "
+                        "run resumes where it stopped")
+    parser.add_argument("--checkpoint-max-age", type=float, default=24,
+                        help="hours after which a checkpoint is too old to resume")
+    parser.add_argument("--shard", metavar="I/N", type=shards.parse_shard,
+                        help="only get the comics of shard I of N (e.g. 0/4) and write them "
+                        "to 'comics.shard-I-of-N.jsonl'")
+    parser.add_argument("--checklist-url", default=CHECKLIST_URL,
+                        help="url of the checklist, e.g. of a local standin.py")
+    parser.add_argument("--merge-shards", metavar="N", type=int,
+                        help="merge the outputs of N shards into 'comics.json' and exit")
+    parser.add_argument("--profile", metavar="DIRECTORY",
+                        help="profile time and memory of every stage in all processes and "
+                        "write the merged profiles to this directory (slow)")
+    args = parser.parse_args()
+    response_cache = http_cache.HTTPCache(args.cache or "cache", args.cache_ttl,
+                                          args.cache_size * 1024 ** 2, args.offline) \
+        if args.cache or args.offline else None
+    Apollo(args.mode, args.requests_in_flight, args.parse_workers, args.timeout,
+           args.queue_size, args.pool_connections, args.pool_maxsize, response_cache,
+           blobs.BlobStore(args.images) if args.images else None, args.database,
+           args.parser, args.max_concurrency, args.thumbnails, args.thumbnail_format,
+           args.thumbnail_quality, args.thumbnails_only, args.checkpoint,
+           args.checkpoint_max_age * 60 * 60, args.shard, args.merge_shards,
+           args.checklist_url, args.profile).main()
 
 # TODO:
 # - better logging for errors
@@ -0,0 +1,164 @@
+"""Changes between runs. Every record gets a content hash (and every field a short one) under its
+key, e.g. the product link. Comparing them with the hashes of the previous run gives the records
+that were added, removed or changed (with the changed fields), so downstream consumers only have
+to read the delta file instead of diffing two catalogs.
+
+The delta file has one change per line:
+
+    {"change": "added", "key": ..., "record": {...}}
+    {"change": "changed", "key": ..., "fields": {...}, "removed_fields": [...]}
+    {"change": "removed", "key": ...}
+"""
+
+import hashlib
+import json
+import os
+import typing
+
+# hex digits of the field hashes, enough to tell the versions of a field apart
+FIELD_HASH_SIZE = 16
+
+
+def content_hash(value: typing.Any) -> str:
+    """Hash a JSON value. Independent of the key order of dictionaries.
+
+    Arguments:
+        - value: the value.
+
+    Returns:
+        The SHA-256 hash as hex string.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":"),
+                                     ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class DeltaIndex:
+    """The hashes of all records of a run. Can be used as a sink of writer.CatalogWriter; the
+    changes are written to the delta file while the records arrive and the hashes are saved
+    for the next run when it is closed.
+    """
+
+    def __init__(self, path: str, delta_path: str, keys: typing.Sequence[str]) -> None:
+        """Initialize the index and load the hashes of the previous run.
+
+        Arguments:
+            - path: path of the hash index, e.g. 'comics.hashes.json'.
+            - delta_path: path of the delta file, e.g. 'comics.delta.jsonl'.
+            - keys: the fields that identify a record, the first one a record has is used.
+
+        Returns:
+            Nothing.
+        """
+        self.path = path
+        self.delta_path = delta_path
+        self.keys = keys
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                self.previous: dict[str, dict[str, typing.Any]] = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.previous = {}
+        self.hashes: dict[str, dict[str, typing.Any]] = {}
+        # keys of all records of the run (e.g. the links on the checklist); a listed record
+        # that was not written (e.g. its page could not be fetched) keeps its hashes and is
+        # not removed. None if every record of the run is written.
+        self.listed: set[str] | None = None
+        self.counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "missing": 0}
+        # pylint: disable-next=consider-using-with
+        self.file = open(f"{delta_path}.tmp", "w", encoding="utf-8")
+
+    def key(self, record: dict) -> str | None:
+        """Get the key of a record.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            The value of the first key field the record has or None if it has none.
+        """
+        for key in self.keys:
+            if record.get(key):
+                return str(record[key])
+        return None
+
+    def change(self, change: str, key: str, **data: typing.Any) -> None:
+        """Write a change to the delta file.
+
+        Arguments:
+            - change: 'added', 'changed' or 'removed'.
+            - key: the key of the record.
+            - data: what changed.
+
+        Returns:
+            Nothing.
+        """
+        self.file.write(json.dumps({"change": change, "key": key} | data) + "\n")
+        self.counts[change] += 1
+
+    def write(self, record: dict) -> None:
+        """Hash a record and write its changes.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            Nothing.
+        """
+        key = self.key(record)
+        # records without key and repeated records can not be told apart
+        if key is None or key in self.hashes:
+            return
+        fields = {field: content_hash(value)[:FIELD_HASH_SIZE]
+                  for field, value in record.items()}
+        self.hashes[key] = {"hash": content_hash(record), "fields": fields}
+        previous = self.previous.get(key)
+        if previous is None:
+            self.change("added", key, record=record)
+        elif previous["hash"] != self.hashes[key]["hash"]:
+            self.change("changed", key, fields={
+                field: record[field] for field, field_hash in fields.items()
+                if previous["fields"].get(field) != field_hash},
+                removed_fields=[field for field in previous["fields"] if field not in fields])
+        else:
+            self.counts["unchanged"] += 1
+
+    def close(self) -> None:
+        """Write the removed records, finish the delta file and save the hashes.
+
+        Returns:
+            Nothing.
+        """
+        for key, previous in self.previous.items():
+            if key in self.hashes:
+                continue
+            if self.listed is not None and key in self.listed:
+                # still there, compared again by the next run
+                self.hashes[key] = previous
+                self.counts["missing"] += 1
+            else:
+                self.change("removed", key)
+        self.file.close()
+        os.replace(f"{self.delta_path}.tmp", self.delta_path)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.hashes, file)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def abort(self) -> None:
+        """Keep the old hashes and delta file, the run failed.
+
+        Returns:
+            Nothing.
+        """
+        self.file.close()
+        os.remove(f"{self.delta_path}.tmp")
+
+    def summary(self) -> str:
+        """Summarize the changes for logging.
+
+        Returns:
+            The number of added, changed, removed, unchanged and missing records.
+        """
+        missing = f", {self.counts['missing']} could not be compared" \
+            if self.counts["missing"] else ""
+        return (f"{self.counts['added']} records were added, {self.counts['changed']} changed "
+                f"and {self.counts['removed']} removed, {self.counts['unchanged']} are "
+                f"unchanged{missing} (see '{self.delta_path}').")
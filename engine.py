@@ -0,0 +1,255 @@
+"""Asynchronous fetch engine for apollo. Keeps a configurable number of requests in flight
+over pooled keep-alive connections and hands parsing off to a small process pool.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import random
+import time
+import typing
+import urllib.parse
+
+import aiohttp
+
+import fetch
+import http_cache
+import metrics
+import rate_control
+
+
+class AsyncEngine:
+    """Fetches urls with asyncio and parses the results in a process pool."""
+
+    def __init__(self, user_agents: list[str], requests_in_flight: int = 64,
+                 connections_per_host: int = 32, timeout: float = 10,
+                 parse_workers: int = 2, retries: int = 3) -> None:
+        """Initialize the engine. Nothing is opened until the engine is entered.
+
+        Arguments:
+            - user_agents: user agents to choose from for each request.
+            - requests_in_flight: maximum number of requests at the same time.
+            - connections_per_host: maximum number of open connections per host.
+            - timeout: timeout for each request in seconds.
+            - parse_workers: number of processes used for parsing.
+            - retries: how often a request is repeated on 429, 5xx or timeouts.
+
+        Returns:
+            Nothing.
+        """
+        self.user_agents = user_agents
+        self.requests_in_flight = requests_in_flight
+        self.connections_per_host = connections_per_host
+        self.timeout = timeout
+        self.parse_workers = parse_workers
+        self.retries = retries
+        self.session: aiohttp.ClientSession | None = None
+        self.executor: concurrent.futures.ProcessPoolExecutor | None = None
+        self.semaphore: asyncio.Semaphore | None = None
+
+    async def __aenter__(self) -> "AsyncEngine":
+        connector = aiohttp.TCPConnector(limit=self.requests_in_flight,
+                                         limit_per_host=self.connections_per_host,
+                                         keepalive_timeout=30)
+        # count connections and requests like the shared fetch layer does
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self.on_connection_create_end)
+        trace_config.on_request_end.append(self.on_request_end)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             trace_configs=[trace_config])
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.parse_workers)
+        self.semaphore = asyncio.Semaphore(self.requests_in_flight)
+        return self
+
+    async def __aexit__(self, *_: typing.Any) -> None:
+        await typing.cast(aiohttp.ClientSession, self.session).close()
+        typing.cast(concurrent.futures.ProcessPoolExecutor, self.executor).shutdown()
+
+    @staticmethod
+    async def on_connection_create_end(*_: typing.Any) -> None:
+        fetch.STATS.connection()
+
+    @staticmethod
+    async def on_request_end(*_: typing.Any) -> None:
+        fetch.STATS.request()
+
+    # defined before the fetch method, which hides the fetch module in the class body
+    async def download(self, url: str, destination: typing.Callable[[], fetch.Destination],
+                       magic_numbers: typing.Sequence[bytes], attempts: int = 5,
+                       max_size: int = fetch.MAX_DOWNLOAD_SIZE) -> tuple[typing.Any, int]:
+        """Async version of fetch.download: downloads a file chunk by chunk straight into
+        its destination and tries again with backoff if it is not valid.
+
+        Arguments:
+            - url: the url of the file.
+            - destination: opens the destination of the file, e.g. blobs.writer.
+            - magic_numbers: the file has to start with one of these.
+            - attempts: maximum number of attempts.
+            - max_size: maximum size of the file in bytes.
+
+        Returns:
+            What the destination returned on commit (None if all attempts failed)
+            and the number of attempts.
+        """
+        response_cache = fetch.cache()
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(rate_control.backoff(attempt - 1))
+            current = fetch.Download(destination, magic_numbers, max_size)
+            headers = {"User-Agent": random.choice(self.user_agents)}
+            entry = None
+            if response_cache is not None:
+                entry = response_cache.get(url)
+                if entry is not None and (response_cache.offline or entry.is_fresh()):
+                    fetch.STATS.cache_hit()
+                    result = current.run_entry(entry)
+                    if result is not None or response_cache.offline:
+                        return result, attempt + 1
+                    # an invalid body from an older run, ask the server
+                    current = fetch.Download(destination, magic_numbers, max_size)
+                    entry = None
+                elif response_cache.offline:
+                    raise http_cache.CacheMiss(url)
+                if entry is not None:
+                    headers |= entry.validators()
+
+            async def read(response: aiohttp.ClientResponse,
+                           current: fetch.Download = current) -> typing.Any:
+                if response.status != 200:
+                    return None
+                if response_cache is not None:
+                    current.cache_writer = functools.partial(
+                        response_cache.writer, url, response.status, response.headers)
+                try:
+                    async for data in response.content.iter_chunked(fetch.CHUNK_SIZE):
+                        if not current.feed(data):
+                            return None
+                except BaseException:
+                    current.abort()
+                    raise
+                finally:
+                    metrics.count("bytes_received", current.size,
+                                  host=urllib.parse.urlsplit(url).netloc)
+                return current.finish()
+
+            try:
+                async with typing.cast(asyncio.Semaphore, self.semaphore):
+                    response, result = await self.request(url, headers, read)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if attempt + 1 >= attempts:
+                    raise
+                continue
+            if response.status == 304 and entry is not None:
+                fetch.STATS.revalidated()
+                typing.cast(http_cache.HTTPCache, response_cache).refresh(
+                    entry, response.headers)
+                result = current.run_entry(entry)
+            if result is not None:
+                return result, attempt + 1
+            if current.size > max_size:
+                # will not get smaller
+                return None, attempt + 1
+        return None, attempts
+
+    async def fetch(self, url: str) -> bytes:
+        """Get the content at the url. Uses the cache and the rate controller of the fetch
+        layer like fetch.get.
+
+        Arguments:
+            - url: the url to get.
+
+        Returns:
+            The body of the response.
+        """
+        headers = {"User-Agent": random.choice(self.user_agents)}
+        response_cache = fetch.cache()
+        entry = None
+        if response_cache is not None:
+            entry = response_cache.get(url)
+            if entry is not None and (response_cache.offline or entry.is_fresh()):
+                fetch.STATS.cache_hit()
+                return entry.body()
+            if response_cache.offline:
+                raise http_cache.CacheMiss(url)
+            if entry is not None:
+                headers |= entry.validators()
+        async with typing.cast(asyncio.Semaphore, self.semaphore):
+            response, body = await self.request(url, headers)
+        if response_cache is not None:
+            if response.status == 304 and entry is not None:
+                fetch.STATS.revalidated()
+                response_cache.refresh(entry, response.headers)
+                return entry.body()
+            if response.status == 200:
+                response_cache.store(url, response.status, response.headers, body)
+        return body
+
+    async def request(self, url: str, headers: dict[str, str],
+                      read: typing.Callable[[aiohttp.ClientResponse], typing.Awaitable]
+                      | None = None) -> tuple[aiohttp.ClientResponse, typing.Any]:
+        """Send a request, waiting for a slot of the host if there is a rate controller.
+        429, 5xx and timeouts are retried after the Retry-After of the server or a backoff.
+
+        Arguments:
+            - url: the url to get.
+            - headers: the headers of the request.
+            - read: reads the body of the response; by default it is read completely.
+
+        Returns:
+            The response (the last one if all attempts were overloaded) and what was read.
+        """
+        controller = fetch.rate_controller()
+        host = urllib.parse.urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if controller is not None:
+                await controller.acquire_async(host)
+            start_time = time.monotonic()
+            response = None
+            body = None
+            wait = None
+            try:
+                async with typing.cast(aiohttp.ClientSession, self.session).get(
+                        url, headers=headers) as response:
+                    body = await (read(response) if read is not None else response.read())
+                wait = rate_control.retry_after(response.headers.get("Retry-After"))
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+                response = None
+                if attempt >= self.retries:
+                    raise
+            finally:
+                latency = time.monotonic() - start_time
+                if controller is not None:
+                    controller.release(host, latency,
+                                       response.status if response is not None else None, wait)
+                metrics.observe("request_seconds", latency, host=host)
+                metrics.count("requests", host=host,
+                              status=response.status if response is not None else "error")
+                if attempt:
+                    metrics.count("retries", host=host)
+                if response is not None:
+                    metrics.count("bytes_sent", metrics.request_size(
+                        "GET", url, response.request_info.headers), host=host)
+                    if read is None and body is not None:
+                        # streamed bodies are counted by download while they are read
+                        metrics.count("bytes_received", len(body), host=host)
+            if response is not None and (response.status not in rate_control.RETRY_STATUSES
+                                         or attempt >= self.retries):
+                return response, body
+            await asyncio.sleep(rate_control.backoff(
+                attempt, None if controller is not None else wait))
+            attempt += 1
+
+    async def parse(self, func: typing.Callable, *args: typing.Any) -> typing.Any:
+        """Run a (cpu heavy) function in the process pool.
+
+        Arguments:
+            - func: function to apply; has to be picklable.
+            - args: arguments for the function.
+
+        Returns:
+            The result of the function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
@@ -0,0 +1,597 @@
+"""Shared fetch layer for comics.py and halo_novels.py. Keeps one pooled keep-alive session
+per process and thread, asks for compressed responses and counts how often connections
+actually get reused. With a rate controller, requests wait for a slot of their host and
+overloaded hosts (429, 5xx, timeouts) are retried with backoff.
+"""
+
+import functools
+import os
+import random
+import threading
+import time
+import typing
+import urllib.parse
+
+import requests
+import requests.adapters
+import requests.structures
+import urllib3
+import urllib3.util.request
+
+import http_cache
+import metrics
+import rate_control
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:53.0) Gecko/20100101 Firefox/53.0",
+    "Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:47.0) Gecko/20100101 Firefox/47.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/91.0.4472.124",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/91.0.4472.124",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/58.0.3029.110 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/51.0.2704.103 Safari/537.36"
+]
+# gzip and deflate always, br (and zstd) only if urllib3 is able to decode it
+ACCEPT_ENCODING = urllib3.util.request.ACCEPT_ENCODING
+CHUNK_SIZE = 64 * 1024
+MAX_DOWNLOAD_SIZE = 20 * 1024 ** 2
+
+
+class Destination(typing.Protocol):
+    """Where a download goes chunk by chunk, e.g. a blob store or the http cache."""
+
+    def write(self, data: bytes) -> None:
+        """Add a chunk."""
+
+    def commit(self) -> typing.Any:
+        """Finish after the last chunk."""
+
+    def abort(self) -> None:
+        """Throw away what was written."""
+
+
+class Download:
+    """Checks a body while it arrives: it has to start with one of the magic numbers and must
+    not get bigger than the maximum size. The destinations are only opened once the magic
+    number matched and get the chunks right away, so the body is never held in memory.
+    """
+
+    def __init__(self, destination: typing.Callable[[], Destination],
+                 magic_numbers: typing.Sequence[bytes], max_size: int = MAX_DOWNLOAD_SIZE,
+                 cache_writer: typing.Callable[[], Destination] | None = None) -> None:
+        """Initialize the download.
+
+        Arguments:
+            - destination: opens the destination of the body.
+            - magic_numbers: the body has to start with one of these.
+            - max_size: maximum size of the body in bytes.
+            - cache_writer: opens the cache entry for the body or None.
+
+        Returns:
+            Nothing.
+        """
+        self.destination = destination
+        self.magic_numbers = magic_numbers
+        self.max_size = max_size
+        self.cache_writer = cache_writer
+        self.head: bytes | None = b""
+        self.size = 0
+        self.error = ""
+        self.writers: list[Destination] = []
+
+    def feed(self, data: bytes) -> bool:
+        """Add a chunk of the body.
+
+        Arguments:
+            - data: the chunk.
+
+        Returns:
+            False if the body is not valid (see error); the download was then aborted.
+        """
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.error = f"bigger than {self.max_size} bytes"
+            self.abort()
+            return False
+        if self.head is not None:
+            self.head += data
+            if not any(self.head[:len(magic_number)] == magic_number[:len(self.head)]
+                       for magic_number in self.magic_numbers):
+                self.error = f"starts with {self.head[:8]!r}, not with a magic number"
+                self.abort()
+                return False
+            if not any(self.head.startswith(magic_number)
+                       for magic_number in self.magic_numbers):
+                # too short to tell yet
+                return True
+            data, self.head = self.head, None
+            self.writers = [self.destination()]
+            if self.cache_writer is not None:
+                self.writers.append(self.cache_writer())
+        for destination in self.writers:
+            destination.write(data)
+        return True
+
+    def finish(self) -> typing.Any:
+        """Finish after the last chunk.
+
+        Returns:
+            What the destination returned on commit or None if the body is not valid.
+        """
+        if self.head is not None:
+            self.error = "too short for a magic number"
+            return None
+        results = [destination.commit() for destination in self.writers]
+        return results[0]
+
+    def abort(self) -> None:
+        """Throw away what was written.
+
+        Returns:
+            Nothing.
+        """
+        for destination in self.writers:
+            destination.abort()
+        self.writers = []
+
+    def run(self, chunks: typing.Iterable[bytes]) -> typing.Any:
+        """Feed all chunks of a body and finish.
+
+        Arguments:
+            - chunks: the chunks.
+
+        Returns:
+            What the destination returned on commit or None if the body is not valid.
+        """
+        try:
+            for data in chunks:
+                if not self.feed(data):
+                    return None
+        except BaseException:
+            self.abort()
+            raise
+        return self.finish()
+
+    def run_entry(self, entry: http_cache.Entry) -> typing.Any:
+        """Feed the body of a cache entry and finish.
+
+        Arguments:
+            - entry: the cache entry.
+
+        Returns:
+            What the destination returned on commit or None if the body is not valid.
+        """
+        with entry.open() as body:
+            return self.run(iter(lambda: body.read(CHUNK_SIZE), b""))
+
+
+class Stats:
+    """Counts opened connections and served requests of this process."""
+
+    def __init__(self) -> None:
+        """Initialize the counters.
+
+        Returns:
+            Nothing.
+        """
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.connections = 0
+        self.requests = 0
+        self.cached = 0
+        self.not_modified = 0
+
+    def check_process(self) -> None:
+        """Reset the counters if this is a forked process; they belong to the parent.
+
+        Returns:
+            Nothing.
+        """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connections = 0
+            self.requests = 0
+            self.cached = 0
+            self.not_modified = 0
+
+    def connection(self) -> None:
+        """Count an opened connection.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.check_process()
+            self.connections += 1
+
+    def request(self) -> None:
+        """Count a served request.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.check_process()
+            self.requests += 1
+
+    def cache_hit(self) -> None:
+        """Count a response that was served from the cache without a request.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.check_process()
+            self.cached += 1
+
+    def revalidated(self) -> None:
+        """Count a conditional request that was answered with 304 Not Modified.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.check_process()
+            self.not_modified += 1
+
+    def as_dict(self) -> dict[str, int]:
+        """Get the counters.
+
+        Returns:
+            The counters as a dictionary.
+        """
+        with self.lock:
+            self.check_process()
+            return {"connections": self.connections, "requests": self.requests,
+                    "cached": self.cached, "not_modified": self.not_modified}
+
+
+STATS = Stats()
+_settings: dict[str, typing.Any] = {"pool_connections": 4, "pool_maxsize": 4,
+                                   "cache": None, "rate_controller": None, "retries": 3}
+_local = threading.local()
+
+
+class CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    """Connection pool that counts every new connection."""
+
+    def _new_conn(self) -> typing.Any:
+        STATS.connection()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    """Connection pool that counts every new connection (https)."""
+
+    def _new_conn(self) -> typing.Any:
+        STATS.connection()
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    """Adapter that uses the counting connection pools."""
+
+    def init_poolmanager(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool,
+                                                   "https": CountingHTTPSConnectionPool}
+
+
+def configure(pool_connections: int = 4, pool_maxsize: int = 4,
+              cache: http_cache.HTTPCache | None = None,
+              rate_controller: rate_control.RateController | None = None,
+              retries: int = 3) -> None:
+    """Set the pool sizes for sessions that get created from now on, the cache and
+    the rate controller. Can be used as initializer for a process pool.
+
+    Arguments:
+        - pool_connections: number of hosts to keep connection pools for.
+        - pool_maxsize: maximum number of connections kept per host.
+        - cache: the http cache to use or None to always ask the server.
+        - rate_controller: the controller shared by all processes or None to not limit
+        the requests per host.
+        - retries: how often a request is repeated on 429, 5xx or timeouts.
+
+    Returns:
+        Nothing.
+    """
+    _settings.update(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                     cache=cache, rate_controller=rate_controller, retries=retries)
+
+
+def cache() -> http_cache.HTTPCache | None:
+    """Get the configured http cache.
+
+    Returns:
+        The cache or None if there is none.
+    """
+    return _settings["cache"]
+
+
+def rate_controller() -> rate_control.RateController | None:
+    """Get the configured rate controller.
+
+    Returns:
+        The controller or None if there is none.
+    """
+    return _settings["rate_controller"]
+
+
+def cached_response(entry: http_cache.Entry) -> requests.Response:
+    """Build a response from a cache entry.
+
+    Arguments:
+        - entry: the cache entry.
+
+    Returns:
+        The response.
+    """
+    response = requests.Response()
+    response.status_code = entry.meta["status"]
+    response.url = entry.url
+    response.headers = requests.structures.CaseInsensitiveDict(entry.headers)
+    response._content = entry.body()  # pylint: disable=protected-access
+    return response
+
+
+def session() -> requests.Session:
+    """Get the session of this process and thread. Creates it if there is none yet.
+
+    Returns:
+        The session.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        new_session = requests.Session()
+        adapter = CountingHTTPAdapter(pool_connections=_settings["pool_connections"],
+                                      pool_maxsize=_settings["pool_maxsize"])
+        new_session.mount("http://", adapter)
+        new_session.mount("https://", adapter)
+        new_session.headers.update({"Accept-Encoding": ACCEPT_ENCODING})
+        _local.session = new_session
+        _local.pid = os.getpid()
+    return _local.session
+
+
+def get(url: str, timeout: float = 10, **kwargs: typing.Any) -> requests.Response:
+    """Get the url with the session of this process and thread and a random user agent.
+    If there is a cache, fresh responses come from the cache and stale ones are revalidated
+    with a conditional request.
+
+    Arguments:
+        - url: the url to get.
+        - timeout: timeout for the request in seconds.
+        - kwargs: passed on to requests.Session.get.
+
+    Returns:
+        The response.
+    """
+    headers = {"User-Agent": random.choice(USER_AGENTS)} | kwargs.pop("headers", {})
+    response_cache = cache()
+    entry = None
+    if response_cache is not None:
+        entry = response_cache.get(url)
+        if entry is not None and (response_cache.offline or entry.is_fresh()):
+            STATS.cache_hit()
+            return cached_response(entry)
+        if response_cache.offline:
+            raise http_cache.CacheMiss(url)
+        if entry is not None:
+            headers |= entry.validators()
+    response = request(url, timeout=timeout, headers=headers, **kwargs)
+    if response_cache is not None:
+        if response.status_code == 304 and entry is not None:
+            STATS.revalidated()
+            response_cache.refresh(entry, response.headers)
+            return cached_response(entry)
+        if response.status_code == 200:
+            response_cache.store(url, response.status_code, response.headers, response.content)
+    return response
+
+
+def download(url: str, destination: typing.Callable[[], Destination],
+             magic_numbers: typing.Sequence[bytes], timeout: float = 10, attempts: int = 5,
+             max_size: int = MAX_DOWNLOAD_SIZE) -> tuple[typing.Any, int]:
+    """Download a file (e.g. an image) chunk by chunk straight into its destination.
+    Stops reading as soon as the first bytes do not match a magic number (e.g. an error page)
+    or the file gets too big, and tries again after a jittered exponential backoff.
+    Uses the cache like get, but only stores valid files.
+
+    Arguments:
+        - url: the url of the file.
+        - destination: opens the destination of the file, e.g. blobs.writer.
+        - magic_numbers: the file has to start with one of these.
+        - timeout: timeout for the request in seconds.
+        - attempts: maximum number of attempts.
+        - max_size: maximum size of the file in bytes.
+
+    Returns:
+        What the destination returned on commit (None if all attempts failed)
+        and the number of attempts.
+    """
+    response_cache = cache()
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(rate_control.backoff(attempt - 1))
+        current = Download(destination, magic_numbers, max_size)
+        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        entry = None
+        if response_cache is not None:
+            entry = response_cache.get(url)
+            if entry is not None and (response_cache.offline or entry.is_fresh()):
+                STATS.cache_hit()
+                result = current.run_entry(entry)
+                if result is not None or response_cache.offline:
+                    return result, attempt + 1
+                # an invalid body from an older run, ask the server
+                current = Download(destination, magic_numbers, max_size)
+                entry = None
+            elif response_cache.offline:
+                raise http_cache.CacheMiss(url)
+            if entry is not None:
+                headers |= entry.validators()
+        try:
+            with request(url, timeout=timeout, headers=headers, stream=True) as response:
+                result = None
+                if response.status_code == 304 and entry is not None:
+                    STATS.revalidated()
+                    typing.cast(http_cache.HTTPCache, response_cache).refresh(
+                        entry, response.headers)
+                    result = current.run_entry(entry)
+                elif response.status_code == 200:
+                    if response_cache is not None:
+                        current.cache_writer = functools.partial(
+                            response_cache.writer, url, response.status_code, response.headers)
+                    try:
+                        result = current.run(response.iter_content(CHUNK_SIZE))
+                    finally:
+                        metrics.count("bytes_received", current.size,
+                                      host=urllib.parse.urlsplit(url).netloc)
+        except requests.RequestException:
+            if attempt + 1 >= attempts:
+                raise
+            continue
+        if result is not None:
+            return result, attempt + 1
+        if current.size > max_size:
+            # will not get smaller
+            return None, attempt + 1
+    return None, attempts
+
+
+def finish_request(url: str, start_time: float, response: requests.Response | None,
+                   wait: float | None, attempt: int, streamed: bool) -> None:
+    """Give back the slot of a request and record its metrics.
+
+    Arguments:
+        - url: the url of the request.
+        - start_time: when the request was sent (time.monotonic).
+        - response: the response or None if the request failed.
+        - wait: seconds from the Retry-After header or None.
+        - attempt: the number of the attempt (0 for the first one).
+        - streamed: whether the body was streamed (it is counted by download).
+
+    Returns:
+        Nothing.
+    """
+    controller = rate_controller()
+    host = urllib.parse.urlsplit(url).netloc
+    latency = time.monotonic() - start_time
+    if controller is not None:
+        controller.release(host, latency,
+                           response.status_code if response is not None else None, wait)
+    metrics.observe("request_seconds", latency, host=host)
+    metrics.count("requests", host=host, status=response.status_code
+                  if response is not None else "error")
+    if attempt:
+        metrics.count("retries", host=host)
+    if response is not None:
+        metrics.count("bytes_sent", metrics.request_size(
+            "GET", url, response.request.headers), host=host)
+        # streamed bodies are counted by download while they are read
+        if not streamed:
+            metrics.count("bytes_received", len(response.content), host=host)
+
+
+def finish_on_close(response: requests.Response, finish: typing.Callable[[], None]) -> None:
+    """Finish a streamed request when its response is closed, after its body was read.
+
+    Arguments:
+        - response: the response.
+        - finish: finishes the request.
+
+    Returns:
+        Nothing.
+    """
+    close = response.close
+
+    def close_and_finish() -> None:
+        try:
+            close()
+        finally:
+            # closing twice must not give back the slot twice
+            if response.close is close_and_finish:
+                response.close = close  # type: ignore[method-assign]
+                finish()
+
+    response.close = close_and_finish  # type: ignore[method-assign]
+
+
+def request(url: str, **kwargs: typing.Any) -> requests.Response:
+    """Send a request, waiting for a slot of the host if there is a rate controller.
+    429, 5xx and timeouts are retried after the Retry-After of the server or a backoff.
+    A streamed response keeps its slot until it is closed, so the time to read the body
+    counts as well; it has to be closed (e.g. used with 'with').
+
+    Arguments:
+        - url: the url to get.
+        - kwargs: passed on to requests.Session.get.
+
+    Returns:
+        The response (the last one if all attempts were overloaded).
+    """
+    controller = rate_controller()
+    host = urllib.parse.urlsplit(url).netloc
+    attempt = 0
+    while True:
+        if controller is not None:
+            controller.acquire(host)
+        start_time = time.monotonic()
+        response = None
+        wait = None
+        try:
+            response = session().get(url, **kwargs)
+            STATS.request()
+            wait = rate_control.retry_after(response.headers.get("Retry-After"))
+        except (requests.Timeout, requests.ConnectionError):
+            if attempt >= _settings["retries"]:
+                raise
+        finally:
+            finish = functools.partial(finish_request, url, start_time, response, wait,
+                                       attempt, bool(kwargs.get("stream")))
+            done = response is not None and (
+                response.status_code not in rate_control.RETRY_STATUSES
+                or attempt >= _settings["retries"])
+            if done and kwargs.get("stream"):
+                # the body is read after this returns
+                finish_on_close(typing.cast(requests.Response, response), finish)
+            else:
+                finish()
+        if done:
+            return typing.cast(requests.Response, response)
+        if response is not None:
+            response.close()
+        # the controller pauses the host for the Retry-After, so this is only the backoff
+        time.sleep(rate_control.backoff(attempt, None if controller is not None else wait))
+        attempt += 1
+
+
+def stats() -> dict[str, int]:
+    """Get the connection statistics of this process.
+
+    Returns:
+        Opened connections and served requests.
+    """
+    return STATS.as_dict()
+
+
+def summary(all_stats: typing.Iterable[dict[str, int]]) -> str:
+    """Summarize connection statistics, e.g. of multiple processes.
+
+    Arguments:
+        - all_stats: the statistics to summarize.
+
+    Returns:
+        A short text for logging.
+    """
+    connections = requests_served = cached = not_modified = 0
+    for item in all_stats:
+        connections += item["connections"]
+        requests_served += item["requests"]
+        cached += item["cached"]
+        not_modified += item["not_modified"]
+    return (f"Served {requests_served} requests over {connections} connections "
+            f"({round(requests_served / max(connections, 1), 2)} requests per connection), "
+            f"{cached} responses from the cache and {not_modified} not modified.")
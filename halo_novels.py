@@ -1,33 +1,41 @@
 """This programm gets all the halo novels from Halopedia."""
 
-import base64
+import argparse
+import concurrent.futures
+import contextlib
 import datetime
-import json
+import functools
 import logging
-import random
 import re
 import time
+import typing
+import urllib.parse
 
 import bs4
-import requests
+
+import blobs
+import delta
+import fetch
+import http_cache
+import metrics
+import rate_control
+import sqlite_catalog
+import thumbnails
+import writer
 
 
 FORMATTER = logging.Formatter(fmt="[{asctime}] - {levelname:>8}: {message}",
                               datefmt="%Y-%m-%dT%H:%M:%S", style="{")
-USER_AGENTS = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:53.0) Gecko/20100101 Firefox/53.0",
-    "Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:47.0) Gecko/20100101 Firefox/47.0",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/91.0.4472.124",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/91.0.4472.124",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/58.0.3029.110 Safari/537.36",
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 "
-    "Safari/537.36"
-]  # WHY? I'm not making that many requests
 JPG_MAGIC_NUMBER = b"\xff\xd8\xff"
 PNG_MAGIC_NUMBER = b"\x89\x50\x4e\x47\x0d\x0a\x1a\x0a"
+MAGIC_NUMBERS = {"image/jpeg": JPG_MAGIC_NUMBER, "image/png": PNG_MAGIC_NUMBER}
+HALOPEDIA_URL = "https://www.halopedia.org/"
+# maximum number of titles per API query (for clients without the apihighlimits right)
+API_BATCH_SIZE = 50
+# infobox parameters that can hold the publication date
+DATE_PARAMETERS = ("publication date", "publication_date", "release date", "release_date",
+                   "released", "published", "date")
+DATE = re.compile(r"[A-Z][a-z]+ \d{1,2}, \d{4}")
 
 # - get all tables (series) /in main
 # - get all novel links and basic info /in main
@@ -35,30 +43,231 @@ PNG_MAGIC_NUMBER = b"\x89\x50\x4e\x47\x0d\x0a\x1a\x0a"
 # - get image /in get_novel_image
 
 
-def get_novel_information(url: str) -> list[str]:
-    page = requests.get(url, timeout=10,
-                        headers={"User-Agent": random.choice(USER_AGENTS)})
-    soup = bs4.BeautifulSoup(page.content, "html.parser")
+def parse_novel_information(content: bytes) -> list[str]:
+    """Parses the html of a novel site for more information (date for now).
+
+    Arguments:
+        - content: the html of the site.
+
+    Returns:
+        The information (publication date in ISO 8601 format).
+    """
+    soup = bs4.BeautifulSoup(content, "html.parser")
     label = [label for label in soup.find_all("td", class_="infoboxlabel")
              if label.text.strip() == "Publication date:"][0]
     date_string = re.sub(r"\[\d\]", "", label.find_next(
         "td", class_="infoboxcell").text.split(" (")[0].strip())
-    date = datetime.date.fromtimestamp(datetime.datetime.strptime(
+    return [iso_date(date_string)]
+
+
+def iso_date(date_string: str) -> str:
+    """Converts a date like 'October 1, 2001' to ISO 8601.
+
+    Arguments:
+        - date_string: the date.
+
+    Returns:
+        The date in ISO 8601 format.
+    """
+    return datetime.date.fromtimestamp(datetime.datetime.strptime(
         date_string, "%B %d, %Y").timestamp()).isoformat()
-    return [date]
 
 
-def get_novel_image(url: str) -> str:
+def get_novel_information(url: str) -> list[str]:
+    with metrics.timer("stage_seconds", stage="get_novel_information", step="fetch"):
+        page = fetch.get(url, timeout=10)
+    with metrics.timer("stage_seconds", stage="get_novel_information", step="parse"):
+        information = parse_novel_information(page.content)
+    metrics.item("get_novel_information")
+    return information
+
+
+def parse_wikitext_information(wikitext: str) -> list[str] | None:
+    """Parses the wikitext of a novel article for more information (date for now).
+    Reads the parameters of the infobox template instead of the rendered infobox.
+
+    Arguments:
+        - wikitext: the wikitext of the article.
+
+    Returns:
+        The information (publication date in ISO 8601 format) or None if the wikitext
+        has no date parameter that can be read.
+    """
+    # drop references and comments, keep the text of links
+    wikitext = re.sub(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>|<!--.*?-->", "", wikitext, flags=re.S)
+    wikitext = re.sub(r"\[\[(?:[^|\]]*\|)?([^\]]*)\]\]", r"\1", wikitext)
+    parameters = {match.group(1).strip().lower(): match.group(2)
+                  for match in re.finditer(r"^\s*\|\s*([^=|\n]+?)\s*=(.*)$", wikitext, re.M)}
+    for name in DATE_PARAMETERS:
+        if match := DATE.search(parameters.get(name, "")):
+            try:
+                return [iso_date(match.group())]
+            except ValueError:
+                continue
+    return None
+
+
+def api_query(parameters: dict[str, str], base_url: str = HALOPEDIA_URL
+              ) -> typing.Iterator[dict]:
+    """Runs a query of the MediaWiki API and follows its continuations.
+
+    Arguments:
+        - parameters: the parameters of the query (without action and format).
+        - base_url: url of the wiki.
+
+    Returns:
+        The 'query' part of every response.
+    """
+    parameters = {"action": "query", "format": "json", "formatversion": "2"} | parameters
+    continuation: dict[str, str] = {}
+    while True:
+        # the whole query goes into the url, it is the key of the http cache
+        response = fetch.get(f"{base_url}api.php?"
+                             f"{urllib.parse.urlencode(parameters | continuation)}", timeout=10)
+        response.raise_for_status()
+        result = response.json()
+        if "error" in result:
+            raise ValueError(f"API error: {result['error'].get('info')}")
+        yield result.get("query", {})
+        if "continue" not in result:
+            return
+        continuation = result["continue"]
+
+
+def api_pages(titles: list[str], parameters: dict[str, str], base_url: str = HALOPEDIA_URL
+              ) -> dict[str, dict]:
+    """Gets the pages of some titles from the MediaWiki API, following redirects.
+
+    Arguments:
+        - titles: the titles (at most API_BATCH_SIZE).
+        - parameters: what to get about the pages (prop etc.).
+        - base_url: url of the wiki.
+
+    Returns:
+        The pages by the requested titles (missing pages are left out).
+    """
+    renamed: dict[str, str] = {}
+    pages: dict[str, dict] = {}
+    for query in api_query({"titles": "|".join(titles), "redirects": "1"} | parameters,
+                           base_url):
+        for rename in query.get("normalized", []) + query.get("redirects", []):
+            renamed[rename["from"]] = rename["to"]
+        # continuations only return the rest of the properties of the pages
+        for page in query.get("pages", []):
+            pages.setdefault(page["title"], {}).update(page)
+    result = {}
+    for title in titles:
+        resolved = title
+        while resolved in renamed and renamed[resolved] != resolved:
+            resolved = renamed[resolved]
+        if resolved in pages and not pages[resolved].get("missing"):
+            result[title] = pages[resolved]
+    return result
+
+
+def get_novels_information(titles: list[str], base_url: str = HALOPEDIA_URL
+                           ) -> dict[str, list[str] | None]:
+    """Gets more information (date for now) about a batch of novels with one API query
+    for the wikitext of their articles.
+
+    Arguments:
+        - titles: the titles of the novels (at most API_BATCH_SIZE).
+        - base_url: url of the wiki.
+
+    Returns:
+        The information by title, None if it could not be read from the wikitext.
+    """
+    with metrics.timer("stage_seconds", stage="get_novels_information", step="fetch"):
+        pages = api_pages(titles, {"prop": "revisions", "rvprop": "content",
+                                   "rvslots": "main"}, base_url)
+    information: dict[str, list[str] | None] = {}
+    with metrics.timer("stage_seconds", stage="get_novels_information", step="parse"):
+        for title in titles:
+            revisions = pages.get(title, {}).get("revisions") or [{}]
+            wikitext = revisions[0].get("slots", {}).get("main", {}).get("content", "")
+            information[title] = parse_wikitext_information(wikitext)
+    metrics.item("get_novels_information")
+    return information
+
+
+def get_image_urls(file_names: list[str], base_url: str = HALOPEDIA_URL
+                   ) -> dict[str, tuple[str, str]]:
+    """Resolves the original urls of a batch of images with one API query.
+
+    Arguments:
+        - file_names: the file names of the images (at most API_BATCH_SIZE).
+        - base_url: url of the wiki.
+
+    Returns:
+        The url and MIME type by file name (images that are not found are left out).
+    """
+    with metrics.timer("stage_seconds", stage="get_image_urls", step="fetch"):
+        pages = api_pages([f"File:{file_name}" for file_name in file_names],
+                          {"prop": "imageinfo", "iiprop": "url|mime"}, base_url)
+    metrics.item("get_image_urls")
+    image_urls = {}
+    for file_name in file_names:
+        image_info = pages.get(f"File:{file_name}", {}).get("imageinfo")
+        if image_info:
+            image_urls[file_name] = (image_info[0]["url"], image_info[0].get("mime", ""))
+    return image_urls
+
+
+def image_file_name(url: str) -> str | None:
+    """Gets the file name of an image from its url, e.g. 'Fall.jpg' from
+    '.../images/thumb/a/ab/Fall.jpg/300px-Fall.jpg'.
+
+    Arguments:
+        - url: the url of the image or a thumbnail of it.
+
+    Returns:
+        The file name or None if the url is not an image of the wiki.
+    """
+    path = urllib.parse.urlsplit(url).path.split("/")
+    if "images" not in path:
+        return None
+    path = path[path.index("images") + 1:]
+    if path[:1] == ["thumb"]:
+        path = path[1:]
+    # hash directories (e.g. 'a/ab') and the file name
+    if len(path) < 3:
+        return None
+    return urllib.parse.unquote(path[2]).replace("_", " ")
+
+
+def parse_novel_tables(content: bytes) -> typing.Iterator[tuple[list[str], list[str]]]:
+    """Walks the series tables of the novels page.
+
+    Arguments:
+        - content: the html of the novels page.
+
+    Returns:
+        The table headers and the cells (plus the series) of every novel.
+    """
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    for series_table in soup.find_all("table", class_="wikitable"):
+        rows = series_table.find("tbody").find_all("tr")
+        table_headers = [table_header.text.strip()
+                         for table_header in rows[0].find_all("th")] + ["Series"]
+        for novel in rows[1:]:
+            novel_data = [table_data_cell.text.strip() if not table_data_cell.find("img")
+                          else table_data_cell.find("img")["src"]
+                          for table_data_cell in novel.find_all("td")] \
+                + [series_table.find_previous("span", class_="mw-headline").text.strip()]
+            yield table_headers, novel_data
+
+
+def get_novel_image(url: str, image_store: blobs.BlobStore | None = None) -> str:
     """Downloads the image at the url after . Also gets the real url.
 
     Arguments:
         - url: the url of the image.
+        - image_store: store for the image or None to encode it as base64.
 
     Returns:
-        The image as a base64 encoded string or empty string if failed.
+        The hash of the image in the image store (or the image as base64
+        encoded string without one) or empty string if failed.
     """
-    image = b""
-    retries = 0
     url = url.replace("/thumb", "")
     # aaaaaaaaaaaahhh!
     if ".png" in url:
@@ -75,21 +284,105 @@ def get_novel_image(url: str) -> str:
         magic_number = JPG_MAGIC_NUMBER
     else:
         return ""
-    while not image.startswith(magic_number) and retries < 10:
-        image = requests.get(url, timeout=10,
-                             headers={"User-Agent": random.choice(USER_AGENTS)}).content
-        retries += 1
-    if image.startswith(magic_number):
-        image_string = base64.b64encode(image).decode("utf-8")
-    else:
-        image_string = ""
+    return download_image(url, magic_number, image_store)
+
+
+def download_image(url: str, magic_number: bytes,
+                   image_store: blobs.BlobStore | None = None) -> str:
+    """Downloads an image straight into the image store (or a base64 encoded string).
+    Stops as soon as the first bytes do not match the magic number and tries again
+    with backoff.
+
+    Arguments:
+        - url: the url of the image.
+        - magic_number: the bytes the image has to start with.
+        - image_store: store for the image or None to encode it as base64.
+
+    Returns:
+        The hash of the image in the image store (or the image as base64
+        encoded string without one) or empty string if failed.
+    """
+    with metrics.timer("stage_seconds", stage="get_novel_image", step="fetch"):
+        image_string, _ = fetch.download(url, functools.partial(blobs.writer, image_store),
+                                         (magic_number,))
+    if image_string is None:
+        return ""
+    metrics.item("get_novel_image")
     return image_string
 
 
-def main() -> None:
-    """The main method. Exists only for parity with comics.py."""
+def get_novel_image_api(url: str, image_urls: dict[str, tuple[str, str]],
+                        image_store: blobs.BlobStore | None = None) -> str:
+    """Downloads an image from the original url resolved by the API.
+    Falls back to guessing the url if the API did not know the image.
+
+    Arguments:
+        - url: the url of the image (thumbnail) on the novels page.
+        - image_urls: the resolved urls and MIME types by file name.
+        - image_store: store for the image or None to encode it as base64.
+
+    Returns:
+        The hash of the image in the image store (or the image as base64
+        encoded string without one) or empty string if failed.
+    """
+    file_name = image_file_name(url)
+    if file_name is None or file_name not in image_urls:
+        return get_novel_image(url, image_store)
+    image_url, mime = image_urls[file_name]
+    if mime not in MAGIC_NUMBERS:
+        return ""
+    return download_image(image_url, MAGIC_NUMBERS[mime], image_store)
+
+
+def get_novel_information_api(title: str, information: dict[str, list[str] | None],
+                              base_url: str = HALOPEDIA_URL) -> list[str]:
+    """Gets the information of a novel from an API batch.
+    Falls back to the article if it could not be read from the wikitext.
+
+    Arguments:
+        - title: the title of the novel.
+        - information: the information by title from the API batches.
+        - base_url: url of the wiki.
+
+    Returns:
+        The information (publication date in ISO 8601 format).
+    """
+    return information.get(title) or get_novel_information(
+        f"{base_url}{title.replace(' ', '_')}")
+
+
+def main(cache: http_cache.HTTPCache | None = None,
+         image_store: blobs.BlobStore | None = None, database: str | None = None,
+         workers: int = 8, api: bool = False, base_url: str = HALOPEDIA_URL,
+         thumbnail_widths: list[int] | None = None, thumbnail_format: str = "jpeg",
+         thumbnail_quality: int = 80, thumbnails_only: bool = False) -> None:
+    """The main method. Exists only for parity with comics.py.
+
+    Arguments:
+        - cache: http cache for all requests or None to always ask the server.
+        - image_store: store for the images or None to put them into the
+        JSON file as base64 encoded strings.
+        - database: path of a SQLite catalog to write as well or None.
+        - workers: maximum number of novel pages and images that are fetched at the same
+        time; the rate controller adapts the actual limit to the host.
+        - api: get the dates and image urls with batched MediaWiki API queries
+        instead of one article per novel.
+        - base_url: url of the wiki, e.g. of a local stand-in (see standin.py).
+        - thumbnail_widths: widths of the thumbnails of the covers or None for none.
+        - thumbnail_format: 'jpeg' or 'webp'.
+        - thumbnail_quality: quality of the thumbnails (1-100).
+        - thumbnails_only: keep only the thumbnails, the biggest one replaces the cover.
+
+    Returns:
+        Nothing.
+    """
+    started = time.time()
+    controller = rate_control.RateController(maximum=workers)
+    fetch.configure(cache=cache, rate_controller=controller)
+
     # file_handler for logging
     date = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    report_path = f"logs/halo_novels-{date}.metrics.json"
     file_handler = logging.FileHandler(filename=f"logs/halo_novels-{date}.log",
                                        mode="w", encoding="utf-8")
     file_handler.setFormatter(FORMATTER)
@@ -102,40 +395,143 @@ def main() -> None:
 
     # logging setup
     logger = logging.getLogger("comics")
+    logger.setLevel(logging.DEBUG)
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
     # get novel page
     start_time = time.time()
-    page = requests.get("https://www.halopedia.org/Halo_novels",
-                        timeout=10, headers={"User-Agent": random.choice(USER_AGENTS)})
+    page = fetch.get(f"{base_url}Halo_novels", timeout=10)
     logger.info("Got novels page in %s seconds.",
                 round(time.time() - start_time, 2))
 
-    novels_data = []
-    soup = bs4.BeautifulSoup(page.content, "html.parser")
-    for series_table in soup.find_all("table", class_="wikitable"):
-        rows = series_table.find("tbody").find_all("tr")
-        table_headers = [table_header.text.strip()
-                         for table_header in rows[0].find_all("th")] + ["Series"]
-        for novel in rows[1:]:
-            novel_data = [table_data_cell.text.strip() if not table_data_cell.find("img")
-                          else table_data_cell.find("img")["src"]
-                          for table_data_cell in novel.find_all("td")] \
-                + [series_table.find_previous("span", class_="mw-headline").text.strip()]
-            date = get_novel_information(
-                f"https://www.halopedia.org/{novel_data[0].replace(' ', '_')}")[0]
-            novel_data[1] = get_novel_image(novel_data[1])
+    # every novel is written as soon as it is complete
+    changes = delta.DeltaIndex("halo_novels.hashes.json", "halo_novels.delta.jsonl", ("Title",))
+    sinks: list[writer.Sink] = [changes]
+    if database:
+        sinks.append(sqlite_catalog.SQLiteCatalog(
+            database, sqlite_catalog.NOVEL_FIELDS, sqlite_catalog.NOVEL_LIST_FIELDS,
+            create=True))
+    with writer.CatalogWriter("halo_novels.json", sinks) as catalog, \
+            (thumbnails.ThumbnailWriter(
+                catalog, "Cover", "Thumbnails", thumbnail_widths, thumbnail_format,
+                thumbnail_quality, thumbnails_only, image_store,
+                "halo_novels.thumbnails.json") if thumbnail_widths
+             else contextlib.nullcontext(catalog)) as output, \
+            concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        start_time = time.time()
+        with metrics.timer("stage_seconds", stage="get_novels", step="parse"):
+            novels = list(parse_novel_tables(page.content))
+        logger.info("Got %s novels from the tables in %s seconds.",
+                    len(novels), round(time.time() - start_time, 2))
+
+        # fetch all novel pages and images at the same time and remember when
+        # the last one of every stage was done
+        start_time = time.time()
+        done: dict[str, float] = {}
+
+        def submit(stage: str, func: typing.Callable, *args: typing.Any
+                   ) -> concurrent.futures.Future:
+            future = executor.submit(func, *args)
+            future.add_done_callback(lambda _: done.update({stage: time.time()}))
+            return future
+
+        if api:
+            # a few batched queries instead of one article per novel
+            titles = list(dict.fromkeys(novel_data[0] for _, novel_data in novels))
+            file_names = list(dict.fromkeys(
+                file_name for _, novel_data in novels
+                if (file_name := image_file_name(novel_data[1])) is not None))
+            information_batches = [
+                submit("information", get_novels_information,
+                       titles[index:index + API_BATCH_SIZE], base_url)
+                for index in range(0, len(titles), API_BATCH_SIZE)]
+            image_url_batches = [
+                submit("images", get_image_urls,
+                       file_names[index:index + API_BATCH_SIZE], base_url)
+                for index in range(0, len(file_names), API_BATCH_SIZE)]
+            information: dict[str, list[str] | None] = {}
+            for batch in information_batches:
+                information |= batch.result()
+            image_urls: dict[str, tuple[str, str]] = {}
+            for batch in image_url_batches:
+                image_urls |= batch.result()
+            logger.info("Got %s API responses for %s novels in %s seconds.",
+                        len(information_batches) + len(image_url_batches), len(novels),
+                        round(time.time() - start_time, 2))
+            dates = [submit("information", get_novel_information_api, novel_data[0],
+                            information, base_url) for _, novel_data in novels]
+            images = [submit("images", get_novel_image_api, novel_data[1], image_urls,
+                             image_store) for _, novel_data in novels]
+        else:
+            dates = [submit("information", get_novel_information,
+                            f"{base_url}{novel_data[0].replace(' ', '_')}")
+                     for _, novel_data in novels]
+            images = [submit("images", get_novel_image, novel_data[1], image_store)
+                      for _, novel_data in novels]
+        # write in table order
+        for (table_headers, novel_data), date, image in zip(novels, dates, images):
+            novel_data[1] = image.result()
             novel_data[2] = re.split(", and |, ", novel_data[2])
             novel_data[3] = re.split(", and |, ", novel_data[3])
-            novel_data[4] = date
-            novels_data.append(dict(zip(table_headers, novel_data)))
-
-    novels = {"_default": {str(index): novel
-                           for index, novel in enumerate(novels_data)}}
-    with open("halo_novels.json", "w", encoding="utf-8") as file:
-        json.dump(novels, file)
+            novel_data[4] = date.result()[0]
+            output.write(dict(zip(table_headers, novel_data)))
+        logger.info("Got information about %s novels in %s seconds.", len(novels),
+                    round(done.get("information", start_time) - start_time, 2))
+        logger.info("Got %s images in %s seconds.",
+                    sum(bool(image.result()) for image in images),
+                    round(done.get("images", start_time) - start_time, 2))
+    if isinstance(output, thumbnails.ThumbnailWriter):
+        logger.info("Made thumbnails of %s covers, %s were still up to date.",
+                    output.made, output.reused)
+    logger.info(changes.summary())
+    logger.info(fetch.summary([fetch.stats()]))
+    logger.info(controller.summary())
+    if cache is not None:
+        deleted, size = cache.prune()
+        logger.info("Deleted %s responses from the cache, %s MiB left.",
+                    deleted, round(size / 1024 ** 2, 2))
+    # everything ran in this process
+    metrics.write(metrics.merge([metrics.snapshot()]), started, report_path, "halo_novels.prom",
+                  "halo_novels")
+    logger.info("Wrote the metrics to '%s' and '%s'.", report_path, "halo_novels.prom")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Get all the halo novels from Halopedia.")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="cache responses in this directory and revalidate them")
+    parser.add_argument("--cache-ttl", type=float, default=12 * 60 * 60,
+                        help="seconds a cached response is used without asking the server")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum size of the cache in MiB")
+    parser.add_argument("--offline", action="store_true",
+                        help="only use the cache (e.g. to rerun the parsers)")
+    parser.add_argument("--images", metavar="DIRECTORY",
+                        help="store the images in this directory and only their hashes in "
+                        "the JSON file")
+    parser.add_argument("--database", metavar="PATH",
+                        help="also write the novels to an indexed SQLite catalog")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="maximum number of novel pages and images fetched at the same "
+                        "time; the actual limit adapts to the host")
+    parser.add_argument("--api", action="store_true",
+                        help="get dates and image urls with batched MediaWiki API queries")
+    parser.add_argument("--base-url", default=HALOPEDIA_URL,
+                        help="url of the wiki, e.g. of a local stand-in (see standin.py)")
+    parser.add_argument("--thumbnails", metavar="WIDTHS",
+                        type=lambda widths: [int(width) for width in widths.split(",")],
+                        help="make thumbnails of the covers with these widths, e.g. 100,300")
+    parser.add_argument("--thumbnail-format", choices=["jpeg", "webp"], default="jpeg",
+                        help="format of the thumbnails")
+    parser.add_argument("--thumbnail-quality", type=int, default=80,
+                        help="quality of the thumbnails (1-100)")
+    parser.add_argument("--thumbnails-only", action="store_true",
+                        help="keep only the thumbnails, the biggest one replaces the cover")
+    args = parser.parse_args()
+    main(http_cache.HTTPCache(args.cache or "cache", args.cache_ttl,
+                              args.cache_size * 1024 ** 2, args.offline)
+         if args.cache or args.offline else None,
+         blobs.BlobStore(args.images) if args.images else None, args.database, args.workers,
+         args.api, args.base_url, args.thumbnails, args.thumbnail_format,
+         args.thumbnail_quality, args.thumbnails_only)
@@ -2,14 +2,26 @@
 Also contains code that would otherwise be redundant.
 """
 
+import argparse
+import array
+import bisect
+import collections
 import datetime
+import glob
 import logging
+import mmap
+import os
+import re
+import time
+import typing
 
 import rich.color
+import rich.console
 import rich.highlighter
 import rich.logging
 import rich.segment
 import rich.style
+import rich.text
 import rich.theme
 import textual.app
 import textual.geometry
@@ -17,6 +29,7 @@ import textual.scroll_view
 import textual.strip
 import textual.widget
 import textual.widgets
+import textual.worker
 
 THEME = rich.theme.Theme({
     "log.datetime": rich.color.Color.from_rgb(44, 88, 172).name,
@@ -30,6 +43,15 @@ THEME = rich.theme.Theme({
 })
 FORMATTER = logging.Formatter(fmt="[{time}] [{func}/{levelname}] ({proc}) {message}",
                               datefmt="%Y-%m-%d %H:%M:%S", style="{")
+# bytes of the log file indexed at once and number of rendered lines that are kept
+INDEX_CHUNK_SIZE = 16 * 1024 ** 2
+STRIP_CACHE_SIZE = 1024
+# seconds between two checks for new lines in follow mode
+FOLLOW_INTERVAL = 0.25
+LOG_NAME = r"(.*)-\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.log"
+CURSOR_STYLE = rich.style.Style(bgcolor=rich.color.Color.from_rgb(60, 60, 60).name)
+# '[time] [func/LEVEL] (proc) message' like FORMATTER writes it
+LOG_LINE = re.compile(rb"\[[^\]]*\] \[(([a-zA-Z_]*)/([A-Z]+)\] \(([^)]*))\)")
 
 
 class LogHighlighter(rich.highlighter.RegexHighlighter):
@@ -103,57 +125,578 @@ class Logger:
         return self.logger
 
 
+class Column:
+    """One part of the log lines (level, function or process): the value of every line as
+    a small id and the lines of every value, so filters do not have to read the file.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the column.
+
+        Returns:
+            Nothing.
+        """
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+        self.values = array.array("H")
+        self.lines: list[array.array] = []
+
+    def id(self, name: str) -> int:
+        """Get the id of a value.
+
+        Arguments:
+            - name: the value.
+
+        Returns:
+            The id (a new one if the value is new).
+        """
+        value = self.ids.get(name)
+        if value is None:
+            value = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.lines.append(array.array("L"))
+        return value
+
+    def append(self, value: int) -> None:
+        """Add the value of the next line.
+
+        Arguments:
+            - value: the id of the value.
+
+        Returns:
+            Nothing.
+        """
+        self.lines[value].append(len(self.values))
+        self.values.append(value)
+
+    def pop(self) -> None:
+        """Remove the value of the last line.
+
+        Returns:
+            Nothing.
+        """
+        self.lines[self.values.pop()].pop()
+
+
 class Log(textual.scroll_view.ScrollView):
-    """Render the log lines."""
+    """Render the log lines. The file is memory-mapped and only the start of every line is
+    kept (in an array, indexed in the background); lines are highlighted when they become
+    visible and the latest rendered lines are cached. In follow mode, appended lines are
+    indexed as they arrive and a newer log of the same program is switched to.
+    """
 
-    def __init__(self, path: str) -> None:
-        """Initialize the log thing."""
-        super().__init__()
-        console = rich.console.Console(highlighter=LogHighlighter(),
-                                       theme=THEME)
-        with open(path, "r", encoding="utf-8") as file:
-            log_text = file.readlines()
-        # log_text = list(map(str, range(100)))
-        self.virtual_size = textual.geometry.Size(max(len(line) for line in log_text),
-                                                  len(log_text))
-        self.log_lines = [textual.strip.Strip(list(console.render(
-            text.replace("[", r"\[").replace("\n", ""))), len(text))
-            for text in log_text]
+    def __init__(self, path: str, follow: bool = False, **kwargs: typing.Any) -> None:
+        """Initialize the log thing.
+
+        Arguments:
+            - path: path of the log file.
+            - follow: keep watching the file for new lines.
+            - kwargs: passed on to the widget (e.g. id).
+
+        Returns:
+            Nothing.
+        """
+        super().__init__(**kwargs)
+        self.follow = follow
+        self.console = rich.console.Console(theme=THEME)
+        self.highlighter = LogHighlighter()
+        self.map: mmap.mmap | bytes = b""
+        self.strips: collections.OrderedDict[int, textual.strip.Strip] = \
+            collections.OrderedDict()
+        # the filter (column and value) and the search, they stay when the file changes
+        self.criteria: dict[str, str] = {}
+        self.pattern = ""
+        self.regex: re.Pattern[bytes] | None = None
+        self.text_regex: re.Pattern[str] | None = None
+        self.open(path)
+
+    def open(self, path: str) -> None:
+        """Open a log file (again) and forget everything about the old one.
+
+        Arguments:
+            - path: path of the log file.
+
+        Returns:
+            Nothing.
+        """
+        # nothing can be rendered while the file is swapped
+        self.line_count = 0
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.path = path
+        self.map = b""
+        self.inode = os.stat(path).st_ino
+        self.remap()
+        # offsets[i] is the start of line i, the last offset is the end of the last line
+        self.offsets = array.array("Q", [0])
+        self.width = 0
+        # start of the current line and up to where the file was scanned for its end
+        self.start = self.scanned = 0
+        # whether the last line has no line break yet
+        self.partial = False
+        self.strips.clear()
+        self.columns = {"level": Column(), "func": Column(), "proc": Column()}
+        # ids of the values of every line header that was seen and of the last line
+        self.headers: dict[bytes, tuple[int, ...]] = {}
+        self.last_ids = tuple(column.id("") for column in self.columns.values())
+        # lines of every filter that was used and up to which line they are complete
+        self.views: dict[tuple[tuple[str, str], ...], tuple[array.array, int]] = {}
+        self.view: array.array | None = None
+        # lines of every search and up to which byte the file was searched
+        self.searches: dict[str, tuple[array.array, int]] = {}
+        # highlighted row (e.g. the current match)
+        self.cursor: int | None = None
+
+    def remap(self) -> None:
+        """Map the whole file again after it grew.
+
+        Returns:
+            Nothing.
+        """
+        with open(self.path, "rb") as file:
+            # an empty file can not be mapped
+            new_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.fstat(file.fileno()).st_size else b""
+        old_map, self.map = self.map, new_map
+        if isinstance(old_map, mmap.mmap):
+            old_map.close()
+
+    def on_mount(self) -> None:
+        """Start indexing the lines."""
+        self.run_worker(self.index_lines, thread=True, exclusive=True)
+
+    def on_unmount(self) -> None:
+        """Close the file."""
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def index_lines(self) -> None:
+        """Index the file and, in follow mode, everything that is appended to it.
+        Runs in a worker thread as long as the log is shown, so follow mode can be
+        switched on and off without a second worker indexing at the same time;
+        the file is only swapped in the app thread.
+
+        Returns:
+            Nothing.
+        """
+        worker = textual.worker.get_current_worker()
+        while not worker.is_cancelled:
+            self.index_chunks(worker)
+            time.sleep(FOLLOW_INTERVAL)
+            if not self.follow:
+                continue
+            newest = self.newest_log()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                stat = None
+            if newest != self.path or stat is None or stat.st_ino != self.inode \
+                    or stat.st_size < len(self.map):
+                # a new log, or the file was rotated, replaced or truncated
+                if os.path.exists(newest):
+                    self.app.call_from_thread(self.switch, newest)
+            elif stat.st_size > len(self.map):
+                self.app.call_from_thread(self.remap)
+
+    def index_chunks(self, worker: textual.worker.Worker) -> None:
+        """Find the start of every line that is not indexed yet. The lines can be shown
+        while this runs, every chunk that is done gets published.
+
+        Arguments:
+            - worker: the worker this runs in.
+
+        Returns:
+            Nothing.
+        """
+        size = len(self.map)
+        if self.partial and size > self.offsets[-1]:
+            # the last line goes on, index it again
+            self.line_count -= 1
+            self.offsets.pop()
+            for column in self.columns.values():
+                column.pop()
+            if self.columns["level"].values:
+                self.last_ids = tuple(column.values[-1] for column in self.columns.values())
+            self.app.call_from_thread(self.forget_line, self.line_count)
+            self.partial = False
+        first_line = self.line_count
+        while self.scanned < size and not worker.is_cancelled:
+            chunk_start, end = self.scanned, min(self.scanned + INDEX_CHUNK_SIZE, size)
+            width = self.width
+            while (newline := self.map.find(b"\n", self.scanned, end)) != -1:
+                self.index_line(self.start, newline)
+                width = max(width, newline - self.start)
+                self.start = self.scanned = newline + 1
+                self.offsets.append(self.start)
+            # the indexed chunk does not have to stay in memory
+            if hasattr(mmap, "MADV_DONTNEED"):
+                page_start = chunk_start - chunk_start % mmap.PAGESIZE
+                self.map.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+            self.scanned = end
+            if self.scanned == size and self.start < size:
+                # last line without line break (yet)
+                width = max(width, size - self.start)
+                self.index_line(self.start, size)
+                self.offsets.append(size)
+                self.partial = True
+            self.width = width
+            self.line_count = len(self.offsets) - 1
+            self.app.call_from_thread(self.update_size, first_line)
+            first_line = self.line_count
+
+    def index_line(self, start: int, end: int) -> None:
+        """Add level, function and process of the next line to the columns.
+
+        Arguments:
+            - start: start of the line.
+            - end: end of the line.
+
+        Returns:
+            Nothing.
+        """
+        match = LOG_LINE.match(self.map, start, end)
+        if match is not None:
+            # most lines share a few headers, the values only have to be decoded once
+            ids = self.headers.get(match.group(1))
+            if ids is None:
+                ids = self.headers[match.group(1)] = tuple(
+                    column.id(match.group(group).decode("utf-8", errors="replace"))
+                    for column, group in zip(self.columns.values(), (3, 2, 4)))
+            self.last_ids = ids
+        # lines without header (e.g. of a traceback) belong to the line before
+        for column, value in zip(self.columns.values(), self.last_ids):
+            column.append(value)
+
+    def forget_line(self, line: int) -> None:
+        """Remove a line that is indexed again from the filtered views.
+
+        Arguments:
+            - line: the line.
+
+        Returns:
+            Nothing.
+        """
+        for key, (view, done) in self.views.items():
+            if view and view[-1] == line:
+                view.pop()
+            self.views[key] = (view, min(done, line))
+
+    def newest_log(self) -> str:
+        """Find the newest log of the same program, e.g. 'comics-<date>.log'.
+
+        Returns:
+            Its path (the path of this log if there is no newer one).
+        """
+        match = re.fullmatch(LOG_NAME, os.path.basename(self.path))
+        if match is None:
+            return self.path
+        logs = [path for path in glob.glob(os.path.join(
+            glob.escape(os.path.dirname(self.path)), f"{glob.escape(match.group(1))}-*.log"))
+            if re.fullmatch(LOG_NAME, os.path.basename(path))]
+        # the dates in the names sort chronologically
+        return max(logs + [self.path], key=os.path.basename)
+
+    def switch(self, path: str) -> None:
+        """Show another log file from the start.
+
+        Arguments:
+            - path: path of the log file.
+
+        Returns:
+            Nothing.
+        """
+        self.open(path)
+        self.virtual_size = textual.geometry.Size(0, 0)
+        self.scroll_home(animate=False)
+        self.refresh()
+
+    def update_size(self, first_line: int) -> None:
+        """Make the new lines scrollable and repaint them.
+
+        Arguments:
+            - first_line: the first new line.
+
+        Returns:
+            Nothing.
+        """
+        at_end = self.scroll_offset.y >= self.max_scroll_y
+        # the first line might have been rendered before it was complete
+        self.strips.pop(first_line, None)
+        self.update_view()
+        self.virtual_size = textual.geometry.Size(self.width, self.rows())
+        if self.view is None:
+            self.refresh_lines(first_line, max(1, self.line_count - first_line))
+        else:
+            self.refresh()
+        if self.follow and at_end:
+            self.scroll_end(animate=False)
+
+    def rows(self) -> int:
+        """Get the number of shown lines.
+
+        Returns:
+            The number of lines (that match the filter).
+        """
+        return len(self.view) if self.view is not None else self.line_count
+
+    def row_line(self, row: int) -> int:
+        """Get the line that is shown in a row.
+
+        Arguments:
+            - row: the row.
+
+        Returns:
+            The line.
+        """
+        return self.view[row] if self.view is not None else row
+
+    def line_row(self, line: int) -> int | None:
+        """Get the row a line is shown in.
+
+        Arguments:
+            - line: the line.
+
+        Returns:
+            The row or None if the line does not match the filter.
+        """
+        if self.view is None:
+            return line
+        row = bisect.bisect_left(self.view, line)
+        return row if row < len(self.view) and self.view[row] == line else None
+
+    def update_view(self) -> None:
+        """Get the lines that match the filter. Only lines that were indexed since the
+        filter was used last time are checked, and only with the columns.
+
+        Returns:
+            Nothing.
+        """
+        if not self.criteria:
+            self.view = None
+            return
+        line_count = self.line_count
+        key = tuple(sorted(self.criteria.items()))
+        view, done = self.views.get(key, (array.array("L"), 0))
+        if done < line_count:
+            columns = [(self.columns[name], self.columns[name].ids.get(value))
+                       for name, value in key]
+            if all(value is not None for _, value in columns):
+                # go through the lines of the rarest value
+                lines = min((column.lines[typing.cast(int, value)]
+                             for column, value in columns), key=len)
+                new_lines = lines[bisect.bisect_left(lines, done):
+                                  bisect.bisect_left(lines, line_count)]
+                if len(columns) == 1:
+                    view.extend(new_lines)
+                else:
+                    view.extend(line for line in new_lines
+                                if all(column.values[line] == value
+                                       for column, value in columns))
+        self.views[key] = (view, max(done, line_count))
+        self.view = view
+
+    def filter(self, criteria: dict[str, str]) -> None:
+        """Only show the lines with these values, e.g. {"level": "WARNING"}.
+
+        Arguments:
+            - criteria: the value of every column to filter by (level, func, proc).
+
+        Returns:
+            Nothing.
+        """
+        self.criteria = criteria
+        self.cursor = None
+        self.update_view()
+        self.virtual_size = textual.geometry.Size(self.width, self.rows())
+        self.scroll_home(animate=False)
+        self.refresh()
+
+    def search(self, pattern: str) -> None:
+        """Search for a regular expression (or text if it is none) and highlight it.
+
+        Arguments:
+            - pattern: the pattern or an empty string to stop searching.
+
+        Returns:
+            Nothing.
+        """
+        try:
+            re.compile(pattern)
+        except re.error:
+            pattern = re.escape(pattern)
+        self.pattern = pattern
+        self.regex = re.compile(pattern.encode("utf-8"), re.MULTILINE) if pattern else None
+        self.text_regex = re.compile(pattern) if pattern else None
+        self.cursor = None
+        self.strips.clear()
+        self.refresh()
+
+    def matches(self) -> array.array:
+        """Get the lines that match the search. Only the part of the file that was
+        added since the last time is searched.
+
+        Returns:
+            The lines.
+        """
+        if self.regex is None:
+            return array.array("L")
+        lines, searched = self.searches.get(self.pattern, (array.array("L"), 0))
+        # only complete lines
+        line_count = self.line_count - self.partial
+        end = self.offsets[line_count]
+        position = searched
+        while position < end and (match := self.regex.search(self.map, position, end)):
+            line = bisect.bisect_right(self.offsets, match.start(), 0, line_count + 1) - 1
+            lines.append(line)
+            position = self.offsets[line + 1]
+        self.searches[self.pattern] = (lines, max(searched, end))
+        return lines
+
+    def jump(self, direction: int) -> bool:
+        """Move to the next (or previous) shown line that matches the search.
+
+        Arguments:
+            - direction: 1 for the next match, -1 for the previous one.
+
+        Returns:
+            Whether there was a match.
+        """
+        matches = self.matches()
+        if not self.rows():
+            return False
+        if self.cursor is not None and self.cursor < self.rows():
+            current = self.row_line(self.cursor)
+        else:
+            # matches in the first shown line count as next ones
+            current = self.row_line(min(self.scroll_offset.y, self.rows() - 1)) - (direction > 0)
+        index = bisect.bisect_right(matches, current) if direction > 0 \
+            else bisect.bisect_left(matches, current) - 1
+        while 0 <= index < len(matches):
+            if (match_row := self.line_row(matches[index])) is not None:
+                self.cursor = match_row
+                self.scroll_to(y=max(0, match_row - self.size.height // 2), animate=False)
+                self.refresh()
+                return True
+            index += direction
+        return False
+
+    def line(self, y: int) -> textual.strip.Strip:
+        """Get a highlighted line.
+
+        Arguments:
+            - y: the number of the line.
+
+        Returns:
+            The line.
+        """
+        if y in self.strips:
+            self.strips.move_to_end(y)
+            return self.strips[y]
+        text = rich.text.Text(bytes(self.map[self.offsets[y]:self.offsets[y + 1]])
+                              .decode("utf-8", errors="replace").rstrip("\r\n"))
+        self.highlighter.highlight(text)
+        if self.text_regex is not None:
+            text.highlight_regex(self.text_regex, style="reverse")
+        strip = textual.strip.Strip(text.render(self.console, end=""), text.cell_len)
+        self.strips[y] = strip
+        if len(self.strips) > STRIP_CACHE_SIZE:
+            self.strips.popitem(last=False)
+        return strip
 
     def render_line(self, y: int) -> textual.strip.Strip:
         """Render a line."""
         scroll_x, scroll_y = self.scroll_offset
         y += scroll_y
-        if y >= len(self.log_lines):
+        if y >= self.rows():
             return textual.strip.Strip.blank(self.size.width)
-        return self.log_lines[y].crop_extend(scroll_x, scroll_x + self.size.width, None)
+        strip = self.line(self.row_line(y))
+        if y == self.cursor:
+            strip = strip.apply_style(CURSOR_STYLE)
+        return strip.crop_extend(scroll_x, scroll_x + self.size.width, None)
 
 
 class LogViewer(textual.app.App):
     """Log viewer ui."""
 
-    def __init__(self, path: str) -> None:
-        """Initializes the log viewer."""
+    BINDINGS = [("f", "toggle_follow", "Follow"),
+                ("slash", "focus_query", "Search"),
+                ("n", "jump(1)", "Next match"),
+                ("N", "jump(-1)", "Previous match"),
+                ("escape", "clear", "Clear")]
+
+    def __init__(self, path: str, follow: bool = False) -> None:
+        """Initializes the log viewer.
+
+        Arguments:
+            - path: path of the log file.
+            - follow: keep showing new lines (and newer logs of the same program).
+
+        Returns:
+            Nothing.
+        """
         super().__init__()
         self.path = path
-        self.console = rich.console.Console(highlighter=LogHighlighter(),
-                                            theme=THEME)
-
-    def on_ready(self) -> None:
-        "Add text when DOM is ready."
-        log = self.query_one("#log", textual.widgets.RichLog)
-        log.highlighter = LogHighlighter()  # type: ignore
-        with open(self.path, "r", encoding="utf-8") as file:
-            log_text = file.readlines()
-        for text in log_text:
-            log.write(text.replace("\n", ""))
+        self.follow = follow
 
     def compose(self) -> textual.app.ComposeResult:
         """Composes the ui."""
         yield textual.widgets.Header(show_clock=True)
-        yield textual.widgets.RichLog(id="log", highlight=True)
+        yield Log(self.path, self.follow, id="log")
+        yield textual.widgets.Input(placeholder="level:WARNING func:get_comic_image "
+                                    "proc:ForkPoolWorker-1 regex", id="query")
         yield textual.widgets.Footer()
 
+    def on_input_submitted(self, event: textual.widgets.Input.Submitted) -> None:
+        """Filter the log by the columns in the query and search for the rest."""
+        criteria = {}
+        words = []
+        for word in event.value.split():
+            name, _, value = word.partition(":")
+            if name in ("level", "func", "proc") and value:
+                criteria[name] = value.upper() if name == "level" else value
+            else:
+                words.append(word)
+        log = self.query_one("#log", Log)
+        log.filter(criteria)
+        log.search(" ".join(words))
+        if words:
+            log.jump(1)
+        log.focus()
+        self.update_status()
+
+    def update_status(self) -> None:
+        """Show the number of shown lines and matches."""
+        log = self.query_one("#log", Log)
+        self.sub_title = f"{log.rows()} lines" + (
+            f", {len(log.matches())} matches" if log.pattern else "")
+
+    def action_focus_query(self) -> None:
+        """Type a filter or search."""
+        self.query_one("#query", textual.widgets.Input).focus()
+
+    def action_jump(self, direction: int) -> None:
+        """Go to the next or previous match."""
+        if not self.query_one("#log", Log).jump(direction):
+            self.bell()
+        self.update_status()
+
+    def action_clear(self) -> None:
+        """Show all lines again."""
+        self.query_one("#query", textual.widgets.Input).value = ""
+        log = self.query_one("#log", Log)
+        log.filter({})
+        log.search("")
+        log.focus()
+        self.update_status()
+
+    def action_toggle_follow(self) -> None:
+        """Start or stop following the log."""
+        log = self.query_one("#log", Log)
+        # the worker of the log picks it up with its next check for new lines
+        log.follow = not log.follow
+        if log.follow:
+            log.scroll_end(animate=False)
+
 
 # TODO(LogViewer):
 # - create ascii art
@@ -169,4 +712,10 @@ class LogViewer(textual.app.App):
 # - only year as date breaks
 
 if __name__ == "__main__":
-    LogViewer("logs/comics-2023-09-21_18-40-32.log").run()
+    parser = argparse.ArgumentParser(description="View a log file.")
+    parser.add_argument("path", nargs="?", default="logs/comics-2023-09-21_18-40-32.log",
+                        help="path of the log file")
+    parser.add_argument("--follow", action="store_true",
+                        help="show new lines as they are written and switch to newer logs")
+    args = parser.parse_args()
+    LogViewer(args.path, args.follow).run()
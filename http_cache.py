@@ -0,0 +1,313 @@
+"""On-disk HTTP cache for the fetch layer. Responses are stored gzip compressed together with
+their ETag/Last-Modified, so they can be revalidated with conditional requests or be used
+to run the parsers completely offline.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+import typing
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode if a url is not in the cache."""
+
+
+class Entry:
+    """A cached response."""
+
+    def __init__(self, cache: "HTTPCache", path: str, meta: dict[str, typing.Any]) -> None:
+        """Initialize the entry.
+
+        Arguments:
+            - cache: the cache the entry belongs to.
+            - path: path of the entry without extension.
+            - meta: the metadata of the entry.
+
+        Returns:
+            Nothing.
+        """
+        self.cache = cache
+        self.path = path
+        self.meta = meta
+
+    @property
+    def url(self) -> str:
+        """The url of the entry."""
+        return self.meta["url"]
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """The stored headers of the entry."""
+        return self.meta["headers"]
+
+    def body(self) -> bytes:
+        """Read the body of the entry.
+
+        Returns:
+            The (uncompressed) body.
+        """
+        with gzip.open(f"{self.path}.gz", "rb") as file:
+            return file.read()
+
+    def open(self) -> typing.BinaryIO:
+        """Open the body of the entry for reading it in chunks.
+
+        Returns:
+            The (uncompressed) body as file.
+        """
+        return typing.cast(typing.BinaryIO, gzip.open(f"{self.path}.gz", "rb"))
+
+    def is_fresh(self) -> bool:
+        """Check whether the entry is younger than the ttl of the cache.
+
+        Returns:
+            True if the entry can be used without asking the server.
+        """
+        return time.time() - self.meta["stored"] < self.cache.ttl
+
+    def validators(self) -> dict[str, str]:
+        """Get the headers for a conditional request.
+
+        Returns:
+            If-None-Match and/or If-Modified-Since if the server sent validators.
+        """
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+
+class HTTPCache:
+    """Cache that stores every response in two files: '<hash>.json' with the metadata and
+    '<hash>.gz' with the compressed body. The hash is the sha256 of the url.
+    """
+
+    STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Date")
+
+    def __init__(self, directory: str = "cache", ttl: float = 12 * 60 * 60,
+                 max_size: int = 1024 ** 3, offline: bool = False) -> None:
+        """Initialize the cache.
+
+        Arguments:
+            - directory: directory to store the responses in.
+            - ttl: seconds a response is used without asking the server again.
+            - max_size: maximum size of the cache in bytes (enforced by prune).
+            - offline: only use the cache and never ask the server.
+
+        Returns:
+            Nothing.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+
+    def path(self, url: str) -> str:
+        """Get the path of the entry for a url.
+
+        Arguments:
+            - url: the url.
+
+        Returns:
+            The path without extension.
+        """
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, url: str) -> Entry | None:
+        """Get the entry for a url.
+
+        Arguments:
+            - url: the url.
+
+        Returns:
+            The entry or None if the url is not cached.
+        """
+        path = self.path(url)
+        try:
+            with open(f"{path}.json", "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # remember the last use for eviction
+        os.utime(f"{path}.json")
+        return Entry(self, path, meta)
+
+    def write(self, path: str, data: bytes) -> None:
+        """Atomically write a file, so other processes never see half an entry.
+
+        Arguments:
+            - path: the path to write to.
+            - data: the data to write.
+
+        Returns:
+            Nothing.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def store(self, url: str, status: int, headers: typing.Mapping[str, str],
+              body: bytes) -> Entry:
+        """Store a response.
+
+        Arguments:
+            - url: the url of the response.
+            - status: the status code.
+            - headers: the headers of the response.
+            - body: the (uncompressed) body.
+
+        Returns:
+            The new entry.
+        """
+        path = self.path(url)
+        meta = {"url": url, "status": status, "stored": time.time(), "size": len(body),
+                "headers": {name: headers[name] for name in self.STORED_HEADERS
+                            if name in headers}}
+        self.write(f"{path}.gz", gzip.compress(body, compresslevel=6))
+        self.write(f"{path}.json", json.dumps(meta).encode("utf-8"))
+        return Entry(self, path, meta)
+
+    def writer(self, url: str, status: int,
+               headers: typing.Mapping[str, str]) -> "EntryWriter":
+        """Store a response whose body arrives in chunks.
+
+        Arguments:
+            - url: the url of the response.
+            - status: the status code.
+            - headers: the headers of the response.
+
+        Returns:
+            The writer for the body; the entry exists once it is committed.
+        """
+        return EntryWriter(self, url, status, headers)
+
+    def refresh(self, entry: Entry, headers: typing.Mapping[str, str]) -> None:
+        """Mark an entry as fresh again after the server answered 304 Not Modified.
+
+        Arguments:
+            - entry: the entry.
+            - headers: the headers of the 304 response.
+
+        Returns:
+            Nothing.
+        """
+        entry.meta["stored"] = time.time()
+        entry.meta["headers"].update({name: headers[name] for name in self.STORED_HEADERS
+                                      if name in headers})
+        self.write(f"{entry.path}.json", json.dumps(entry.meta).encode("utf-8"))
+
+    def prune(self) -> tuple[int, int]:
+        """Delete the least recently used entries until the cache is not bigger than max_size.
+
+        Returns:
+            Number of deleted entries and the size of the cache afterwards in bytes.
+        """
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name.removesuffix(".json"))
+                try:
+                    size = os.path.getsize(f"{path}.json") + os.path.getsize(f"{path}.gz")
+                    last_used = os.path.getmtime(f"{path}.json")
+                except FileNotFoundError:
+                    continue
+                entries.append((last_used, size, path))
+                total_size += size
+        deleted = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            for extension in (".json", ".gz"):
+                try:
+                    os.remove(f"{path}{extension}")
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+            deleted += 1
+        return deleted, total_size
+
+
+class EntryWriter:
+    """Compresses a body chunk by chunk into a temporary file that becomes the entry
+    when it is committed.
+    """
+
+    def __init__(self, cache: HTTPCache, url: str, status: int,
+                 headers: typing.Mapping[str, str]) -> None:
+        """Initialize the writer.
+
+        Arguments:
+            - cache: the cache to store the response in.
+            - url: the url of the response.
+            - status: the status code.
+            - headers: the headers of the response.
+
+        Returns:
+            Nothing.
+        """
+        self.cache = cache
+        self.path = cache.path(url)
+        self.meta = {"url": url, "status": status, "size": 0,
+                     "headers": {name: headers[name] for name in cache.STORED_HEADERS
+                                 if name in headers}}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        file_descriptor, self.temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        # pylint: disable-next=consider-using-with
+        self.file = gzip.GzipFile(fileobj=os.fdopen(file_descriptor, "wb"), mode="wb",
+                                  compresslevel=6)
+
+    def write(self, data: bytes) -> None:
+        """Add a chunk of the body.
+
+        Arguments:
+            - data: the chunk.
+
+        Returns:
+            Nothing.
+        """
+        self.file.write(data)
+        self.meta["size"] += len(data)
+
+    def close_file(self) -> None:
+        """Close the compressed file and the file below it.
+
+        Returns:
+            Nothing.
+        """
+        fileobj = self.file.fileobj
+        self.file.close()
+        if fileobj is not None:
+            fileobj.close()
+
+    def commit(self) -> Entry:
+        """Finish the body and store the entry.
+
+        Returns:
+            The new entry.
+        """
+        self.close_file()
+        self.meta["stored"] = time.time()
+        os.replace(self.temp_path, f"{self.path}.gz")
+        self.cache.write(f"{self.path}.json", json.dumps(self.meta).encode("utf-8"))
+        return Entry(self.cache, self.path, self.meta)
+
+    def abort(self) -> None:
+        """Throw the body away, e.g. because it was not what was expected.
+
+        Returns:
+            Nothing.
+        """
+        self.close_file()
+        os.remove(self.temp_path)
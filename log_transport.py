@@ -0,0 +1,266 @@
+"""Batched transport for log records from the worker processes to the logging process.
+Records are buffered per process and sent in batches over a multiprocessing queue (a pipe,
+no round trip to a manager process). Progress is sent as counts instead of one message per
+step. If the logging process falls behind, the buffer is bounded: records below the drop
+level are dropped (and counted), more important records wait for space.
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import sys
+import threading
+import time
+import typing
+
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 0.1
+BUFFER_SIZE = 10000
+QUEUE_SIZE = 1024
+# seconds between two statuses, the final one is always sent
+STATUS_INTERVAL = 2.0
+
+
+class Batch(typing.NamedTuple):
+    """Everything a process sent since its last batch."""
+
+    proc: str
+    # (level, message, function, time) of every record
+    records: list[tuple[int, str, str, float]]
+    # new totals and steps of the progress tasks
+    totals: dict[str, int]
+    progress: dict[str, int]
+    dropped: int
+    # None if the status was sent recently
+    status: typing.Any
+
+
+class Transport:
+    """Buffers the records of one process and sends them in batches."""
+
+    def __init__(self, log_queue: multiprocessing.Queue, progress: dict[str, str] | None = None,
+                 status: typing.Callable[[], typing.Any] | None = None,
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 buffer_size: int = BUFFER_SIZE, drop_level: int = logging.WARNING) -> None:
+        """Initialize the transport and start the thread that flushes it regularly.
+
+        Arguments:
+            - log_queue: the queue the logging process reads from.
+            - progress: which function advances which progress task with every record.
+            - status: gets a status of the process that is sent with the batches, at most
+            every STATUS_INTERVAL seconds and with the last one.
+            - batch_size: number of records that are sent together.
+            - flush_interval: seconds after which records are sent anyway.
+            - buffer_size: maximum number of records waiting to be sent.
+            - drop_level: records below this level are dropped if the buffer is full.
+
+        Returns:
+            Nothing.
+        """
+        self.queue = log_queue
+        self.progress = progress if progress is not None else {}
+        self.status = status
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.drop_level = drop_level
+        self.pid = os.getpid()
+        self.proc = multiprocessing.current_process().name
+        self.lock = threading.Lock()
+        # keeps the batches in order if several threads flush
+        self.flush_lock = threading.Lock()
+        self.records: list[tuple[int, str, str, float]] = []
+        self.totals: dict[str, int] = {}
+        self.counts: dict[str, int] = {}
+        self.dropped = 0
+        self.status_sent = 0.0
+        self.stopped = threading.Event()
+        thread = threading.Thread(target=self.run, args=(flush_interval,), daemon=True)
+        thread.start()
+        # send the rest when the process exits (pool workers have to be closed, not terminated),
+        # before the queue closes its feeder thread (exitpriority 10)
+        multiprocessing.util.Finalize(self, self.close, exitpriority=20)
+
+    def run(self, flush_interval: float) -> None:
+        """Flush the transport regularly, so records do not wait for a full batch.
+
+        Arguments:
+            - flush_interval: seconds between two flushes.
+
+        Returns:
+            Nothing.
+        """
+        while not self.stopped.wait(flush_interval):
+            self.flush(block=True)
+
+    def send(self, level: int, msg: str, func: str) -> None:
+        """Add a record.
+
+        Arguments:
+            - level: level of the record.
+            - msg: the message.
+            - func: the function that logged the message.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            if func in self.progress:
+                task = self.progress[func]
+                self.counts[task] = self.counts.get(task, 0) + 1
+            full = len(self.records) >= self.buffer_size
+            if full and level < self.drop_level:
+                self.dropped += 1
+                return
+            self.records.append((level, msg, func, time.time()))
+            ready = len(self.records) >= self.batch_size
+        if full:
+            # backpressure: wait until the logging process took the buffer
+            self.flush(block=True)
+        elif ready:
+            self.flush(block=False)
+
+    def total(self, task: str, total: int) -> None:
+        """Set the total of a progress task. Sent immediately, the workers are about to
+        advance the task.
+
+        Arguments:
+            - task: the progress task.
+            - total: the total.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.totals[task] = total
+        self.flush(block=True)
+
+    def flush(self, block: bool = True, final: bool = False) -> None:
+        """Send everything that is buffered.
+
+        Arguments:
+            - block: wait if the queue is full, otherwise try again later.
+            - final: send the status even if nothing is buffered or it was sent recently
+            (it may have changed since the last batch).
+
+        Returns:
+            Nothing.
+        """
+        with self.flush_lock:
+            with self.lock:
+                if not (self.records or self.totals or self.counts or self.dropped
+                        or (final and self.status is not None)):
+                    return
+                status = None
+                now = time.monotonic()
+                if self.status is not None \
+                        and (final or now - self.status_sent >= STATUS_INTERVAL):
+                    status = self.status()
+                    self.status_sent = now
+                batch = Batch(self.proc, self.records, self.totals, self.counts, self.dropped,
+                              status)
+                self.records, self.totals, self.counts, self.dropped = [], {}, {}, 0
+            try:
+                self.queue.put(batch, block=block)
+            except queue.Full:
+                # put everything back in front of what came in since
+                with self.lock:
+                    self.records[:0] = batch.records
+                    self.totals = batch.totals | self.totals
+                    for task, count in batch.progress.items():
+                        self.counts[task] = self.counts.get(task, 0) + count
+                    self.dropped += batch.dropped
+                    if batch.status is not None:
+                        self.status_sent = 0.0
+
+    def close(self) -> None:
+        """Stop the flushing thread and send the rest.
+
+        Returns:
+            Nothing.
+        """
+        self.stopped.set()
+        self.flush(block=True, final=True)
+
+
+_transport: Transport | None = None
+_settings: dict[str, typing.Any] = {}
+
+
+def install(log_queue: multiprocessing.Queue, progress: dict[str, str] | None = None,
+            status: typing.Callable[[], typing.Any] | None = None) -> None:
+    """Set the queue to send the records of this process (and its children) to.
+    Can be used as initializer of a process pool.
+
+    Arguments:
+        - log_queue: the queue the logging process reads from.
+        - progress: which function advances which progress task with every record.
+        - status: gets a status of the process that is sent with the batches.
+
+    Returns:
+        Nothing.
+    """
+    global _transport  # pylint: disable=global-statement
+    if _transport is not None and _transport.pid == os.getpid():
+        _transport.close()
+    _settings.update({"log_queue": log_queue, "progress": progress, "status": status})
+    _transport = None
+
+
+def transport() -> Transport | None:
+    """Get the transport of this process. Forked processes get their own.
+
+    Returns:
+        The transport or None if install was not called (e.g. if the crawler is used as a
+        library), the records are then logged in this process.
+    """
+    global _transport  # pylint: disable=global-statement
+    if not _settings:
+        return None
+    if _transport is None or _transport.pid != os.getpid():
+        _transport = Transport(**_settings)
+    return _transport
+
+
+def send(level: int, msg: str, func: str = "") -> None:
+    """Log a message in the logging process.
+
+    Arguments:
+        - level: level to log with.
+        - msg: message to log.
+        - func: the function that logs, by default the caller.
+
+    Returns:
+        Nothing.
+    """
+    if (current := transport()) is None:
+        # the logger the logging process writes the records to
+        logging.getLogger("comics").log(level, msg)
+        return
+    # pylint: disable-next=protected-access
+    current.send(level, msg, func or sys._getframe(1).f_code.co_name)
+
+
+def total(task: str, count: int) -> None:
+    """Set the total of a progress task.
+
+    Arguments:
+        - task: the progress task.
+        - count: the total.
+
+    Returns:
+        Nothing.
+    """
+    if (current := transport()) is not None:
+        current.total(task, count)
+
+
+def flush() -> None:
+    """Send everything that is buffered in this process and its status.
+
+    Returns:
+        Nothing.
+    """
+    if (current := transport()) is not None:
+        current.flush(block=True, final=True)
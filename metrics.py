@@ -0,0 +1,363 @@
+"""Metrics of a run: counters (e.g. requests by host and status) and latency histograms (e.g. of
+the fetch and parse step of every stage). Every process records its own metrics; the snapshots
+of all processes are merged at the end of the run and written as a JSON report and in the
+Prometheus text format. The histograms have fixed buckets, so they can be merged exactly.
+"""
+
+import bisect
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+import time
+import typing
+import urllib.parse
+
+# upper bounds of the histogram buckets in seconds, the last bucket is unbounded
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+# a series is the name of a metric and its labels, e.g. ('requests', (('host', 'a'),))
+Series = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def worker() -> str:
+    """Get the name of this worker: the process and, outside of the main thread, the thread.
+
+    Returns:
+        The name.
+    """
+    thread = threading.current_thread()
+    process = multiprocessing.current_process().name
+    return process if thread is threading.main_thread() else f"{process}/{thread.name}"
+
+
+def request_size(method: str, url: str, headers: typing.Mapping[str, str]) -> int:
+    """Estimate the size of a request (request line and headers, there is no body).
+
+    Arguments:
+        - method: the method, e.g. 'GET'.
+        - url: the url.
+        - headers: the headers that were sent.
+
+    Returns:
+        The size in bytes.
+    """
+    parts = urllib.parse.urlsplit(url)
+    target = f"{parts.path or '/'}{f'?{parts.query}' if parts.query else ''}"
+    return (len(f"{method} {target} HTTP/1.1\r\n") + len(f"Host: {parts.netloc}\r\n")
+            + sum(len(f"{name}: {value}\r\n") for name, value in headers.items()) + 2)
+
+
+class Registry:
+    """The metrics of this process."""
+
+    def __init__(self) -> None:
+        """Initialize the registry.
+
+        Returns:
+            Nothing.
+        """
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all metrics.
+
+        Returns:
+            Nothing.
+        """
+        self.counters: dict[Series, float] = {}
+        # bucket counts, then sum, count and maximum
+        self.histograms: dict[Series, list[float]] = {}
+        # start of the first and end of the last item of every worker
+        self.activity: dict[str, list[float]] = {}
+
+    def check_process(self) -> None:
+        """Reset the metrics if this is a forked process; they belong to the parent.
+
+        Returns:
+            Nothing.
+        """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.reset()
+
+    def count(self, name: str, value: float = 1, **labels: typing.Any) -> None:
+        """Add to a counter.
+
+        Arguments:
+            - name: the name of the counter, e.g. 'requests'.
+            - value: what to add.
+            - labels: the labels, e.g. host='example.com'.
+
+        Returns:
+            Nothing.
+        """
+        series = (name, tuple(sorted((key, str(label)) for key, label in labels.items())))
+        with self.lock:
+            self.check_process()
+            self.counters[series] = self.counters.get(series, 0) + value
+
+    def observe(self, name: str, value: float, **labels: typing.Any) -> None:
+        """Add a value to a histogram.
+
+        Arguments:
+            - name: the name of the histogram, e.g. 'request_seconds'.
+            - value: the value, e.g. the latency in seconds.
+            - labels: the labels, e.g. host='example.com'.
+
+        Returns:
+            Nothing.
+        """
+        series = (name, tuple(sorted((key, str(label)) for key, label in labels.items())))
+        with self.lock:
+            self.check_process()
+            histogram = self.histograms.setdefault(series, [0] * (len(BUCKETS) + 4))
+            histogram[bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[-3] += value
+            histogram[-2] += 1
+            histogram[-1] = max(histogram[-1], value)
+
+    def active(self, when: float) -> None:
+        """Note that this worker was working, e.g. when it started an item.
+
+        Arguments:
+            - when: the time (seconds since the epoch).
+
+        Returns:
+            Nothing.
+        """
+        name = worker()
+        with self.lock:
+            self.check_process()
+            times = self.activity.setdefault(name, [when, when])
+            times[:] = [min(times[0], when), max(times[1], when)]
+
+    def item(self, stage: str) -> None:
+        """Count a finished item of a stage for the throughput of this worker.
+
+        Arguments:
+            - stage: the stage, e.g. 'get_comic_links'.
+
+        Returns:
+            Nothing.
+        """
+        self.count("items", stage=stage, worker=worker())
+        self.active(time.time())
+
+    def snapshot(self) -> dict[str, typing.Any]:
+        """Get a copy of the metrics, e.g. to send it to another process.
+
+        Returns:
+            The counters, histograms and activity of the workers.
+        """
+        with self.lock:
+            self.check_process()
+            return {"counters": dict(self.counters),
+                    "histograms": {series: list(histogram)
+                                   for series, histogram in self.histograms.items()},
+                    "activity": {name: list(times) for name, times in self.activity.items()}}
+
+
+REGISTRY = Registry()
+
+
+def count(name: str, value: float = 1, **labels: typing.Any) -> None:
+    """Add to a counter of this process, see Registry.count."""
+    REGISTRY.count(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: typing.Any) -> None:
+    """Add a value to a histogram of this process, see Registry.observe."""
+    REGISTRY.observe(name, value, **labels)
+
+
+def item(stage: str) -> None:
+    """Count a finished item of this worker, see Registry.item."""
+    REGISTRY.item(stage)
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels: typing.Any) -> typing.Iterator[None]:
+    """Measure how long the block takes and add it to a histogram of this process.
+
+    Arguments:
+        - name: the name of the histogram, e.g. 'stage_seconds'.
+        - labels: the labels, e.g. stage='get_comic_links', step='parse'.
+
+    Returns:
+        Nothing.
+    """
+    REGISTRY.active(time.time())
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.monotonic() - start_time, **labels)
+
+
+def snapshot() -> dict[str, typing.Any]:
+    """Get the metrics of this process, see Registry.snapshot."""
+    return REGISTRY.snapshot()
+
+
+def merge(snapshots: typing.Iterable[dict[str, typing.Any]]) -> dict[str, typing.Any]:
+    """Merge the snapshots of several processes.
+
+    Arguments:
+        - snapshots: the snapshots.
+
+    Returns:
+        One snapshot with everything.
+    """
+    merged: dict[str, typing.Any] = {"counters": {}, "histograms": {}, "activity": {}}
+    for item_snapshot in snapshots:
+        for series, value in item_snapshot["counters"].items():
+            merged["counters"][series] = merged["counters"].get(series, 0) + value
+        for series, histogram in item_snapshot["histograms"].items():
+            if series not in merged["histograms"]:
+                merged["histograms"][series] = list(histogram)
+                continue
+            target = merged["histograms"][series]
+            for index, value in enumerate(histogram[:-1]):
+                target[index] += value
+            target[-1] = max(target[-1], histogram[-1])
+        for name, (first, last) in item_snapshot["activity"].items():
+            times = merged["activity"].setdefault(name, [first, last])
+            times[:] = [min(times[0], first), max(times[1], last)]
+    return merged
+
+
+def quantile(histogram: list[float], fraction: float) -> float:
+    """Estimate a quantile of a histogram, interpolating linearly within the bucket
+    (like histogram_quantile of Prometheus).
+
+    Arguments:
+        - histogram: the bucket counts, sum, count and maximum.
+        - fraction: the quantile, e.g. 0.95.
+
+    Returns:
+        The estimate (at most the maximum).
+    """
+    total = histogram[-2]
+    if not total:
+        return 0.0
+    rank = fraction * total
+    seen = 0.0
+    for index, bucket_count in enumerate(histogram[:len(BUCKETS) + 1]):
+        if bucket_count and seen + bucket_count >= rank:
+            lower = BUCKETS[index - 1] if index else 0.0
+            upper = BUCKETS[index] if index < len(BUCKETS) else histogram[-1]
+            return min(lower + (upper - lower) * (rank - seen) / bucket_count, histogram[-1])
+        seen += bucket_count
+    return histogram[-1]
+
+
+def report(merged: dict[str, typing.Any], started: float,
+           finished: float | None = None) -> dict[str, typing.Any]:
+    """Make the JSON report of a run.
+
+    Arguments:
+        - merged: the merged snapshots of all processes.
+        - started: when the run started (seconds since the epoch).
+        - finished: when the run finished, by default now.
+
+    Returns:
+        The report: counters, histograms with quantiles and the throughput of every worker.
+    """
+    finished = finished if finished is not None else time.time()
+    items: dict[str, float] = {}
+    for (name, labels), value in merged["counters"].items():
+        if name == "items":
+            worker_name = dict(labels)["worker"]
+            items[worker_name] = items.get(worker_name, 0) + value
+    return {
+        "started": datetime.datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "finished": datetime.datetime.fromtimestamp(finished).isoformat(timespec="seconds"),
+        "seconds": round(finished - started, 3),
+        "counters": [{"name": name, "labels": dict(labels), "value": value}
+                     for (name, labels), value in sorted(merged["counters"].items())],
+        "histograms": [{"name": name, "labels": dict(labels), "count": histogram[-2],
+                        "sum": round(histogram[-3], 6),
+                        "mean": round(histogram[-3] / max(histogram[-2], 1), 6),
+                        "max": round(histogram[-1], 6)}
+                       | {f"p{round(fraction * 100)}": round(quantile(histogram, fraction), 6)
+                          for fraction in QUANTILES}
+                       for (name, labels), histogram in sorted(merged["histograms"].items())],
+        "workers": [{"worker": name, "items": items.get(name, 0),
+                     "seconds": round(last - first, 3),
+                     "items_per_second": round(items.get(name, 0) / max(last - first, 1e-3), 2)}
+                    for name, (first, last) in sorted(merged["activity"].items())]}
+
+
+def escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format.
+
+    Arguments:
+        - value: the value.
+
+    Returns:
+        The escaped value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus(merged: dict[str, typing.Any], prefix: str) -> str:
+    """Format the metrics in the Prometheus text format, e.g. for the textfile collector
+    of the node exporter.
+
+    Arguments:
+        - merged: the merged snapshots of all processes.
+        - prefix: prefix of the metric names, e.g. 'comics'.
+
+    Returns:
+        The text.
+    """
+    def labels_text(labels: typing.Iterable[tuple[str, str]]) -> str:
+        text = ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+        return f"{{{text}}}" if text else ""
+
+    lines = []
+    for name in sorted({name for name, _ in merged["counters"]}):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines += [f"{prefix}_{name}_total{labels_text(labels)} {value:g}"
+                  for (series_name, labels), value in sorted(merged["counters"].items())
+                  if series_name == name]
+    for name in sorted({name for name, _ in merged["histograms"]}):
+        lines.append(f"# TYPE {prefix}_{name} histogram")
+        for (series_name, labels), histogram in sorted(merged["histograms"].items()):
+            if series_name != name:
+                continue
+            cumulative = 0.0
+            for bound, bucket_count in zip([*map(str, BUCKETS), "+Inf"], histogram):
+                cumulative += bucket_count
+                lines.append(f"{prefix}_{name}_bucket"
+                             f"{labels_text([*labels, ('le', bound)])} {cumulative:g}")
+            lines.append(f"{prefix}_{name}_sum{labels_text(labels)} {histogram[-3]:g}")
+            lines.append(f"{prefix}_{name}_count{labels_text(labels)} {histogram[-2]:g}")
+    return "\n".join(lines) + "\n"
+
+
+def write(merged: dict[str, typing.Any], started: float, report_path: str,
+          prometheus_path: str, prefix: str) -> None:
+    """Write the JSON report and the Prometheus file of a run.
+
+    Arguments:
+        - merged: the merged snapshots of all processes.
+        - started: when the run started (seconds since the epoch).
+        - report_path: path of the JSON report.
+        - prometheus_path: path of the Prometheus file.
+        - prefix: prefix of the Prometheus metric names.
+
+    Returns:
+        Nothing.
+    """
+    for path, text in ((report_path, json.dumps(report(merged, started), indent=4)),
+                       (prometheus_path, prometheus(merged, prefix))):
+        # replaced atomically, a collector may read the file at any time
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,231 @@
+"""Opt-in profiling of the crawl stages. Every process (the main process, the pool workers and
+the parse workers) profiles the stages it runs with cProfile and records where the memory of a
+stage was allocated with tracemalloc. The processes save their data when they exit; the main
+process merges it after the run into one profile and one allocation report per stage:
+
+    python comics.py --profile profiles
+    python -m pstats profiles/get_comic_information.prof
+
+Profiling slows a run down a lot (tracemalloc traces every allocation), so only use it to find
+out where the time and memory of a slow run go. Only synchronous code can be profiled by stage;
+the requests of the asyncio modes interleave in the main process and are only covered by the
+metrics.
+"""
+
+import collections
+import contextlib
+import cProfile
+import glob
+import json
+import linecache
+import multiprocessing.util
+import os
+import pstats
+import shutil
+import threading
+import time
+import tracemalloc
+import typing
+
+# number of functions and allocation sites in the reports
+TOP = 25
+# frames kept of every allocation, the first one is the allocation site
+FRAMES = 1
+
+
+class Recorder:
+    """The profiles and allocations of the stages run by one process."""
+
+    def __init__(self, directory: str) -> None:
+        """Initialize the recorder and start tracing allocations. The data is saved when
+        the process exits.
+
+        Arguments:
+            - directory: directory of the profiling data of the run.
+
+        Returns:
+            Nothing.
+        """
+        self.directory = directory
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        # only one stage per process is profiled at a time, cProfile does not nest
+        self.active = False
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.seconds: collections.Counter[str] = collections.Counter()
+        self.peaks: dict[str, int] = {}
+        # stage: allocation site: [bytes, blocks]
+        self.sites: dict[str, dict[str, list[int]]] = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(FRAMES)
+        multiprocessing.util.Finalize(self, self.save, exitpriority=30)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> typing.Iterator[bool]:
+        """Profile a stage.
+
+        Arguments:
+            - name: name of the stage, e.g. 'get_comic_links'.
+
+        Returns:
+            Whether the stage is profiled (False if another one already is).
+        """
+        with self.lock:
+            nested, self.active = self.active, True
+        if nested:
+            yield False
+            return
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        before = snapshot()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield True
+        finally:
+            profile.disable()
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            _, peak = tracemalloc.get_traced_memory()
+            self.peaks[name] = max(self.peaks.get(name, 0), peak - current)
+            # memory the stage allocated and did not free yet (its result, caches, leaks and
+            # garbage the collector has not freed yet, like BeautifulSoup trees)
+            sites = self.sites.setdefault(name, {})
+            for statistic in snapshot().compare_to(before, "lineno"):
+                if statistic.size_diff > 0:
+                    frame = statistic.traceback[0]
+                    site = sites.setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+                    site[0] += statistic.size_diff
+                    site[1] += max(statistic.count_diff, 0)
+            with self.lock:
+                self.active = False
+
+    def save(self) -> None:
+        """Save the profiles and allocations of this process.
+
+        Returns:
+            Nothing.
+        """
+        if os.getpid() != self.pid or not self.calls:
+            return
+        parts = os.path.join(self.directory, "parts")
+        os.makedirs(parts, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(parts, f"{name}.{self.pid}.prof"))
+        with open(os.path.join(parts, f"allocations.{self.pid}.json"), "w",
+                  encoding="utf-8") as file:
+            json.dump({name: {"calls": self.calls[name], "seconds": self.seconds[name],
+                              "peak": self.peaks[name], "sites": self.sites[name]}
+                       for name in self.calls}, file)
+        self.calls.clear()
+
+
+RECORDER: Recorder | None = None
+
+
+def snapshot() -> tracemalloc.Snapshot:
+    """Take a snapshot of the traced allocations, without those of the snapshots.
+
+    Returns:
+        The snapshot.
+    """
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def recorder(directory: str) -> Recorder:
+    """Get the recorder of this process, it is started with the first stage.
+
+    Arguments:
+        - directory: directory of the profiling data of the run.
+
+    Returns:
+        The recorder.
+    """
+    global RECORDER  # pylint: disable=global-statement
+    # a forked process inherits the recorder of its parent
+    if RECORDER is None or RECORDER.pid != os.getpid():
+        RECORDER = Recorder(directory)
+    return RECORDER
+
+
+def stage(directory: str | None, name: str) -> typing.ContextManager[bool]:
+    """Profile a stage if profiling is on.
+
+    Arguments:
+        - directory: directory of the profiling data of the run or None to not profile.
+        - name: name of the stage.
+
+    Returns:
+        Context manager that gives whether the stage is profiled.
+    """
+    if directory is None:
+        return contextlib.nullcontext(False)
+    return recorder(directory).stage(name)
+
+
+def clear(directory: str) -> None:
+    """Remove the data of the processes of an earlier run.
+
+    Arguments:
+        - directory: directory of the profiling data.
+
+    Returns:
+        Nothing.
+    """
+    shutil.rmtree(os.path.join(directory, "parts"), ignore_errors=True)
+
+
+def merge(directory: str, top: int = TOP) -> list[str]:
+    """Merge the data of all processes. Writes the combined profile ('<stage>.prof', for
+    pstats or snakeviz) and a report with the top functions and allocation sites
+    ('<stage>.txt') of every stage, and all allocations to 'allocations.json'.
+
+    Arguments:
+        - directory: directory of the profiling data of the run.
+        - top: number of functions and allocation sites in the reports.
+
+    Returns:
+        The stages that were profiled.
+    """
+    if RECORDER is not None:
+        RECORDER.save()
+    parts = os.path.join(directory, "parts")
+    allocations: dict[str, dict[str, typing.Any]] = {}
+    for path in sorted(glob.glob(os.path.join(parts, "allocations.*.json"))):
+        with open(path, "r", encoding="utf-8") as file:
+            for name, data in json.load(file).items():
+                stage_data = allocations.setdefault(
+                    name, {"calls": 0, "seconds": 0.0, "peak": 0, "processes": 0, "sites": {}})
+                stage_data["calls"] += data["calls"]
+                stage_data["seconds"] += data["seconds"]
+                stage_data["peak"] = max(stage_data["peak"], data["peak"])
+                stage_data["processes"] += 1
+                for site, (size, count) in data["sites"].items():
+                    totals = stage_data["sites"].setdefault(site, [0, 0])
+                    totals[0] += size
+                    totals[1] += count
+    for name, stage_data in allocations.items():
+        stage_data["sites"] = dict(sorted(stage_data["sites"].items(),
+                                          key=lambda item: item[1][0], reverse=True))
+        stats = pstats.Stats(*sorted(glob.glob(os.path.join(parts, f"{name}.*.prof"))))
+        stats.dump_stats(os.path.join(directory, f"{name}.prof"))
+        with open(os.path.join(directory, f"{name}.txt"), "w", encoding="utf-8") as file:
+            file.write(f"{name}: {stage_data['calls']} calls in {stage_data['processes']} "
+                       f"processes, {stage_data['seconds']:.2f} seconds, peak "
+                       f"{stage_data['peak'] / 1024:.1f} KiB\n\n")
+            stats.stream = file  # type: ignore[attr-defined]
+            stats.sort_stats("cumulative").print_stats(top)
+            stats.sort_stats("tottime").print_stats(top)
+            file.write(f"Top {top} allocation sites (memory left allocated by the stage)\n\n")
+            for site, (size, count) in list(stage_data["sites"].items())[:top]:
+                filename, _, lineno = site.rpartition(":")
+                file.write(f"{size / 1024:10.1f} KiB {count:8} blocks  {site}\n"
+                           f"{'':30}{linecache.getline(filename, int(lineno)).strip()}\n")
+    with open(os.path.join(directory, "allocations.json"), "w", encoding="utf-8") as file:
+        json.dump(allocations, file, indent=4)
+    shutil.rmtree(parts, ignore_errors=True)
+    return list(allocations)
+
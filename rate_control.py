@@ -0,0 +1,272 @@
+"""Adaptive per-host concurrency control for the fetch layer. Every host gets a limit of requests
+in flight that grows while responses are fast and successful (additive increase) and is cut on
+429, 5xx and timeouts (multiplicative decrease); a Retry-After pauses the host. The limits live
+in shared memory, so all processes and threads of a run share them.
+"""
+
+import asyncio
+import email.utils
+import multiprocessing
+import random
+import time
+
+MAX_HOSTS = 16
+HOST_SIZE = 128
+POLL_INTERVAL = 0.01
+# latency jitter in seconds that is not a sign of overload (matters for very fast hosts)
+LATENCY_SLACK = 0.05
+# responses that mean the host is overloaded; they are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+FIELDS = ("limit", "in_flight", "paused_until", "last_decrease", "min_latency", "latency",
+          "started", "requests", "throttled", "errors")
+FIELD = {name: index for index, name in enumerate(FIELDS)}
+
+
+def retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header.
+
+    Arguments:
+        - value: the header, either seconds or an HTTP date.
+
+    Returns:
+        The seconds to wait or None if there is no (valid) header.
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, wait: float | None = None, base: float = 0.5,
+            maximum: float = 60) -> float:
+    """Get the delay before the next attempt: the Retry-After if the server sent one,
+    otherwise exponential with full jitter.
+
+    Arguments:
+        - attempt: number of the failed attempt, starting at 0.
+        - wait: seconds from the Retry-After header or None.
+        - base: delay after the first attempt in seconds (before jitter).
+        - maximum: maximum delay in seconds.
+
+    Returns:
+        The delay in seconds.
+    """
+    if wait is not None:
+        return min(wait, maximum)
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class RateController:
+    """Limits the requests in flight per host (AIMD). Create it before the worker processes
+    and hand it to them (e.g. as argument of the pool initializer).
+    """
+
+    def __init__(self, initial: float = 4, minimum: float = 1, maximum: float = 32,
+                 latency_factor: float = 3, decrease: float = 0.5,
+                 max_pause: float = 60) -> None:
+        """Initialize the controller.
+
+        Arguments:
+            - initial: limit of a host that was not seen yet.
+            - minimum: the limit never goes below this.
+            - maximum: the limit never goes above this.
+            - latency_factor: responses slower than this times the fastest response of the
+            host count as a sign of overload; the limit then stops growing and shrinks slowly.
+            - decrease: factor the limit is multiplied with on 429, 5xx and timeouts.
+            - max_pause: maximum seconds a Retry-After pauses a host.
+
+        Returns:
+            Nothing.
+        """
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.decrease = decrease
+        self.max_pause = max_pause
+        self.lock = multiprocessing.Lock()
+        self.hosts = multiprocessing.Array("c", MAX_HOSTS * HOST_SIZE, lock=False)
+        self.values = multiprocessing.Array("d", MAX_HOSTS * len(FIELDS), lock=False)
+
+    def slot(self, host: str) -> int | None:
+        """Get the slot of a host, claim a new one if it was not seen yet.
+        Has to be called with the lock held.
+
+        Arguments:
+            - host: the host.
+
+        Returns:
+            The slot or None if all slots are taken (the host is then not limited).
+        """
+        name = host.encode("utf-8")[:HOST_SIZE]
+        for slot in range(MAX_HOSTS):
+            stored = self.hosts[slot * HOST_SIZE:(slot + 1) * HOST_SIZE].rstrip(b"\0")
+            if stored == name:
+                return slot
+            if not stored:
+                self.hosts[slot * HOST_SIZE:slot * HOST_SIZE + len(name)] = name
+                self.set(slot, "limit", self.initial)
+                self.set(slot, "started", time.time())
+                return slot
+        return None
+
+    def get(self, slot: int, field: str) -> float:
+        """Read a field of a host. Has to be called with the lock held.
+
+        Arguments:
+            - slot: the slot of the host.
+            - field: the field, one of FIELDS.
+
+        Returns:
+            The value.
+        """
+        return self.values[slot * len(FIELDS) + FIELD[field]]
+
+    def set(self, slot: int, field: str, value: float) -> None:
+        """Write a field of a host. Has to be called with the lock held.
+
+        Arguments:
+            - slot: the slot of the host.
+            - field: the field, one of FIELDS.
+            - value: the new value.
+
+        Returns:
+            Nothing.
+        """
+        self.values[slot * len(FIELDS) + FIELD[field]] = value
+
+    def try_acquire(self, host: str) -> float:
+        """Take a request slot of a host if one is free.
+
+        Arguments:
+            - host: the host.
+
+        Returns:
+            0 if the request may start, otherwise the seconds to wait before trying again.
+        """
+        with self.lock:
+            slot = self.slot(host)
+            if slot is None:
+                return 0
+            paused = self.get(slot, "paused_until") - time.time()
+            if paused > 0:
+                return paused
+            if self.get(slot, "in_flight") + 1 > max(self.get(slot, "limit"), self.minimum):
+                return POLL_INTERVAL
+            self.set(slot, "in_flight", self.get(slot, "in_flight") + 1)
+            return 0
+
+    def acquire(self, host: str) -> None:
+        """Wait until a request to a host may start.
+
+        Arguments:
+            - host: the host.
+
+        Returns:
+            Nothing.
+        """
+        while (wait := self.try_acquire(host)) > 0:
+            time.sleep(min(wait, 1))
+
+    async def acquire_async(self, host: str) -> None:
+        """Wait until a request to a host may start, without blocking the event loop.
+
+        Arguments:
+            - host: the host.
+
+        Returns:
+            Nothing.
+        """
+        while (wait := self.try_acquire(host)) > 0:
+            await asyncio.sleep(min(wait, 1))
+
+    def release(self, host: str, latency: float, status: int | None,
+                wait: float | None = None) -> None:
+        """Give back the request slot and adapt the limit of the host to the outcome.
+
+        Arguments:
+            - host: the host.
+            - latency: seconds the request took.
+            - status: status code of the response or None if it failed (e.g. timeout).
+            - wait: seconds from the Retry-After header or None.
+
+        Returns:
+            Nothing.
+        """
+        now = time.time()
+        with self.lock:
+            slot = self.slot(host)
+            if slot is None:
+                return
+            self.set(slot, "in_flight", max(0, self.get(slot, "in_flight") - 1))
+            self.set(slot, "requests", self.get(slot, "requests") + 1)
+            limit = self.get(slot, "limit")
+            # only one decrease per round trip, the other requests of the round saw the same
+            may_decrease = now - self.get(slot, "last_decrease") > max(
+                self.get(slot, "latency"), POLL_INTERVAL)
+            if status is None or status in THROTTLE_STATUSES or status >= 500:
+                field = "throttled" if status in THROTTLE_STATUSES else "errors"
+                self.set(slot, field, self.get(slot, field) + 1)
+                if wait is not None:
+                    self.set(slot, "paused_until", max(self.get(slot, "paused_until"),
+                                                       now + min(wait, self.max_pause)))
+                if may_decrease:
+                    limit *= self.decrease
+                    self.set(slot, "last_decrease", now)
+            else:
+                min_latency = self.get(slot, "min_latency")
+                min_latency = latency if not min_latency else min(min_latency, latency)
+                self.set(slot, "min_latency", min_latency)
+                self.set(slot, "latency", latency if not self.get(slot, "latency")
+                         else 0.8 * self.get(slot, "latency") + 0.2 * latency)
+                if latency <= self.latency_factor * min_latency + LATENCY_SLACK:
+                    # one more request in flight per round trip
+                    limit += 1 / max(limit, 1)
+                elif may_decrease:
+                    limit *= 0.9
+                    self.set(slot, "last_decrease", now)
+            self.set(slot, "limit", min(max(limit, self.minimum), self.maximum))
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        """Get the current limits and the throughput of every host.
+
+        Returns:
+            The metrics by host: limit, in_flight, requests, throttled, errors,
+            requests_per_second, latency_ms and paused (seconds left).
+        """
+        now = time.time()
+        metrics = {}
+        with self.lock:
+            for slot in range(MAX_HOSTS):
+                host = self.hosts[slot * HOST_SIZE:(slot + 1) * HOST_SIZE].rstrip(b"\0")
+                if not host:
+                    break
+                metrics[host.decode("utf-8", "replace")] = {
+                    "limit": round(self.get(slot, "limit"), 2),
+                    "in_flight": self.get(slot, "in_flight"),
+                    "requests": self.get(slot, "requests"),
+                    "throttled": self.get(slot, "throttled"),
+                    "errors": self.get(slot, "errors"),
+                    "requests_per_second": round(self.get(slot, "requests") / max(
+                        now - self.get(slot, "started"), 1e-3), 2),
+                    "latency_ms": round(self.get(slot, "latency") * 1000, 1),
+                    "paused": round(max(0, self.get(slot, "paused_until") - now), 1)}
+        return metrics
+
+    def summary(self) -> str:
+        """Summarize the metrics for logging.
+
+        Returns:
+            A short text per host.
+        """
+        return " ".join(
+            f"{host}: limit {metrics['limit']}, {metrics['requests_per_second']} requests "
+            f"per second, {metrics['latency_ms']} ms, {int(metrics['throttled'])} throttled, "
+            f"{int(metrics['errors'])} errors."
+            for host, metrics in self.metrics().items()) or "No requests."
+
@@ -0,0 +1,134 @@
+"""Series index for the comics. Splits every article number into series prefix and issue
+number (e.g. 'DPB3DC012' into 'DPB3DC' and 12) and keeps the record ids of every series
+sorted by issue, so series lookups only touch the matching records.
+"""
+
+import bisect
+import json
+import os
+import re
+import typing
+
+ARTICLE_NUMBER = re.compile(r"^(.*?)(\d+)$")
+
+
+def split_article_number(article_number: str) -> tuple[str, int | None]:
+    """Split an article number into series prefix and issue number,
+    e.g. 'DPB3DC012' into ('DPB3DC', 12).
+
+    Arguments:
+        - article_number: the article number.
+
+    Returns:
+        The prefix and the issue number (None if there is no number at the end).
+    """
+    if match := ARTICLE_NUMBER.match(article_number):
+        return match.group(1), int(match.group(2))
+    return article_number, None
+
+
+class SeriesIndex:
+    """Maps series prefixes to the (issue, record id) pairs of the series, sorted by issue.
+    Can be used as a sink of writer.CatalogWriter; it is then built while the records
+    arrive and saved next to the JSON file when it is closed.
+    """
+
+    def __init__(self, path: str, series: dict[str, list[list[int]]] | None = None) -> None:
+        """Initialize the index.
+
+        Arguments:
+            - path: path of the index file, e.g. 'comics.series.json'.
+            - series: the series of an existing index.
+
+        Returns:
+            Nothing.
+        """
+        self.path = path
+        self.series = series if series is not None else {}
+        self.count = sum(len(entries) for entries in self.series.values())
+
+    @classmethod
+    def load(cls, path: str) -> "SeriesIndex":
+        """Load an index from a file.
+
+        Arguments:
+            - path: path of the index file.
+
+        Returns:
+            The index.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(path, json.load(file))
+
+    def add(self, record_id: int, article_number: str) -> None:
+        """Add a record to the index.
+
+        Arguments:
+            - record_id: the id of the record.
+            - article_number: the article number of the record.
+
+        Returns:
+            Nothing.
+        """
+        prefix, issue = split_article_number(article_number)
+        # records without issue number come first
+        bisect.insort(self.series.setdefault(prefix, []),
+                      [issue if issue is not None else -1, record_id])
+
+    def write(self, record: dict) -> None:
+        """Add a record. Records get the ids 0, 1, 2... like in the JSON file.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            Nothing.
+        """
+        if record.get("Artikelnummer"):
+            self.add(self.count, record["Artikelnummer"])
+        self.count += 1
+
+    def close(self) -> None:
+        """Save the index.
+
+        Returns:
+            Nothing.
+        """
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.series, file)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def abort(self) -> None:
+        """Keep the old index, the run failed.
+
+        Returns:
+            Nothing.
+        """
+
+    def lookup(self, prefixes: str | typing.Iterable[str],
+               issues: range | None = None) -> list[int]:
+        """Get the record ids of one or more series.
+
+        Arguments:
+            - prefixes: the series prefix(es).
+            - issues: only these issue numbers (e.g. range(1, 11) or range(2, 11, 2)).
+
+        Returns:
+            The record ids, series after series and sorted by issue
+            (descending if the range steps backwards).
+        """
+        record_ids = []
+        for prefix in [prefixes] if isinstance(prefixes, str) else prefixes:
+            entries = self.series.get(prefix, [])
+            if issues is not None:
+                # the bounds are found by bisection, only the step needs a check per entry
+                if issues.step > 0:
+                    entries = entries[bisect.bisect_left(entries, [issues.start]):
+                                      bisect.bisect_left(entries, [issues.stop])]
+                else:
+                    entries = entries[bisect.bisect_left(entries, [issues.stop + 1]):
+                                      bisect.bisect_left(entries, [issues.start + 1])][::-1]
+                if abs(issues.step) != 1:
+                    entries = [entry for entry in entries if entry[0] in issues]
+            record_ids += [record_id for _, record_id in entries]
+        return record_ids
@@ -0,0 +1,174 @@
+"""Sharded crawls. The product links are split over N shards by a stable hash, so the shards can
+run on different hosts without talking to each other. Every shard writes its records together
+with their position on the checklist to a JSON Lines file; merging the files puts the records
+back in checklist order and drops duplicates:
+
+    python comics.py --shard 0/2        (on one host)
+    python comics.py --shard 1/2        (on another host)
+    python comics.py --merge-shards 2   (with both shard outputs)
+
+Every shard reads all checklist pages (a small part of the requests) to split the product links
+without coordination. To try it locally, record the site with --cache, serve it with standin.py
+and point the shards to it with --checklist-url.
+"""
+
+import heapq
+import json
+import os
+import typing
+import zlib
+
+import writer
+
+# records with the same value for one of these are the same comic
+MERGE_KEYS = ("Link", "Artikelnummer")
+
+
+def shard_of(key: str, shards: int) -> int:
+    """Get the shard of a key. The hash is stable across processes and hosts
+    (unlike hash(), which is salted per process).
+
+    Arguments:
+        - key: the key, e.g. a product link.
+        - shards: the number of shards.
+
+    Returns:
+        The shard (0 to shards - 1).
+    """
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse a shard like '0/4' (the first of four shards).
+
+    Arguments:
+        - value: the shard.
+
+    Returns:
+        The shard and the number of shards.
+    """
+    shard, _, shards = value.partition("/")
+    if not shard.isdigit() or not shards.isdigit() or int(shard) >= int(shards):
+        raise ValueError(f"invalid shard '{value}', expected e.g. '0/4'")
+    return int(shard), int(shards)
+
+
+def shard_path(path: str, shard: int, shards: int) -> str:
+    """Get the path of the output of a shard.
+
+    Arguments:
+        - path: path of the merged JSON file, e.g. 'comics.json'.
+        - shard: the shard.
+        - shards: the number of shards.
+
+    Returns:
+        The path, e.g. 'comics.shard-0-of-4.jsonl'.
+    """
+    return f"{os.path.splitext(path)[0]}.shard-{shard}-of-{shards}.jsonl"
+
+
+class ShardWriter:
+    """Writes the records of a shard with their positions to a JSON Lines file. The file only
+    gets its name when the shard is complete, so a failed shard cannot be merged by mistake.
+    """
+
+    def __init__(self, path: str,
+                 position: typing.Callable[[dict], typing.Sequence[int]]) -> None:
+        """Initialize the writer.
+
+        Arguments:
+            - path: path of the shard output.
+            - position: gets the position of a record on the checklist,
+            e.g. (page number, index on page).
+
+        Returns:
+            Nothing.
+        """
+        self.path = path
+        self.position = position
+        self.count = 0
+        # pylint: disable-next=consider-using-with
+        self.file = open(f"{path}.partial", "w", encoding="utf-8")
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: typing.Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, record: dict) -> None:
+        """Append a record.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            Nothing.
+        """
+        self.file.write(json.dumps({"position": list(self.position(record)),
+                                    "record": record}) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        """Close the file and give it its name.
+
+        Returns:
+            Nothing.
+        """
+        if not self.file.closed:
+            self.file.close()
+            os.replace(f"{self.path}.partial", self.path)
+
+    def abort(self) -> None:
+        """Close the file, it keeps the '.partial' suffix.
+
+        Returns:
+            Nothing.
+        """
+        self.file.close()
+
+
+def read(path: str) -> typing.Iterator[tuple[list[int], dict]]:
+    """Read the output of a shard one record at a time.
+
+    Arguments:
+        - path: path of the shard output.
+
+    Returns:
+        The positions and records.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                yield item["position"], item["record"]
+
+
+def merge(paths: typing.Iterable[str], catalog: writer.Sink,
+          keys: typing.Sequence[str] = MERGE_KEYS) -> tuple[int, int]:
+    """Merge the outputs of the shards in checklist order. Every shard output is already in
+    order, so they are merged while reading them.
+
+    Arguments:
+        - paths: paths of the shard outputs.
+        - catalog: the writer the records get written to.
+        - keys: records with the same value for one of these are written only once.
+
+    Returns:
+        The number of records written and of duplicates dropped.
+    """
+    seen: set[tuple[str, typing.Any]] = set()
+    count = duplicates = 0
+    for _, record in heapq.merge(*(read(path) for path in paths), key=lambda item: item[0]):
+        values = [(key, record[key]) for key in keys if record.get(key)]
+        if any(value in seen for value in values):
+            duplicates += 1
+            continue
+        seen.update(values)
+        catalog.write(record)
+        count += 1
+    return count, duplicates
@@ -0,0 +1,208 @@
+"""Indexed SQLite backend for the catalogs. The fields that get queried are stored in indexed
+columns and the list fields in a side table, so lookups are index seeks instead of full scans.
+The whole record is kept as JSON, so queries return the same dictionaries as TinyDB.
+"""
+
+import json
+import os
+import sqlite3
+import typing
+
+import series_index
+
+COMIC_FIELDS = {"title": "Titel", "article_number": "Artikelnummer", "isbn": "ISBN",
+                "release_date": "Erscheinungsdatum", "status": "Status", "price": "Preis"}
+COMIC_LIST_FIELDS = ("Autor", "Zeichner", "Charaktere", "Storys")
+NOVEL_FIELDS = {"title": "Title", "release_date": "Publication", "series": "Series"}
+NOVEL_LIST_FIELDS = ("Author", "Cover artist")
+SCHEMA = """
+CREATE TABLE records (
+    id INTEGER PRIMARY KEY,
+    title TEXT,
+    article_number TEXT,
+    isbn TEXT,
+    release_date TEXT,
+    status TEXT,
+    price REAL,
+    series TEXT,
+    issue INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX records_article_number ON records (article_number);
+CREATE INDEX records_isbn ON records (isbn);
+CREATE INDEX records_release_date ON records (release_date);
+CREATE INDEX records_status ON records (status);
+CREATE INDEX records_price ON records (price);
+CREATE INDEX records_series ON records (series, issue);
+CREATE TABLE list_values (
+    record_id INTEGER NOT NULL REFERENCES records (id),
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX list_values_value ON list_values (field, value);
+CREATE INDEX list_values_record ON list_values (record_id);
+"""
+
+
+class SQLiteCatalog:
+    """Catalog in a SQLite database. Can be used as a sink of writer.CatalogWriter,
+    the database is then built from scratch and replaces the old one when it is closed.
+    """
+
+    def __init__(self, path: str, fields: dict[str, str] | None = None,
+                 list_fields: typing.Iterable[str] = COMIC_LIST_FIELDS,
+                 create: bool = False) -> None:
+        """Open a catalog.
+
+        Arguments:
+            - path: path of the database.
+            - fields: which key of the records goes into which column.
+            - list_fields: keys of the records with lists that go into the side table.
+            - create: build a new database (in a temporary file until it is closed).
+
+        Returns:
+            Nothing.
+        """
+        self.path = path
+        self.fields = fields if fields is not None else COMIC_FIELDS
+        self.list_fields = tuple(list_fields)
+        self.create = create
+        if create:
+            if os.path.exists(f"{path}.tmp"):
+                os.remove(f"{path}.tmp")
+            self.connection = sqlite3.connect(f"{path}.tmp")
+            self.connection.executescript(SCHEMA)
+        else:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        self.count = 0
+
+    def write(self, record: dict) -> None:
+        """Add a record. Records get the ids 0, 1, 2... like in the JSON file.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            Nothing.
+        """
+        columns = {column: record.get(key) for column, key in self.fields.items()}
+        if "series" not in self.fields and columns.get("article_number"):
+            columns["series"], columns["issue"] = series_index.split_article_number(
+                columns["article_number"])
+        columns["id"] = self.count
+        columns["data"] = json.dumps(record)
+        self.connection.execute(
+            f"INSERT INTO records ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})", list(columns.values()))
+        self.connection.executemany(
+            "INSERT INTO list_values (record_id, field, position, value) VALUES (?, ?, ?, ?)",
+            [(self.count, field, position, value) for field in self.list_fields
+             for position, value in enumerate(record.get(field) or [])])
+        self.count += 1
+
+    def close(self) -> None:
+        """Commit and close the database. A new database replaces the old one.
+
+        Returns:
+            Nothing.
+        """
+        self.connection.commit()
+        self.connection.close()
+        if self.create:
+            os.replace(f"{self.path}.tmp", self.path)
+
+    def abort(self) -> None:
+        """Throw away a new database, e.g. because the run failed.
+
+        Returns:
+            Nothing.
+        """
+        self.connection.close()
+        if self.create:
+            os.remove(f"{self.path}.tmp")
+
+    def query(self, where: str = "", parameters: typing.Sequence[typing.Any] = (),
+              order: str = "id") -> list[dict]:
+        """Get the records matching a condition.
+
+        Arguments:
+            - where: the condition (SQL) on the columns of records.
+            - parameters: parameters for the condition.
+            - order: the columns to sort by.
+
+        Returns:
+            The records.
+        """
+        return [json.loads(data) for data, in self.connection.execute(
+            f"SELECT data FROM records {f'WHERE {where}' if where else ''} ORDER BY {order}",
+            parameters)]
+
+    def get(self, record_id: int) -> dict | None:
+        """Get a record by its id.
+
+        Arguments:
+            - record_id: the id.
+
+        Returns:
+            The record or None if there is none with this id.
+        """
+        records = self.query("id = ?", (record_id,))
+        return records[0] if records else None
+
+    def find(self, article_number: str | list[str] | None = None,
+             isbn: str | list[str] | None = None, status: str | list[str] | None = None,
+             series: str | list[str] | None = None, issues: range | None = None,
+             released: tuple[str, str] | None = None, price: tuple[float, float] | None = None,
+             title: str | None = None) -> list[dict]:
+        """Find records. All given filters have to match, lists mean any of the values.
+
+        Arguments:
+            - article_number: article number(s).
+            - isbn: ISBN(s).
+            - status: status(es), e.g. 'Lieferbar'.
+            - series: series prefix(es) of the article number or series name(s).
+            - issues: range of issue numbers (together with series).
+            - released: first and last release date (ISO 8601).
+            - price: lowest and highest price.
+            - title: SQL LIKE pattern for the title, e.g. 'Batgirl Megaband%'.
+
+        Returns:
+            The records, sorted by series and issue.
+        """
+        conditions = []
+        parameters: list[typing.Any] = []
+        for column, value in (("article_number", article_number), ("isbn", isbn),
+                              ("status", status), ("series", series)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            parameters += values
+        if issues is not None:
+            conditions.append("issue >= ? AND issue < ?")
+            parameters += [issues.start, issues.stop]
+        if released is not None:
+            conditions.append("release_date BETWEEN ? AND ?")
+            parameters += list(released)
+        if price is not None:
+            conditions.append("price BETWEEN ? AND ?")
+            parameters += list(price)
+        if title is not None:
+            conditions.append("title LIKE ?")
+            parameters.append(title)
+        return self.query(" AND ".join(conditions), parameters, "series, issue, id")
+
+    def with_value(self, field: str, value: str) -> list[dict]:
+        """Find records that have a value in a list field,
+        e.g. all comics with 'Batman' in 'Charaktere'.
+
+        Arguments:
+            - field: the list field.
+            - value: the value.
+
+        Returns:
+            The records.
+        """
+        return self.query("id IN (SELECT record_id FROM list_values "
+                          "WHERE field = ? AND value = ?)", (field, value))
@@ -0,0 +1,144 @@
+"""Local stand-in for a website that serves recorded responses from the http cache, e.g. to
+test halo_novels.py (and its API mode) without asking Halopedia:
+
+    python halo_novels.py --api --cache recorded
+    python standin.py recorded https://www.halopedia.org/ --port 8000
+    python halo_novels.py --api --base-url http://127.0.0.1:8000/
+
+Links to the website in the recorded pages and API responses point to the stand-in. Other
+websites the pages link to (e.g. the host of the cover images) can be served as well, under
+their host name:
+
+    python standin.py recorded https://paninishop.de/ --other-origin https://media.example/
+    python comics.py --checklist-url http://127.0.0.1:8000/checkliste/dc-comics/
+
+Links to 'https://media.example/a.jpg' then point to 'http://127.0.0.1:8000/media.example/a.jpg'.
+"""
+
+import argparse
+import http.server
+import logging
+import typing
+import urllib.parse
+
+import http_cache
+
+FORMATTER = logging.Formatter(fmt="[{asctime}] - {levelname:>8}: {message}",
+                              datefmt="%Y-%m-%dT%H:%M:%S", style="{")
+TEXT_TYPES = ("text/", "application/json", "application/javascript", "application/xml")
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    """Server that answers GET requests with the recorded responses of a website."""
+
+    def __init__(self, cache: http_cache.HTTPCache, origin: str, host: str = "127.0.0.1",
+                 port: int = 8000, other_origins: typing.Iterable[str] = ()) -> None:
+        """Initialize the server.
+
+        Arguments:
+            - cache: the cache with the recorded responses.
+            - origin: url of the recorded website, e.g. 'https://www.halopedia.org/'.
+            - host: address to listen on.
+            - port: port to listen on.
+            - other_origins: urls of other recorded websites, served under their host name
+            (e.g. 'https://media.example/' at '<url>media.example/').
+
+        Returns:
+            Nothing.
+        """
+        super().__init__((host, port), Handler)
+        self.cache = cache
+        self.origin = origin
+        self.url = f"http://{host}:{self.server_address[1]}/"
+        # url of every origin on the stand-in
+        self.urls = {origin: self.url}
+        for other in other_origins:
+            parts = urllib.parse.urlsplit(other)
+            self.urls[other] = f"{self.url}{parts.netloc}{parts.path}"
+
+    def recorded(self, path: str) -> tuple[str, bytes] | None:
+        """Get the recorded response for a path.
+
+        Arguments:
+            - path: the requested path with query, e.g. '/api.php?action=query&...'.
+
+        Returns:
+            The content type and the body or None if the url was not recorded.
+        """
+        requested = f"{self.url}{path.lstrip('/')}"
+        # the url of the website is a prefix of the urls of the others
+        origin, url = max(((origin, url) for origin, url in self.urls.items()
+                           if requested.startswith(url)), key=lambda item: len(item[1]))
+        entry = self.cache.get(f"{origin}{requested[len(url):]}")
+        if entry is None:
+            return None
+        content_type = entry.headers.get("Content-Type", "application/octet-stream")
+        body = entry.body()
+        if content_type.startswith(TEXT_TYPES):
+            for origin, url in self.urls.items():
+                # JSON may escape the slashes
+                for old, new in ((origin, url), (origin.replace("/", "\\/"),
+                                                 url.replace("/", "\\/"))):
+                    body = body.replace(old.encode("utf-8"), new.encode("utf-8"))
+        return content_type, body
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Answers a request with the recorded response or 404."""
+
+    server: StandIn
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Answer a GET request.
+
+        Returns:
+            Nothing.
+        """
+        recorded = self.server.recorded(self.path)
+        if recorded is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content_type, body = recorded
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # pylint: disable=redefined-builtin
+        logging.getLogger("standin").debug(format, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded responses of a website.")
+    parser.add_argument("cache", metavar="DIRECTORY",
+                        help="http cache with the recorded responses")
+    parser.add_argument("origin", help="url of the recorded website")
+    parser.add_argument("--other-origin", metavar="URL", action="append", default=[],
+                        help="url of another recorded website the pages link to, e.g. the "
+                        "host of the images (can be given more than once)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(FORMATTER)
+    logger = logging.getLogger("standin")
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    logger.addHandler(console_handler)
+    server = StandIn(http_cache.HTTPCache(args.cache, offline=True),
+                     args.origin if args.origin.endswith("/") else f"{args.origin}/",
+                     args.host, args.port,
+                     [origin if origin.endswith("/") else f"{origin}/"
+                      for origin in args.other_origin])
+    for origin, url in server.urls.items():
+        logger.info("Serving %s from %s at %s", origin, args.cache, url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,57 @@
+"""Tests for the delta between two runs."""
+
+import json
+import pathlib
+
+import delta
+
+COMICS = [{"Link": "https://example.com/a", "Titel": "A", "Preis": 9.99},
+          {"Link": "https://example.com/b", "Titel": "B", "Preis": 12.0},
+          {"Link": "https://example.com/c", "Titel": "C", "Preis": 5.5}]
+
+
+def run(directory: pathlib.Path, records: list[dict],
+        listed: set[str] | None = None) -> tuple[delta.DeltaIndex, list[dict]]:
+    """Write the records of one run.
+
+    Arguments:
+        - directory: directory of the hash index and the delta file.
+        - records: the records of the run.
+        - listed: keys of all records of the run or None.
+
+    Returns:
+        The index and the changes of the run.
+    """
+    index = delta.DeltaIndex(str(directory / "hashes.json"), str(directory / "delta.jsonl"),
+                             ("Link",))
+    for record in records:
+        index.write(record)
+    index.listed = listed
+    index.close()
+    with open(directory / "delta.jsonl", "r", encoding="utf-8") as file:
+        return index, [json.loads(line) for line in file]
+
+
+def test_failed_record_is_not_removed(tmp_path: pathlib.Path) -> None:
+    """A listed record whose page could not be fetched keeps its hashes; only records that
+    are not listed anymore are removed."""
+    run(tmp_path, COMICS)
+    index, changes = run(tmp_path, COMICS[:1], {"https://example.com/a", "https://example.com/b"})
+    assert changes == [{"change": "removed", "key": "https://example.com/c"}]
+    assert index.counts["missing"] == 1
+    with open(tmp_path / "hashes.json", "r", encoding="utf-8") as file:
+        assert set(json.load(file)) == {"https://example.com/a", "https://example.com/b"}
+
+    # fetched again, the record is unchanged and not added
+    index, changes = run(tmp_path, COMICS[:2], {"https://example.com/a", "https://example.com/b"})
+    assert changes == []
+    assert index.counts["unchanged"] == 2
+
+
+def test_changed_and_removed_without_listing(tmp_path: pathlib.Path) -> None:
+    """Without a listing every record that was not written is removed."""
+    run(tmp_path, COMICS)
+    _, changes = run(tmp_path, [COMICS[0] | {"Preis": 8.99}, COMICS[1]])
+    assert changes == [{"change": "changed", "key": "https://example.com/a",
+                        "fields": {"Preis": 8.99}, "removed_fields": []},
+                       {"change": "removed", "key": "https://example.com/c"}]
@@ -0,0 +1,200 @@
+"""Tests for sharded crawls: splitting the links and merging the shard outputs."""
+
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+import typing
+
+import pytest
+
+import comics
+import http_cache
+import shards
+import standin
+import writer
+
+# links on the checklist pages, by page number
+PAGES = {page: [f"https://paninishop.de/comic-{page}-{index}/" for index in range(37)]
+         for page in range(1, 4)}
+# the recorded website for the crawls, the covers are on another host
+ORIGIN = "https://paninishop.de/"
+IMAGES = "https://media.example/"
+COMICS_PER_PAGE = 4
+
+
+def comic(link: str) -> dict:
+    """Get the record of a comic.
+
+    Arguments:
+        - link: the link of the comic.
+
+    Returns:
+        The record.
+    """
+    return {"Titel": link.rsplit("/", 2)[1], "Link": link, "Artikelnummer": link[-6:-1]}
+
+
+def test_shard_of_is_stable() -> None:
+    """Shards do not depend on the process (unlike hash())."""
+    assert shards.shard_of("https://paninishop.de/comic-1-0/", 4) == \
+        shards.shard_of("https://paninishop.de/comic-1-0/", 4)
+    assert shards.parse_shard("1/4") == (1, 4)
+    with pytest.raises(ValueError):
+        shards.parse_shard("4/4")
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5])
+def test_shards_are_disjoint_and_complete(count: int) -> None:
+    """Every link is in exactly one shard."""
+    selected: list[str] = []
+    for shard in range(count):
+        apollo = comics.Apollo(shard=(shard, count))
+        for page_number, links in PAGES.items():
+            selected += apollo.select(page_number, links)
+    assert sorted(selected) == sorted(sum(PAGES.values(), []))
+
+
+@pytest.mark.parametrize("count", [2, 3])
+def test_merge_equals_unsharded_run(tmp_path: pathlib.Path, count: int) -> None:
+    """Merging the shard outputs gives the same catalog as a run without shards."""
+    with writer.CatalogWriter(str(tmp_path / "unsharded.json")) as catalog:
+        for links in PAGES.values():
+            for link in links:
+                catalog.write(comic(link))
+
+    paths = []
+    for shard in range(count):
+        apollo = comics.Apollo(shard=(shard, count))
+        path = shards.shard_path(str(tmp_path / "comics.json"), shard, count)
+        # the pages may arrive in any order, the comics are written in checklist order
+        selected = sum((apollo.select(page_number, PAGES[page_number])
+                        for page_number in sorted(PAGES, reverse=True)), [])
+        with shards.ShardWriter(path, lambda record, positions=apollo.positions:
+                                positions[record["Link"]]) as output:
+            for link in sorted(selected, key=apollo.positions.__getitem__):
+                output.write(comic(link))
+        paths.append(path)
+    with writer.CatalogWriter(str(tmp_path / "comics.json")) as catalog:
+        merged, duplicates = shards.merge(paths, catalog)
+
+    assert (merged, duplicates) == (sum(len(links) for links in PAGES.values()), 0)
+    with open(tmp_path / "unsharded.json", "rb") as unsharded, \
+            open(tmp_path / "comics.json", "rb") as file:
+        assert file.read() == unsharded.read()
+
+
+def test_merge_drops_duplicates_and_partial_shards(tmp_path: pathlib.Path) -> None:
+    """A comic that two shards wrote is merged once; a failed shard has no output."""
+    paths = [str(tmp_path / "a.jsonl"), str(tmp_path / "b.jsonl")]
+    for path, positions in zip(paths, ([(1, 0), (1, 2)], [(1, 1), (1, 2)])):
+        with shards.ShardWriter(path, lambda record: record["position"]) as output:
+            for position in positions:
+                output.write({"Link": f"link-{position[1]}", "position": position})
+    with pytest.raises(RuntimeError):
+        with shards.ShardWriter(str(tmp_path / "c.jsonl"), lambda record: (0, 0)) as output:
+            raise RuntimeError
+    assert not os.path.exists(tmp_path / "c.jsonl")
+
+    records: list[dict] = []
+
+    class Catalog:
+        """Keeps the merged records."""
+
+        def write(self, record: dict) -> None:
+            """Keep a record."""
+            records.append(record)
+
+        def close(self) -> None:
+            """Nothing to finish."""
+
+        def abort(self) -> None:
+            """Nothing to throw away."""
+
+    assert shards.merge(paths, Catalog()) == (3, 1)
+    assert [record["Link"] for record in records] == ["link-0", "link-1", "link-2"]
+
+
+def product(page: int, index: int) -> bytes:
+    """Get the product page of a recorded comic.
+
+    Arguments:
+        - page: the checklist page of the comic.
+        - index: the number of the comic on the page.
+
+    Returns:
+        The html of the page.
+    """
+    return f"""<html><body><h1 class="product--title"> Batman {page}-{index} </h1>
+<span class="image--element" data-img-original="{IMAGES}media/{page}-{index}.jpg"></span>
+<meta itemprop="price" content="{page + index}.99">
+<span class="delivery--text"> Lieferbar </span>
+<ul><li class="base-info--entry"><strong>Artikel-Nr.:</strong>
+<span> DPB3DC{page}{index:02d} </span></li></ul>
+<table><tr class="product--properties-row"><td class="product--properties-label">Storys:</td>
+<td class="product--properties-value">Batman {page}-{index + 2}</td></tr></table>
+</body></html>""".encode("utf-8")
+
+
+@pytest.fixture(name="server")
+def fixture_server(tmp_path: pathlib.Path) -> typing.Iterator[standin.StandIn]:
+    """A stand-in for the checklist, the product pages and the covers of a small run."""
+    cache = http_cache.HTTPCache(str(tmp_path / "recorded"), offline=True)
+    html = {"Content-Type": "text/html; charset=utf-8"}
+    checklist = f"{ORIGIN}checkliste/dc-comics/"
+    cache.store(f"{checklist}?o=1&n=100", 200, html,
+                b'<span class="paging--display">Seite 1 von <strong>2</strong></span>')
+    for page in (1, 2):
+        cache.store(f"{checklist}?o=1&p={page}&n=100", 200, html, "".join(
+            f'<a class="product--title" href="{ORIGIN}comic-{page}-{index}/?c=5">Batman</a>'
+            for index in range(COMICS_PER_PAGE)).encode("utf-8"))
+        for index in range(COMICS_PER_PAGE):
+            cache.store(f"{ORIGIN}comic-{page}-{index}/", 200, html, product(page, index))
+            cache.store(f"{IMAGES}media/{page}-{index}.jpg", 200,
+                        {"Content-Type": "image/jpeg"}, comics.JPG_MAGIC_NUMBER + bytes(
+                            [page, index]) * 64)
+    server = standin.StandIn(cache, ORIGIN, port=0, other_origins=[IMAGES])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def crawl(directory: pathlib.Path, *arguments: str) -> subprocess.Popen:
+    """Start comics.py in a directory of its own.
+
+    Arguments:
+        - directory: the directory the run writes to.
+        - arguments: the command line arguments.
+
+    Returns:
+        The process.
+    """
+    os.makedirs(directory / "logs", exist_ok=True)
+    # pylint: disable-next=consider-using-with
+    return subprocess.Popen([sys.executable, os.path.abspath(comics.__file__),
+                             "--max-concurrency", "2", *arguments], cwd=directory,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@pytest.mark.parametrize("count", [2, 3])
+def test_sharded_crawl_equals_unsharded_crawl(tmp_path: pathlib.Path, server: standin.StandIn,
+                                              count: int) -> None:
+    """Crawls of all shards of the stand-in, merged, give the same catalog as one crawl."""
+    checklist = f"{server.url}checkliste/dc-comics/"
+    assert crawl(tmp_path / "unsharded", "--checklist-url", checklist).wait(timeout=120) == 0
+    # the shards run at the same time, like on several machines
+    processes = [crawl(tmp_path / "sharded", "--shard", f"{shard}/{count}",
+                       "--checklist-url", checklist) for shard in range(count)]
+    assert [process.wait(timeout=120) for process in processes] == [0] * count
+    assert crawl(tmp_path / "sharded", "--merge-shards", str(count)).wait(timeout=120) == 0
+
+    with open(tmp_path / "unsharded" / "comics.json", "rb") as unsharded, \
+            open(tmp_path / "sharded" / "comics.json", "rb") as file:
+        catalog = unsharded.read()
+        assert file.read() == catalog
+    # every comic got its cover from the other host
+    assert catalog.count(b'"Bild": "/9j/') == 2 * COMICS_PER_PAGE
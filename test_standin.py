@@ -0,0 +1,95 @@
+"""Tests for the API mode of halo_novels.py against recorded responses served by standin.py."""
+
+import json
+import pathlib
+import threading
+import typing
+import urllib.parse
+
+import pytest
+import requests
+
+import fetch
+import halo_novels
+import http_cache
+import standin
+
+ORIGIN = halo_novels.HALOPEDIA_URL
+TITLES = ["Halo: The Fall of Reach", "Halo: The Flood"]
+
+
+def record(cache: http_cache.HTTPCache, parameters: dict[str, str], result: dict) -> None:
+    """Record an API response like api_query requests it.
+
+    Arguments:
+        - cache: the cache to record the response in.
+        - parameters: the parameters of the query (with continuation).
+        - result: the JSON of the response.
+
+    Returns:
+        Nothing.
+    """
+    parameters = {"action": "query", "format": "json", "formatversion": "2"} | parameters
+    # the MediaWiki API escapes the slashes of urls
+    body = json.dumps(result).replace("/", "\\/").encode("utf-8")
+    cache.store(f"{ORIGIN}api.php?{urllib.parse.urlencode(parameters)}", 200,
+                {"Content-Type": "application/json; charset=utf-8"}, body)
+
+
+def revision(title: str, date: str) -> dict:
+    """Get a page with the wikitext of a novel article.
+
+    Arguments:
+        - title: the title of the article.
+        - date: the publication date in the infobox.
+
+    Returns:
+        The page like the API returns it.
+    """
+    return {"title": title, "revisions": [{"slots": {"main": {
+        "content": f"{{{{Infobox book\n| name = {title}\n| release date = {date}\n}}}}"}}}]}
+
+
+@pytest.fixture(name="server")
+def fixture_server(tmp_path: pathlib.Path) -> typing.Iterator[standin.StandIn]:
+    """A stand-in for Halopedia with the recorded API responses of a small run."""
+    cache = http_cache.HTTPCache(str(tmp_path), offline=True)
+    query = {"titles": "|".join(TITLES), "redirects": "1", "prop": "revisions",
+             "rvprop": "content", "rvslots": "main"}
+    # the second page of the revisions only comes with the continuation
+    continuation = {"rvcontinue": "42|1337", "continue": "||"}
+    record(cache, query, {"continue": continuation, "query": {
+        "normalized": [{"from": TITLES[0], "to": TITLES[0]}],
+        "pages": [revision(TITLES[0], "October 1, 2001"), {"title": TITLES[1]}]}})
+    record(cache, query | continuation, {"query": {
+        "pages": [{"title": TITLES[0]}, revision(TITLES[1], "April 2, 2003")]}})
+    record(cache, {"titles": "File:Fall.jpg", "redirects": "1", "prop": "imageinfo",
+                   "iiprop": "url|mime"}, {"query": {"pages": [{
+                       "title": "File:Fall.jpg", "imageinfo": [{
+                           "url": f"{ORIGIN}images/a/ab/Fall.jpg", "mime": "image/jpeg"}]}]}})
+    server = standin.StandIn(cache, ORIGIN, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fetch.configure()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_continuation(server: standin.StandIn) -> None:
+    """The information of both novels is read, one of them only from the continuation."""
+    assert halo_novels.get_novels_information(TITLES, server.url) == {
+        TITLES[0]: ["2001-10-01"], TITLES[1]: ["2003-04-02"]}
+
+
+def test_escaped_urls(server: standin.StandIn) -> None:
+    """Escaped urls in the API responses point to the stand-in."""
+    assert halo_novels.get_image_urls(["Fall.jpg"], server.url) == {
+        "Fall.jpg": (f"{server.url}images/a/ab/Fall.jpg", "image/jpeg")}
+
+
+def test_not_recorded(server: standin.StandIn) -> None:
+    """Requests that were not recorded get a 404."""
+    with pytest.raises(requests.HTTPError):
+        list(halo_novels.api_query({"titles": "Halo: Ghosts of Onyx"}, server.url))
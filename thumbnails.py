@@ -0,0 +1,275 @@
+"""Thumbnails of the cover images. The originals are scaled down to a few widths (the notebooks
+show the covers 100 pixels wide) in a process pool and stored like the originals, together with
+the dimensions and sizes. An index remembers the thumbnails of every original by its hash, so
+they are only made again when the original (or the settings) change.
+"""
+
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import re
+import typing
+
+import PIL.Image
+
+import blobs
+import writer
+
+FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+MAX_PENDING = 64
+
+
+def make_thumbnails(image: bytes, widths: typing.Sequence[int], image_format: str = "jpeg",
+                    quality: int = 80) -> dict[str, typing.Any]:
+    """Scale an image down to some widths. Runs in the process pool.
+
+    Arguments:
+        - image: the original image.
+        - widths: the widths of the thumbnails (images are not scaled up).
+        - image_format: 'jpeg' or 'webp'.
+        - quality: quality of the thumbnails (1-100).
+
+    Returns:
+        Width, height and size in bytes of the original and the thumbnails
+        (with their data in 'image').
+    """
+    with PIL.Image.open(io.BytesIO(image)) as original:
+        width, height = original.size
+        sizes = sorted({(min(target, width), max(1, round(height * min(target, width) / width)))
+                        for target in widths})
+        # let the JPEG decoder scale down already, much faster than decoding everything
+        original.draft("RGB", sizes[-1])
+        source = original.convert("RGB")
+    thumbnails = []
+    for size in sizes:
+        buffer = io.BytesIO()
+        source.resize(size, PIL.Image.Resampling.LANCZOS).save(
+            buffer, FORMATS[image_format], quality=quality)
+        thumbnails.append({"width": size[0], "height": size[1],
+                           "bytes": buffer.tell(), "format": image_format,
+                           "image": buffer.getvalue()})
+    return {"width": width, "height": height, "bytes": len(image), "thumbnails": thumbnails}
+
+
+def pick(info: dict | None, width: int) -> dict | None:
+    """Get the smallest thumbnail that is at least as wide as needed.
+
+    Arguments:
+        - info: the thumbnail field of a record.
+        - width: the width the image is shown with.
+
+    Returns:
+        The thumbnail (the biggest one if none is wide enough) or None if there is none.
+    """
+    if not info or not info.get("thumbnails"):
+        return None
+    for thumbnail in info["thumbnails"]:
+        if thumbnail["width"] >= width:
+            return thumbnail
+    return info["thumbnails"][-1]
+
+
+class ThumbnailWriter:
+    """Adds thumbnails to the records on their way to the catalog. The thumbnails are made in
+    a process pool while the records keep coming; the records are written in the same order.
+    """
+
+    def __init__(self, catalog: writer.Sink, image_key: str, field: str,
+                 widths: typing.Sequence[int] = (100,), image_format: str = "jpeg",
+                 quality: int = 80, replace: bool = False,
+                 image_store: blobs.BlobStore | None = None,
+                 index_path: str = "thumbnails.json", workers: int | None = None,
+                 max_pending: int = MAX_PENDING) -> None:
+        """Initialize the writer. The process pool is started with the first thumbnail
+        that is not in the index.
+
+        Arguments:
+            - catalog: where the records go, e.g. a writer.CatalogWriter.
+            - image_key: key of the original image in the records.
+            - field: key the dimensions, sizes and thumbnails are stored under.
+            - widths: the widths of the thumbnails.
+            - image_format: 'jpeg' or 'webp'.
+            - quality: quality of the thumbnails (1-100).
+            - replace: replace the original with the biggest thumbnail in the records.
+            - image_store: store for the thumbnails (and the originals) or None to put them
+            into the records as base64 encoded strings.
+            - index_path: path of the index of the thumbnails by hash of the original.
+            - workers: number of processes, by default one per cpu.
+            - max_pending: maximum number of records waiting for their thumbnails.
+
+        Returns:
+            Nothing.
+        """
+        self.catalog = catalog
+        self.image_key = image_key
+        self.field = field
+        self.widths = sorted(set(widths))
+        self.image_format = image_format
+        self.quality = quality
+        self.replace = replace
+        self.image_store = image_store
+        self.index_path = index_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.settings = f"{image_format}:{quality}:{','.join(map(str, self.widths))}"
+        self.executor: concurrent.futures.ProcessPoolExecutor | None = None
+        self.pending: collections.deque[tuple[dict, str | None, typing.Any]] = \
+            collections.deque()
+        self.made = 0
+        self.reused = 0
+        try:
+            with open(index_path, "r", encoding="utf-8") as file:
+                self.index: dict[str, dict] = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    def __enter__(self) -> "ThumbnailWriter":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: typing.Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def original(self, value: str | None) -> tuple[str, bytes | None] | None:
+        """Get the hash and the data of an original image.
+
+        Arguments:
+            - value: the image field of the record (hash or base64 encoded image).
+
+        Returns:
+            The hash and the image (None if it does not have to be read, the hash is the key
+            of the store) or None if the record has no image.
+        """
+        if not value:
+            return None
+        if self.image_store is not None and re.fullmatch(r"[0-9a-f]{64}", value):
+            return value, None
+        image = base64.b64decode(value.encode("utf-8"))
+        return hashlib.sha256(image).hexdigest(), image
+
+    def is_current(self, source_hash: str) -> bool:
+        """Check whether the thumbnails of an original are in the index and still stored.
+
+        Arguments:
+            - source_hash: the hash of the original.
+
+        Returns:
+            True if the thumbnails do not have to be made again.
+        """
+        entry = self.index.get(source_hash)
+        if entry is None or entry.get("settings") != self.settings:
+            return False
+        return all(thumbnail["image"] in self.image_store if self.image_store is not None
+                   else not re.fullmatch(r"[0-9a-f]{64}", thumbnail["image"])
+                   for thumbnail in entry["thumbnails"])
+
+    def write(self, record: dict) -> None:
+        """Add a record. It is written once its thumbnails are done.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            Nothing.
+        """
+        original = self.original(record.get(self.image_key))
+        if original is None:
+            self.pending.append((record, None, None))
+        elif self.is_current(original[0]):
+            self.reused += 1
+            self.pending.append((record, original[0], None))
+        else:
+            image = original[1] if original[1] is not None \
+                else typing.cast(blobs.BlobStore, self.image_store).get(original[0])
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+            self.pending.append((record, original[0], self.executor.submit(
+                make_thumbnails, image, self.widths, self.image_format, self.quality)))
+        self.flush(block=len(self.pending) > self.max_pending)
+
+    def flush(self, block: bool = False) -> None:
+        """Write the records whose thumbnails are done, in order.
+
+        Arguments:
+            - block: wait until the number of pending records is below the maximum again.
+
+        Returns:
+            Nothing.
+        """
+        while self.pending:
+            record, source_hash, future = self.pending[0]
+            if future is not None and not future.done() and not (
+                    block and len(self.pending) > self.max_pending):
+                return
+            self.pending.popleft()
+            if future is not None:
+                try:
+                    self.store(typing.cast(str, source_hash), future.result())
+                except Exception:  # pylint: disable=broad-except
+                    # e.g. not an image Pillow can read; keep the record without thumbnails
+                    source_hash = None
+            if source_hash is not None:
+                info = {key: value for key, value in self.index[source_hash].items()
+                        if key != "settings"}
+                record = record | {self.field: info}
+                if self.replace and info["thumbnails"]:
+                    record[self.image_key] = info["thumbnails"][-1]["image"]
+            self.catalog.write(record)
+
+    def store(self, source_hash: str, info: dict[str, typing.Any]) -> None:
+        """Store new thumbnails and add them to the index.
+
+        Arguments:
+            - source_hash: the hash of the original.
+            - info: the result of make_thumbnails.
+
+        Returns:
+            Nothing.
+        """
+        for thumbnail in info["thumbnails"]:
+            thumbnail["image"] = self.image_store.put(thumbnail["image"]) \
+                if self.image_store is not None \
+                else base64.b64encode(thumbnail["image"]).decode("utf-8")
+        self.index[source_hash] = {"settings": self.settings} | info
+        self.made += 1
+
+    def close(self) -> None:
+        """Write the remaining records and save the index.
+
+        Returns:
+            Nothing.
+        """
+        while self.pending:
+            self.flush(block=True)
+            if self.pending:
+                concurrent.futures.wait([self.pending[0][2]])
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.save()
+
+    def abort(self) -> None:
+        """Give up because the run failed. Thumbnails that were made are kept in the index.
+
+        Returns:
+            Nothing.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        self.pending.clear()
+        self.save()
+
+    def save(self) -> None:
+        """Save the index.
+
+        Returns:
+            Nothing.
+        """
+        with open(f"{self.index_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.index, file)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
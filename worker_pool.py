@@ -0,0 +1,184 @@
+"""A process pool that is started once and used for every stage. The object whose methods do
+the work (e.g. Apollo) is handed to the workers once by the initializer, so a task only carries
+the name of the method and its arguments instead of a pickled bound method. Tasks are sent in
+batches whose size adapts to how long a task of the method takes: slow tasks (requests) go one
+by one, fast ones (e.g. cached responses) are batched to save messages between the processes.
+Every task of a batch succeeds or fails on its own.
+"""
+
+import collections
+import math
+import multiprocessing
+import multiprocessing.pool
+import time
+import typing
+
+# a batch should take about this many seconds in a worker
+BATCH_SECONDS = 0.05
+MAX_CHUNKSIZE = 64
+# batches waiting or running per worker
+BATCHES_PER_WORKER = 2
+# weight of the latest batch in the average duration of a task
+SMOOTHING = 0.3
+
+# the object whose methods are called, set once per worker
+TARGET: typing.Any = None
+
+
+def init(target: typing.Any, initializer: typing.Callable[..., None] | None,
+         initargs: typing.Iterable[typing.Any]) -> None:
+    """Set up a worker. Used as initializer of the pool.
+
+    Arguments:
+        - target: the object whose methods are called.
+        - initializer: function that sets up the rest of the process or None.
+        - initargs: arguments for the initializer.
+
+    Returns:
+        Nothing.
+    """
+    global TARGET  # pylint: disable=global-statement
+    TARGET = target
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def call(name: str, arguments: list[typing.Any], wrapper: str | None = None
+         ) -> tuple[float, list[tuple[bool, typing.Any]]]:
+    """Run a batch of tasks in a worker.
+
+    Arguments:
+        - name: name of the method of the target.
+        - arguments: the argument of every task.
+        - wrapper: name of a method of the target that runs the method instead, called with
+        the name, the method and the argument (e.g. Apollo.profiled), or None.
+
+    Returns:
+        The seconds the batch took and for every task whether it succeeded and its result
+        (the error message if it failed).
+    """
+    func = getattr(TARGET, name)
+    start = time.perf_counter()
+    outcomes: list[tuple[bool, typing.Any]] = []
+    for argument in arguments:
+        try:
+            outcomes.append((True, getattr(TARGET, wrapper)(name, func, argument)
+                             if wrapper is not None else func(argument)))
+        except Exception as excp:  # pylint: disable=broad-except
+            # the exception itself may not be picklable
+            outcomes.append((False, f"{excp.__class__.__name__}: {excp}"))
+    return time.perf_counter() - start, outcomes
+
+
+class WorkerPool:
+    """Process pool for the methods of one object."""
+
+    def __init__(self, target: typing.Any, processes: int,
+                 initializer: typing.Callable[..., None] | None = None,
+                 initargs: typing.Iterable[typing.Any] = ()) -> None:
+        """Start the pool.
+
+        Arguments:
+            - target: the object whose methods are called; sent to every worker once.
+            - processes: number of workers.
+            - initializer: function that sets up a worker or None.
+            - initargs: arguments for the initializer.
+
+        Returns:
+            Nothing.
+        """
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes, initializer=init,
+                                         initargs=(target, initializer, tuple(initargs)))
+        # average seconds of a task by method
+        self.seconds: dict[str, float] = {}
+        self.batches = 0
+        self.tasks = 0
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: typing.Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def chunksize(self, name: str, remaining: int) -> int:
+        """Get the size of the next batch.
+
+        Arguments:
+            - name: name of the method.
+            - remaining: number of tasks that were not sent yet.
+
+        Returns:
+            The number of tasks.
+        """
+        seconds = self.seconds.get(name)
+        # the first batches measure how long a task takes
+        if seconds is None:
+            return 1
+        # every worker gets a few batches, so none waits for the last big one
+        fair = math.ceil(remaining / (self.processes * 4))
+        by_time = int(BATCH_SECONDS / seconds) if seconds > 0 else MAX_CHUNKSIZE
+        return max(1, min(fair, by_time, MAX_CHUNKSIZE))
+
+    def imap(self, name: str, arguments: list[typing.Any], wrapper: str | None = None
+             ) -> typing.Iterator[tuple[typing.Any, bool, typing.Any]]:
+        """Call a method of the target for every argument in the workers.
+        Yields every result (in order) as soon as it is ready.
+
+        Arguments:
+            - name: name of the method.
+            - arguments: the argument of every task.
+            - wrapper: name of a method of the target that runs the method instead (see call)
+            or None.
+
+        Returns:
+            The arguments, whether the tasks succeeded and their results
+            (the error messages of failed tasks).
+        """
+        pending: collections.deque[tuple[list[typing.Any], multiprocessing.pool.AsyncResult]] = \
+            collections.deque()
+        position = 0
+        while True:
+            while position < len(arguments) \
+                    and len(pending) < self.processes * BATCHES_PER_WORKER:
+                batch = arguments[position:position + self.chunksize(
+                    name, len(arguments) - position)]
+                position += len(batch)
+                pending.append((batch, self.pool.apply_async(call, (name, batch, wrapper))))
+                self.batches += 1
+                self.tasks += len(batch)
+            if not pending:
+                return
+            batch, result = pending.popleft()
+            try:
+                seconds, outcomes = result.get()
+            except Exception as excp:  # pylint: disable=broad-except
+                # e.g. a result that could not be pickled, the whole batch is lost
+                outcomes = [(False, f"{excp.__class__.__name__}: {excp}")] * len(batch)
+            else:
+                average = seconds / len(batch)
+                self.seconds[name] = average if name not in self.seconds else \
+                    SMOOTHING * average + (1 - SMOOTHING) * self.seconds[name]
+            for argument, (succeeded, value) in zip(batch, outcomes):
+                yield argument, succeeded, value
+
+    def close(self) -> None:
+        """Let the workers finish and exit normally, so they send their last log records.
+
+        Returns:
+            Nothing.
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self) -> None:
+        """Stop the workers at once.
+
+        Returns:
+            Nothing.
+        """
+        self.pool.terminate()
+        self.pool.join()
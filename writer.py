@@ -0,0 +1,181 @@
+"""Streaming output for the catalogs. Records are appended to a JSON Lines file as soon as they
+are complete, so memory stays flat and a crash does not lose what was already fetched.
+Finalizing turns the JSON Lines file into the usual TinyDB layout ('{"_default": {...}}').
+"""
+
+import json
+import os
+import typing
+
+
+class Sink(typing.Protocol):
+    """Something else the records get written to, e.g. a database."""
+
+    def write(self, record: dict) -> None:
+        """Add a record."""
+
+    def close(self) -> None:
+        """Finish after all records were written."""
+
+    def abort(self) -> None:
+        """Give up because the run failed."""
+
+
+class CatalogWriter:
+    """Writes records to '<name>.jsonl' and finally to '<name>.json' in TinyDB layout."""
+
+    def __init__(self, path: str, sinks: list[Sink] | None = None) -> None:
+        """Initialize the writer and start a new JSON Lines file.
+
+        Arguments:
+            - path: path of the final JSON file, e.g. 'comics.json'.
+            - sinks: other outputs that get every record as well.
+
+        Returns:
+            Nothing.
+        """
+        self.path = path
+        self.sinks = sinks if sinks is not None else []
+        self.jsonl_path = f"{os.path.splitext(path)[0]}.jsonl"
+        self.count = 0
+        # pylint: disable-next=consider-using-with
+        self.file = open(self.jsonl_path, "w", encoding="utf-8")
+
+    def __enter__(self) -> "CatalogWriter":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: typing.Any) -> None:
+        # only finalize complete runs, otherwise keep the old JSON file
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            for sink in self.sinks:
+                sink.abort()
+
+    def write(self, record: dict) -> None:
+        """Append a record.
+
+        Arguments:
+            - record: the record.
+
+        Returns:
+            Nothing.
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        for sink in self.sinks:
+            sink.write(record)
+        self.count += 1
+
+    def close(self) -> None:
+        """Close the JSON Lines file and finalize the JSON file and the sinks.
+        If the JSON file cannot be finalized, the sinks are aborted instead.
+
+        Returns:
+            Nothing.
+        """
+        if not self.file.closed:
+            self.file.close()
+            try:
+                finalize(self.jsonl_path, self.path)
+            except BaseException:
+                for sink in self.sinks:
+                    sink.abort()
+                raise
+            for sink in self.sinks:
+                sink.close()
+
+
+def finalize(jsonl_path: str, path: str) -> int:
+    """Turn a JSON Lines file into the TinyDB layout, one record at a time.
+    The JSON file is replaced atomically, so it is never half written.
+
+    Arguments:
+        - jsonl_path: the JSON Lines file.
+        - path: the JSON file.
+
+    Returns:
+        The number of records.
+    """
+    count = 0
+    with open(jsonl_path, "r", encoding="utf-8") as source, \
+            open(f"{path}.tmp", "w", encoding="utf-8") as target:
+        target.write('{"_default": {')
+        for line in source:
+            if not line.strip():
+                continue
+            target.write(f'{", " if count else ""}"{count}": {line.strip()}')
+            count += 1
+        target.write("}}")
+    os.replace(f"{path}.tmp", path)
+    return count
+
+
+class OrderedWriter:
+    """Puts records that are completed out of order back in order before writing them.
+    Records are addressed by (group, index), e.g. (page number, position on page);
+    the number of records of a group has to be announced with expect.
+    """
+
+    def __init__(self, writer: Sink, first_group: int = 0) -> None:
+        """Initialize the ordered writer.
+
+        Arguments:
+            - writer: the writer to write to.
+            - first_group: number of the first group.
+
+        Returns:
+            Nothing.
+        """
+        self.writer = writer
+        self.counts: dict[int, int] = {}
+        self.pending: dict[tuple[int, int], dict | None] = {}
+        self.group = first_group
+        self.index = 0
+
+    def expect(self, group: int, count: int) -> None:
+        """Announce the number of records of a group.
+
+        Arguments:
+            - group: the group.
+            - count: the number of records.
+
+        Returns:
+            Nothing.
+        """
+        self.counts[group] = count
+        self.flush()
+
+    def put(self, group: int, index: int, record: dict | None) -> None:
+        """Add a record.
+
+        Arguments:
+            - group: the group of the record.
+            - index: the position of the record in its group.
+            - record: the record or None if it failed and should be skipped.
+
+        Returns:
+            Nothing.
+        """
+        self.pending[(group, index)] = record
+        self.flush()
+
+    def flush(self) -> None:
+        """Write all records that are next in order.
+
+        Returns:
+            Nothing.
+        """
+        while self.group in self.counts:
+            if self.index >= self.counts[self.group]:
+                del self.counts[self.group]
+                self.group += 1
+                self.index = 0
+                continue
+            if (self.group, self.index) not in self.pending:
+                return
+            record = self.pending.pop((self.group, self.index))
+            if record is not None:
+                self.writer.write(record)
+            self.index += 1